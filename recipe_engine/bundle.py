@@ -27,7 +27,8 @@ Some things that we'd want to do to make this better:
 Included files
 
 By default, bundle will include all recipes/ and recipe_modules/ files in your
-repo, plus the `recipes.cfg` file, and excluding all json expectation files.
+repo, plus the `recipes.cfg` file, and excluding all json expectation files
+(both `.json` and `.json.gz`).
 
 Recipe bundle also uses the standard `gitattributes` mechanism for tagging files
 within the repo, and will also include these files when generating the bundle.
@@ -42,6 +43,19 @@ example, you could put this in a `.gitattributes` file in your repo:
 That would include all .py files, but exclude all _test.py files. See the page
   `git help gitattributes`
 For more information on how gitattributes work.
+
+Precompiled bundles
+
+With `--precompile`, every .py file in the bundle is also compiled to a .pyc
+next to it, so that the first run on a fresh machine doesn't need to compile
+the engine, modules or recipes (the loader picks up up-to-date .pyc files for
+recipes too).
+
+Like python itself, the loader only considers a .pyc up to date if the mtime
+recorded in it matches the mtime of the .py file. The bundle must therefore be
+shipped in a way which preserves file mtimes (e.g. `tar` or `cp -p`); if the
+mtimes are reset when the bundle is unpacked, the .pyc files are ignored and
+everything is compiled from source as usual.
 """
 
 from __future__ import absolute_import
@@ -50,6 +64,7 @@ import io
 import logging
 import os
 import posixpath
+import py_compile
 import re
 import shutil
 import stat
@@ -105,8 +120,9 @@ def export_package(pkg, destination):
     '%srecipes/**' % reldir,            # all the recipes stuff
     '%srecipe_modules/**' % reldir,     # all the recipe_modules stuff
 
-    # And exclude all the json expectations
+    # And exclude all the json expectations, plain and compressed
     ':(exclude)%s**/*.expected/*.json' % reldir,
+    ':(exclude)%s**/*.expected/*.json.gz' % reldir,
   ]
   LOGGER.info('enumerating all recipe files: %r' % (args,))
   to_copy = subprocess.check_output(args).splitlines()
@@ -166,6 +182,26 @@ def prep_recipes_py(universe, root_package, destination):
     recipes_bat.write(u' %*\n')
 
 
+def precompile(destination):
+  """Compiles all the .py files under |destination| to .pyc files.
+
+  Files which aren't valid python 2 (e.g. resource scripts intended for
+  another interpreter) are skipped.
+  """
+  check(destination, str)
+
+  LOGGER.info('precompiling %s', destination)
+  for root, _dirs, files in os.walk(destination):
+    for f in files:
+      if not f.endswith('.py'):
+        continue
+      path = os.path.join(root, f)
+      try:
+        py_compile.compile(path, doraise=True)
+      except py_compile.PyCompileError as ex:
+        LOGGER.warning('not precompiling %s: %s', path, ex.msg)
+
+
 def add_subparser(parser):
   bundle_p = parser.add_parser(
     'bundle',
@@ -178,6 +214,12 @@ def add_subparser(parser):
     '--destination', default='./bundle',
     type=os.path.abspath,
     help='The directory of where to put the bundle (default: %(default)r).')
+  bundle_p.add_argument(
+    '--precompile', action='store_true',
+    help=(
+      'Also compile all python files in the bundle to bytecode, so that the'
+      ' bundle starts up without compiling anything. The bytecode is only used'
+      ' if the bundle is shipped preserving file mtimes.'))
 
   def postprocess_func(parser, _args):
     raw = subprocess.check_output([GIT, 'version'])
@@ -210,4 +252,6 @@ def main(package_deps, args):
   for pkg in universe.packages:
     export_package(pkg, destination)
   prep_recipes_py(universe, root_package, destination)
+  if args.precompile:
+    precompile(destination)
   LOGGER.info('done!')
@@ -6,17 +6,44 @@
 conditions inside tests, but with much more debugging information, including
 a smart selection of local variables mentioned inside of the call to check."""
 
+import __future__
 import ast
-import copy
+import hashlib
 import inspect
-import re
 import itertools
+import json
+import linecache
+import os
+import re
+import sys
 
-from collections import OrderedDict, deque, defaultdict, namedtuple
+from collections import OrderedDict, deque, namedtuple
 
 import astunparse
 
 from recipe_engine import test_result_pb2
+from recipe_engine import util
+
+
+# The compiler flags for all the __future__ features, so that statements can be
+# re-parsed with the same features as the file they came from.
+_FUTURE_FLAGS = reduce(
+    lambda flags, name: flags | getattr(__future__, name).compiler_flag,
+    __future__.all_feature_names, 0)
+
+# Directory of the on-disk statement index cache (see _load_statement_index),
+# or None to not cache the indexes on disk.
+_STATEMENT_CACHE_DIR = None
+
+# Bump this whenever the format of the cached statement indexes changes.
+_STATEMENT_CACHE_VERSION = 1
+
+
+def SetStatementCacheDir(path):
+  """Sets the directory where the statement indexes of the source files that
+  checks are made from are cached, or disables the cache if |path| is None."""
+  global _STATEMENT_CACHE_DIR
+  _STATEMENT_CACHE_DIR = path
 
 
 class CheckFrame(namedtuple('CheckFrame', 'fname line function code varmap')):
@@ -220,8 +247,8 @@ def render_re(regex):
 
 
 class Checker(object):
-  # filename -> {lineno -> [statements]}
-  _PARSED_FILE_CACHE = defaultdict(lambda: defaultdict(list))
+  # filename -> {lineno -> [statement code]}
+  _PARSED_FILE_CACHE = {}
 
   def __init__(self, filename, lineno, func, args, kwargs, *ignores):
     self.failed_checks = []
@@ -237,53 +264,24 @@ class Checker(object):
     self._ctx_args = map(repr, args)
     self._ctx_kwargs = {k: repr(v) for k, v in kwargs.iteritems()}
 
-  def _get_statements_for_frame(self, frame):
-    """This parses the file containing frame, and then extracts all simple
-    statements (i.e. those which do not contain other statements). It then
-    returns the list of all statements (as AST nodes) which occur on the line
-    number indicated by the frame.
+  def _get_statements_for_frame(self, raw_frame):
+    """Returns the code of all simple statements (i.e. those which do not
+    contain other statements) which occur on the line number indicated by the
+    frame.
 
-    The parse and statement extraction is cached in the _PARSED_FILE_CACHE class
-    variable, so multiple assertions in the same file only pay the parsing cost
-    once.
+    The statement index of each file is cached in the _PARSED_FILE_CACHE class
+    variable, so multiple assertions in the same file only pay the indexing cost
+    once (and on disk, see _load_statement_index).
     """
-    raw_frame, filename, lineno, _, _, _ = frame
-    if filename not in self._PARSED_FILE_CACHE:
-      # multi-statement nodes like Module, FunctionDef, etc. have attributes on
-      # them like 'body' which house the list of statements they contain. The
-      # `to_push` list here is the set of all such attributes across all ast
-      # nodes. The goal is to add the CONTENTS of all multi-statement statements
-      # to the queue, and anything else is considered a 'single statement' for
-      # the purposes of this code.
-      to_push = ['body', 'orelse', 'finalbody', 'excepthandler']
-      lines, _ = inspect.findsource(raw_frame)
-      # Start with the entire parsed document (probably ast.Module).
-      queue = deque([ast.parse(''.join(lines), filename)])
-      while queue:
-        node = queue.pop()
-        had_statements = False
-        # Try to find any nested statements and push them into queue if they
-        # exist.
-        for key in to_push:
-          val = getattr(node, key, MISSING)
-          if val is not MISSING:
-            had_statements = True
-            # Because we're popping things off the start of the queue, and we
-            # want to append nodes to _PARSED_FILE_CACHE, we reverse the
-            # statements when we extend the queue with them.
-            queue.extend(val[::-1])
-        if had_statements:
-          continue
-        # node is a 'simple' statement (doesn't contain any nested statements),
-        # so find it's maxiumum line-number (e.g. the line number that would
-        # show up in a stack trace), and add it to _PARSED_FILE_CACHE. Note that
-        # even though this is a simple statement, it could still span multiple
-        # lines.
-        max_line = max(map(lambda n: getattr(n, 'lineno', 0), ast.walk(node)))
-        self._PARSED_FILE_CACHE[filename][max_line].append(node)
-    return self._PARSED_FILE_CACHE[filename][lineno]
-
-  def _process_frame(self, frame, with_vars):
+    filename = raw_frame.f_code.co_filename
+    index = self._PARSED_FILE_CACHE.get(filename)
+    if index is None:
+      source = ''.join(linecache.getlines(filename, raw_frame.f_globals))
+      index = _load_statement_index(source, filename)
+      self._PARSED_FILE_CACHE[filename] = index
+    return index.get(raw_frame.f_lineno, [])
+
+  def _process_frame(self, raw_frame, with_vars):
     """This processes a stack frame into an expect_tests.CheckFrame, which
     includes file name, line number, function name (of the function containing
     the frame), the parsed statement at that line, and the relevant local
@@ -295,15 +293,21 @@ class Checker(object):
       * omit the overall step ordered dictionary
       * transform all subexpression values using render_user_value().
     """
-    nodes = self._get_statements_for_frame(frame)
-    raw_frame, filename, lineno, func_name, _, _ = frame
+    code = self._get_statements_for_frame(raw_frame)
 
     varmap = None
     if with_vars:
       varmap = {}
 
+      # Only the statements at this line are parsed again, with the same
+      # __future__ features as the code of the frame.
+      flags = ast.PyCF_ONLY_AST | (raw_frame.f_code.co_flags & _FUTURE_FLAGS)
+      nodes = []
+      for statement in code:
+        nodes.extend(compile(statement, '<check>', 'exec', flags, True).body)
+
       xfrmr = _checkTransformer(raw_frame.f_locals, raw_frame.f_globals)
-      xfrmd = xfrmr.visit(ast.Module(copy.deepcopy(nodes)))
+      xfrmd = xfrmr.visit(ast.Module(nodes))
 
       for n in itertools.chain(ast.walk(xfrmd), xfrmr.extras):
         if isinstance(n, _resolved):
@@ -318,10 +322,10 @@ class Checker(object):
             varmap[n.representation] = render_user_value(val)
 
     return CheckFrame(
-      filename,
-      lineno,
-      func_name,
-      '; '.join(astunparse.unparse(n).strip() for n in nodes),
+      raw_frame.f_code.co_filename,
+      raw_frame.f_lineno,
+      raw_frame.f_code.co_name,
+      '; '.join(code),
       varmap
     )
 
@@ -343,20 +347,21 @@ class Checker(object):
       # this check passed
       return
 
+    frames = []
     try:
-      frames = inspect.stack()[2:]
-
       # grab all frames which have self as a local variable (e.g. frames
-      # associated with this checker), excluding self.__call__.
-      try:
-        i = 0
-        for i, f in enumerate(frames):
-          if self not in f[0].f_locals.itervalues():
-            break
-        keep_frames = [self._process_frame(f, j == 0)
-                       for j, f in enumerate(frames[:i-1])]
-      finally:
-        del f
+      # associated with this checker), excluding self._call_impl and
+      # self.__call__. Only these frames are looked at, so walk them directly
+      # rather than building the whole stack with inspect.
+      f = sys._getframe(2)
+      while f is not None and self in f.f_locals.itervalues():
+        frames.append(f)
+        f = f.f_back
+      del f
+
+      # The outermost of these frames is the one which made this checker.
+      keep_frames = [self._process_frame(f, j == 0)
+                     for j, f in enumerate(frames[:-1])]
 
       # order it so that innermost frame is at the bottom
       keep_frames = keep_frames[::-1]
@@ -372,7 +377,7 @@ class Checker(object):
         False
       ))
     finally:
-      # avoid reference cycle as suggested by inspect docs.
+      # avoid reference cycle between the frames and their locals.
       del frames
 
   def __call__(self, arg1, arg2=None):
@@ -389,6 +394,89 @@ class Checker(object):
 MISSING = object()
 
 
+def _index_statements(source, filename):
+  """Parses |source|, and then extracts all simple statements (i.e. those which
+  do not contain other statements).
+
+  Returns {lineno: [statement code]}, where lineno is the last line of the
+  statement (i.e. the line number that would show up in a stack trace).
+  """
+  index = {}
+  # multi-statement nodes like Module, FunctionDef, etc. have attributes on
+  # them like 'body' which house the list of statements they contain. The
+  # `to_push` list here is the set of all such attributes across all ast
+  # nodes. The goal is to add the CONTENTS of all multi-statement statements
+  # to the queue, and anything else is considered a 'single statement' for
+  # the purposes of this code.
+  to_push = ['body', 'orelse', 'finalbody', 'excepthandler']
+  # Start with the entire parsed document (probably ast.Module).
+  queue = deque([ast.parse(source, filename)])
+  while queue:
+    node = queue.pop()
+    had_statements = False
+    # Try to find any nested statements and push them into queue if they
+    # exist.
+    for key in to_push:
+      val = getattr(node, key, MISSING)
+      if val is not MISSING:
+        had_statements = True
+        # Because we're popping things off the start of the queue, and we
+        # want to append nodes to the index, we reverse the statements when we
+        # extend the queue with them.
+        queue.extend(val[::-1])
+    if had_statements:
+      continue
+    # node is a 'simple' statement (doesn't contain any nested statements),
+    # so find it's maxiumum line-number (e.g. the line number that would
+    # show up in a stack trace), and add it to the index. Note that even
+    # though this is a simple statement, it could still span multiple lines.
+    max_line = max(map(lambda n: getattr(n, 'lineno', 0), ast.walk(node)))
+    index.setdefault(max_line, []).append(astunparse.unparse(node).strip())
+  return index
+
+
+def _load_statement_index(source, filename):
+  """Returns the statement index of |source| (see _index_statements).
+
+  Indexing a file means parsing and unparsing all of it, so if
+  SetStatementCacheDir was called, the indexes are cached on disk, keyed by the
+  hash of the source.
+  """
+  if _STATEMENT_CACHE_DIR is None:
+    return _index_statements(source, filename)
+
+  path = os.path.join(
+      _STATEMENT_CACHE_DIR, '%s.json' % hashlib.sha1(source).hexdigest())
+  try:
+    with open(path) as f:
+      data = json.load(f)
+    if data['version'] == _STATEMENT_CACHE_VERSION:
+      return {int(lineno): util.strip_unicode(code)
+              for lineno, code in data['statements'].iteritems()}
+  except (IOError, ValueError, KeyError, TypeError, AttributeError):
+    pass
+
+  index = _index_statements(source, filename)
+  # Write to a temporary file and rename it into place, so that concurrent
+  # test workers never observe a partially written index.
+  tmp_path = '%s.%d.tmp' % (path, os.getpid())
+  try:
+    if not os.path.isdir(_STATEMENT_CACHE_DIR):
+      os.makedirs(_STATEMENT_CACHE_DIR)
+    with open(tmp_path, 'w') as f:
+      json.dump({
+        'version': _STATEMENT_CACHE_VERSION,
+        'statements': index,
+      }, f)
+    if sys.platform.startswith(('win', 'cygwin')) and os.path.exists(path):
+      os.remove(path)
+    os.rename(tmp_path, path)
+  except (IOError, OSError):
+    # The cache is only an optimization.
+    pass
+  return index
+
+
 def VerifySubset(a, b):
   """Verify subset verifies that `a` is a subset of `b` where a and b are both
   JSON-ish types. They are also permitted to be OrderedDicts instead of
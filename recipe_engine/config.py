@@ -277,13 +277,24 @@ def config_item_context(CONFIG_SCHEMA):
 
 
 class AutoHide(object):
-  pass
+  # AutoHide is compared by identity, so copies must be AutoHide itself.
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, _memo):
+    return self
 AutoHide = AutoHide()
 
 
+# Returned by ConfigBase._render for objects which are hidden.
+_HIDDEN = object()
+
+
 class ConfigBase(object):
   """This is the root interface for all config schema types."""
 
+  __slots__ = ('_hidden_mode', '_inclusions')
+
   def __init__(self, hidden=AutoHide):
     """
     Args:
@@ -330,6 +341,22 @@ class ConfigBase(object):
       return self._is_default()
     return self._hidden_mode
 
+  def _render(self, want_default):
+    """Renders this object for as_jsonish(include_hidden=False) of its parent.
+
+    Args:
+      want_default (bool) - True iff the caller needs to know if this object is
+        the default value.
+
+    Returns (is_default, jsonish). is_default is None if it wasn't needed.
+    jsonish is _HIDDEN if this object is hidden.
+    """
+    is_default = None
+    if want_default or self._hidden_mode is AutoHide:
+      is_default = self._is_default()
+    hidden = is_default if self._hidden_mode is AutoHide else self._hidden_mode
+    return is_default, (_HIDDEN if hidden else self.as_jsonish())
+
   def schema_proto(self):
     """Returns a doc.Doc.Schema proto message for this config type."""
     raise NotImplementedError
@@ -376,6 +403,33 @@ class ConfigSchemaBase(object):
     raise NotImplementedError
 
 
+def _render_container(self, want_default):
+  """ConfigBase._render for ConfigGroup and ConfigList.
+
+  Their default-ness depends on all of their items, so it's computed while
+  rendering them (see _render_items), rather than walking them twice.
+  """
+  # pylint: disable=W0212
+  if self._hidden_mode is AutoHide:
+    is_default, ret = self._render_items(True)
+    return is_default, (_HIDDEN if is_default else ret)
+  if self._hidden_mode and not want_default:
+    return None, _HIDDEN
+  is_default, ret = self._render_items(want_default)
+  return is_default, (_HIDDEN if self._hidden_mode else ret)
+
+
+def _group_field(name):
+  """Returns the descriptor for the field |name| of a compiled ConfigGroup."""
+  def fget(self):
+    return self._type_map[name].get_val()
+  def fset(self, val):
+    self._type_map[name].set_val(val)
+  def fdel(self):
+    self._type_map[name].reset()
+  return property(fget, fset, fdel)
+
+
 class ConfigGroup(ConfigBase):
   """Allows you to provide hierarchy to a configuration schema.
 
@@ -388,34 +442,39 @@ class ConfigGroup(ConfigBase):
     )
     config_blob.some_item = "hello"
     config_blob.group.numbahs.update(range(10))
+
+  Constructing a ConfigGroup actually returns an instance of a subclass which
+  is compiled (once) for its set of field names. The subclass has a descriptor
+  per field, so that reading and writing fields doesn't need to go through
+  __getattribute__/__setattr__ hooks on every attribute access.
   """
 
+  __slots__ = ('_type_map',)
+
+  # (cls, frozenset(field names)) -> compiled subclass of cls
+  _COMPILED = {}
+
+  def __new__(cls, *_args, **type_map):
+    if not getattr(cls, '_IS_COMPILED', False):
+      key = (cls, frozenset(type_map).difference(('hidden',)))
+      compiled = ConfigGroup._COMPILED.get(key)
+      if compiled is None:
+        attrs = {name: _group_field(name) for name in key[1]}
+        attrs.update(__slots__=(), __module__=cls.__module__,
+                     _IS_COMPILED=True)
+        compiled = type(cls.__name__, (cls,), attrs)
+        ConfigGroup._COMPILED[key] = compiled
+      cls = compiled
+    return super(ConfigGroup, cls).__new__(cls)
+
   def __init__(self, hidden=AutoHide, **type_map):
     """Expects type_map to be {python_name -> ConfigBase} instance."""
     super(ConfigGroup, self).__init__(hidden)
     assert type_map, 'A ConfigGroup with no type_map is meaningless.'
 
-    object.__setattr__(self, '_type_map', type_map)
-    for name, typeval in self._type_map.iteritems():
+    for typeval in type_map.itervalues():
       typeAssert(typeval, ConfigBase)
-      object.__setattr__(self, name, typeval)
-
-  def __getattribute__(self, name):
-    obj = object.__getattribute__(self, name)
-    if isinstance(obj, ConfigBase):
-      return obj.get_val()
-    else:
-      return obj
-
-  def __setattr__(self, name, val):
-    obj = object.__getattribute__(self, name)
-    typeAssert(obj, ConfigBase)
-    obj.set_val(val)
-
-  def __delattr__(self, name):
-    obj = object.__getattribute__(self, name)
-    typeAssert(obj, ConfigBase)
-    obj.reset()
+    self._type_map = type_map
 
   def set_val(self, val):
     if isinstance(val, ConfigBase):
@@ -434,9 +493,25 @@ class ConfigGroup(ConfigBase):
       raise TypeError("Got extra keys while setting ConfigGroup: %s" % val)
 
   def as_jsonish(self, include_hidden=False):
-    return dict(
-      (n, v.as_jsonish(include_hidden)) for n, v in self._type_map.iteritems()
-        if include_hidden or not v._hidden)  # pylint: disable=W0212
+    if include_hidden:
+      return {n: v.as_jsonish(True) for n, v in self._type_map.iteritems()}
+    return self._render_items(False)[1]
+
+  def _render_items(self, want_default):
+    """Renders the visible fields, and whether all fields are default, in a
+    single walk of the tree."""
+    ret = {}
+    is_default = want_default
+    for n, v in self._type_map.iteritems():
+      # pylint: disable=W0212
+      v_default, val = v._render(is_default)
+      if is_default:
+        is_default = v_default
+      if val is not _HIDDEN:
+        ret[n] = val
+    return (is_default if want_default else None), ret
+
+  _render = _render_container
 
   def reset(self):
     for v in self._type_map.values():
@@ -560,8 +635,24 @@ class ConfigList(ConfigBase, collections.MutableSequence):
       self.append(item)
 
   def as_jsonish(self, include_hidden=False):
-    return [i.as_jsonish(include_hidden) for i in self.data
-            if include_hidden or not i._hidden]  # pylint: disable=W0212
+    if include_hidden:
+      return [i.as_jsonish(True) for i in self.data]
+    return self._render_items(False)[1]
+
+  def _render_items(self, want_default):
+    """See ConfigGroup._render_items."""
+    ret = []
+    is_default = want_default
+    for i in self.data:
+      # pylint: disable=W0212
+      i_default, val = i._render(is_default)
+      if is_default:
+        is_default = i_default
+      if val is not _HIDDEN:
+        ret.append(val)
+    return (is_default if want_default else None), ret
+
+  _render = _render_container
 
   def _is_default(self):
     # pylint: disable=W0212
@@ -5,6 +5,7 @@
 import abc
 import os
 import re
+import weakref
 
 from collections import namedtuple
 
@@ -26,6 +27,16 @@ def json_fixup(obj):
   raise TypeError("%r is not JSON serializable" % obj)
 
 
+def _check_pieces(pieces):
+  assert all(isinstance(x, basestring) for x in pieces), pieces
+  assert not any(x in ('..', '.', '/', '\\') for x in pieces)
+
+
+def _make_path(cls, base, pieces, platform_ext):
+  """Unpickles a Path (see Path.__reduce__)."""
+  return cls._make(base, pieces, platform_ext)  # pylint: disable=W0212
+
+
 class RecipeConfigType(object):
   """Base class for custom Recipe config types, intended to be subclassed.
 
@@ -47,6 +58,8 @@ class RecipeConfigType(object):
   uses data from the current recipe run, like the host os, to return platform
   specific strings using the data in the Path object.
   """
+  __slots__ = ()
+
   _TOSTRING_MAP = {}
 
   @property
@@ -145,9 +158,17 @@ class Path(RecipeConfigType):
   context (working directory) which goes into assembling a final OS-specific
   absolute path, we only store three context-free attributes in this Path
   object.
+
+  Paths are immutable, and are interned: creating a Path which is equal to a
+  live Path returns that same object.
   """
 
-  def __init__(self, base, *pieces, **kwargs):
+  __slots__ = ('base', 'pieces', 'platform_ext', '_hash', '__weakref__')
+
+  # (base, pieces, platform_ext items) -> Path
+  _INTERNED = weakref.WeakValueDictionary()
+
+  def __new__(cls, base, *pieces, **kwargs):
     """Creates a Path
 
     Args:
@@ -160,16 +181,28 @@ class Path(RecipeConfigType):
       platform_ext (dict(str, str)) - A mapping from platform name (as defined
         by the 'platform' module), to a suffix for the path.
     """
-    super(Path, self).__init__()
     assert isinstance(base, BasePath), base
-    assert all(isinstance(x, basestring) for x in pieces), pieces
-    assert not any(x in ('..', '.', '/', '\\') for x in pieces)
+    _check_pieces(pieces)
+    return cls._make(base, pieces, kwargs.get('platform_ext', {}))
 
-    self.base = base
-    self.pieces = pieces
-    self.platform_ext = kwargs.get('platform_ext', {})
+  @classmethod
+  def _make(cls, base, pieces, platform_ext):
+    """Returns the interned Path for the already validated arguments."""
+    key = (cls, base, pieces,
+           tuple(sorted(platform_ext.iteritems())) if platform_ext else ())
+    ret = cls._INTERNED.get(key)
+    if ret is None:
+      ret = object.__new__(cls)
+      ret.base = base
+      ret.pieces = pieces
+      ret.platform_ext = dict(platform_ext)
+      ret._hash = hash(key[1:])
+      cls._INTERNED[key] = ret
+    return ret
 
   def __eq__(self, other):
+    if self is other:
+      return True
     return (self.base == other.base and
             self.pieces == other.pieces and
             self.platform_ext == other.platform_ext)
@@ -177,6 +210,19 @@ class Path(RecipeConfigType):
   def __ne__(self, other):
     return not self == other
 
+  def __hash__(self):
+    return self._hash
+
+  # Paths are immutable, so copies may just be the same object.
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, _memo):
+    return self
+
+  def __reduce__(self):
+    return _make_path, (type(self), self.base, self.pieces, self.platform_ext)
+
   def join(self, *pieces, **kwargs):
     """Appends *pieces to this Path, returning a new Path.
 
@@ -194,8 +240,14 @@ class Path(RecipeConfigType):
     """
     if not pieces and not kwargs:
       return self
-    kwargs.setdefault('platform_ext', self.platform_ext)
-    return Path(self.base, *filter(bool, self.pieces + pieces), **kwargs)
+    pieces = tuple(p for p in pieces if p)
+    _check_pieces(pieces)
+    if '' in self.pieces:
+      base_pieces = tuple(p for p in self.pieces if p)
+    else:
+      base_pieces = self.pieces
+    return self._make(self.base, base_pieces + pieces,
+                      kwargs.get('platform_ext', self.platform_ext))
 
   def is_parent_of(self, child):
     """True if |child| is in a subdirectory of this path."""
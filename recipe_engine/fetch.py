@@ -16,8 +16,6 @@ import time
 from cStringIO import StringIO
 from collections import namedtuple
 
-import requests
-
 from google.protobuf import json_format
 
 from . import package_pb2
@@ -87,6 +85,17 @@ class Backend(object):
       cache[revision] = self._commit_metadata_impl(revision)
     return cache[revision]
 
+  def prime_commit_metadata(self, metadata):
+    """Adds a known CommitMetadata to the commit_metadata cache.
+
+    Args:
+      metadata (CommitMetadata) - metadata for a resolved revision of this
+        backend's repo.
+    """
+    self.assert_resolved(metadata.revision)
+    cache = self._GIT_METADATA_CACHE.setdefault(self.repo_url, {})
+    cache[metadata.revision] = metadata
+
   @classmethod
   def is_resolved_revision(cls, revision):
     return cls._COMMIT_RE.match(revision)
@@ -2,12 +2,20 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+from __future__ import absolute_import
 import collections
 import contextlib
+import functools
+import hashlib
 import imp
 import inspect
+import json
+import logging
+import marshal
 import os
+import struct
 import sys
+import types
 
 from .config import ConfigContext, ConfigGroupSchema
 from .config_types import Path, ModuleBasePath, PackageRepoBasePath
@@ -18,6 +26,10 @@ from .recipe_api import _UnresolvedRequirement
 from .recipe_api import BoundProperty
 from .recipe_api import UndefinedPropertyException, PROPERTY_SENTINEL
 from .recipe_test_api import RecipeTestApi, DisabledTestData
+from . import util
+
+
+LOGGER = logging.getLogger(__name__)
 
 
 @contextlib.contextmanager
@@ -119,8 +131,9 @@ class RecipeScript(object):
     recipe_globals = {}
     recipe_globals['__file__'] = script_path
 
+    code = _compile_recipe_script(script_path)
     with _temp_sys_path():
-      execfile(script_path, recipe_globals)
+      exec code in recipe_globals
 
     recipe_globals['LOADED_DEPS'] = universe_view.deps_from_spec(
         recipe_globals.get('DEPS', []))
@@ -128,9 +141,213 @@ class RecipeScript(object):
     return cls(name, recipe_globals, universe_view.package.name, script_path)
 
 
+def _rebase_code(code, filename):
+  """Returns |code| with co_filename set to |filename|, recursively.
+
+  Bytecode compiled elsewhere (e.g. in a bundle, see bundle.py) records the
+  path it was compiled at; this makes tracebacks point at the real file.
+  """
+  if code.co_filename == filename:
+    return code
+  consts = tuple(
+      _rebase_code(c, filename) if isinstance(c, types.CodeType) else c
+      for c in code.co_consts)
+  return types.CodeType(
+      code.co_argcount, code.co_nlocals, code.co_stacksize, code.co_flags,
+      code.co_code, consts, code.co_names, code.co_varnames, filename,
+      code.co_name, code.co_firstlineno, code.co_lnotab, code.co_freevars,
+      code.co_cellvars)
+
+
+def _compile_recipe_script(script_path):
+  """Returns the code object for the recipe at |script_path|.
+
+  If there's an up-to-date .pyc next to the recipe (like the ones produced by
+  `recipes.py bundle --precompile`), it's used instead of compiling the source.
+  """
+  try:
+    with open(script_path + 'c', 'rb') as f:
+      data = f.read()
+    # A python2 .pyc is the magic number, the source mtime, and then the
+    # marshalled code object.
+    if data[:4] == imp.get_magic():
+      mtime, = struct.unpack('<I', data[4:8])
+      if mtime == int(os.stat(script_path).st_mtime) & 0xFFFFFFFF:
+        return _rebase_code(marshal.loads(data[8:]), script_path)
+  except (IOError, OSError, EOFError, ValueError, TypeError, struct.error):
+    pass
+
+  # dont_inherit, so that this file's __future__ imports don't leak into the
+  # recipe.
+  with open(script_path, 'rU') as f:
+    return compile(f.read(), script_path, 'exec', 0, True)
+
+
+# Whether PackageManifest already warned about failing to write its cache.
+_MANIFEST_WRITE_WARNED = False
+
+
+class PackageManifest(object):
+  """The layout of a package's recipe modules and recipes on disk.
+
+  Discovering all of them means listing every directory in the package, which
+  (and stat'ing every entry) is slow on networked filesystems, so the result is
+  cached on disk. The cache is valid as long as none of the listed directories
+  changed its mtime or its list of entries. The mtime alone isn't enough, since
+  an entry added within the same mtime tick as the scan doesn't change it.
+  """
+
+  VERSION = 2
+
+  def __init__(self, recipes_dir, modules, recipes, dir_states):
+    """
+    Args:
+      recipes_dir (str): The package's recipes_dir.
+      modules (list([str, tree])): The recipe modules of the package, and the
+        tree of their python files (see _scan_import_tree).
+      recipes (list([str, str])): [path relative to recipes_dir, recipe name]
+        for every recipe in the package, in loop_over_recipes order.
+      dir_states (dict(str, [float, str]|None)): The mtime and the hash of the
+        sorted entries of every directory which was listed to build the
+        manifest (see _dir_state), or None if it didn't exist.
+    """
+    self.recipes_dir = recipes_dir
+    self.modules = modules
+    self.recipes = recipes
+    self._module_trees = dict(modules)
+    self._dir_states = dir_states
+
+  def module_names(self):
+    return [name for name, _ in self.modules]
+
+  def module_tree(self, name):
+    """Returns the tree of python files of the module |name|, or None."""
+    return self._module_trees.get(name)
+
+  def is_fresh(self):
+    return all(_dir_state(path) == state
+               for path, state in self._dir_states.iteritems())
+
+  @classmethod
+  def scan(cls, package):
+    """Builds the manifest for |package| from the filesystem."""
+    dir_states = {}
+    def note_dir(path):
+      dir_states[path] = _dir_state(path)
+
+    modules = []
+    note_dir(package.module_dir)
+    if dir_states[package.module_dir] is not None:
+      for item in os.listdir(package.module_dir):
+        subpath = os.path.join(package.module_dir, item)
+        if _is_recipe_module_dir(subpath):
+          modules.append([item, _scan_import_tree(subpath, note_dir)])
+        elif os.path.isdir(subpath):
+          # It becomes a module if someone adds an __init__.py.
+          note_dir(subpath)
+
+    def scan_directory(path, predicate):
+      for root, dirs, files in os.walk(path):
+        note_dir(root)
+        dirs[:] = [x for x in dirs
+                   if not x.endswith(('.expected', '.resources'))]
+        for file_name in (f for f in files if predicate(f)):
+          yield os.path.join(root, file_name)
+      if path not in dir_states:
+        dir_states[path] = None
+
+    recipes = []
+    path = package.recipe_dir
+    for recipe in scan_directory(
+        path, lambda f: f.endswith('.py') and f[0] != '_'):
+      recipes.append([recipe, recipe[len(path)+1:-len('.py')]])
+
+    for module_name, _ in modules:
+      module_dir = os.path.join(package.module_dir, module_name)
+      for subdir_name in ('tests', 'examples'):
+        subdir = os.path.join(module_dir, subdir_name)
+        for recipe in scan_directory(subdir, lambda f: f.endswith('.py')):
+          recipes.append([recipe, '%s:%s/%s' % (
+              module_name, subdir_name, recipe[len(subdir)+1:-len('.py')])])
+
+    recipes = [[os.path.relpath(recipe, package.recipes_dir), name]
+               for recipe, name in recipes]
+    return cls(package.recipes_dir, modules, recipes, dir_states)
+
+  @classmethod
+  def load(cls, package, cache_dir):
+    """Returns the manifest for |package|, from the cache in |cache_dir| if it's
+    still valid.
+
+    Otherwise the package is scanned, and the cache is updated.
+    """
+    path = os.path.join(cache_dir, '%s.json' % package.name)
+    try:
+      with open(path) as f:
+        data = json.load(f)
+      if (data['version'] == cls.VERSION and
+          data['recipes_dir'] == package.recipes_dir):
+        manifest = cls(
+            str(data['recipes_dir']),
+            util.strip_unicode(data['modules']),
+            util.strip_unicode(data['recipes']),
+            util.strip_unicode(data['dir_states']))
+        if manifest.is_fresh():
+          return manifest
+    except (IOError, ValueError, KeyError, TypeError):
+      pass
+
+    manifest = cls.scan(package)
+    manifest._save(path)
+    return manifest
+
+  def _save(self, path):
+    data = {
+      'version': self.VERSION,
+      'recipes_dir': self.recipes_dir,
+      'modules': self.modules,
+      'recipes': self.recipes,
+      'dir_states': self._dir_states,
+    }
+    # Write to a temporary file and rename it into place, so that concurrent
+    # invocations never observe a partially written manifest.
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+      if sys.platform.startswith(('win', 'cygwin')) and os.path.exists(path):
+        os.remove(path)
+      os.rename(tmp_path, path)
+    except (IOError, OSError):
+      # The manifest is only an optimization. If the cache can't be written
+      # (e.g. in a read-only checkout) this fails for every package, so only
+      # warn about it once.
+      global _MANIFEST_WRITE_WARNED
+      if _MANIFEST_WRITE_WARNED:
+        LOGGER.debug('Failed to write module manifest %r', path, exc_info=True)
+      else:
+        _MANIFEST_WRITE_WARNED = True
+        LOGGER.warning(
+            'Failed to write module manifest %r', path, exc_info=True)
+
+
+def _dir_state(path):
+  """Returns [mtime, hash of the sorted entries] of the directory |path|, or
+  None if it doesn't exist."""
+  try:
+    mtime = os.stat(path).st_mtime
+    entries = sorted(os.listdir(path))
+  except OSError:
+    return None
+  return [mtime, hashlib.sha1('\0'.join(entries)).hexdigest()]
+
+
 class RecipeUniverse(object):
   def __init__(self, package_deps, config_file):
     self._loaded = {}
+    self._manifests = {}
     self._package_deps = package_deps
     self._config_file = config_file
 
@@ -156,6 +373,15 @@ class RecipeUniverse(object):
   def package_deps(self):
     return self._package_deps
 
+  def manifest(self, package):
+    """Returns the PackageManifest for |package|."""
+    if package.name not in self._manifests:
+      cache_dir = os.path.join(
+          self._package_deps.root_package.recipes_dir, '.recipe_deps',
+          '.manifests')
+      self._manifests[package.name] = PackageManifest.load(package, cache_dir)
+    return self._manifests[package.name]
+
   def load(self, package, name):
     """Load a recipe module, identified by a name inside of a package"""
     key = (package.name, name)
@@ -181,14 +407,10 @@ class RecipeUniverse(object):
       return mod
 
   def loop_over_recipe_modules(self):
-    """Yields pairs (package, module path)."""
+    """Yields pairs (package, module name)."""
     for package in self.packages:
-      path = package.module_dir
-      if os.path.isdir(path):
-        for item in os.listdir(path):
-          subpath = os.path.join(path, item)
-          if _is_recipe_module_dir(subpath):
-            yield package, os.path.basename(subpath)
+      for name in self.manifest(package).module_names():
+        yield package, name
 
 
 class UniverseView(collections.namedtuple('UniverseView', 'universe package')):
@@ -340,37 +562,14 @@ class UniverseView(collections.namedtuple('UniverseView', 'universe package')):
     Enumerates real recipes in recipes/*, as well as examples in
     recipe_modules/*.
     """
-    def scan_directory(path, predicate):
-      for root, dirs, files in os.walk(path):
-        dirs[:] = [x for x in dirs
-                   if not x.endswith(('.expected', '.resources'))]
-        for file_name in (f for f in files if predicate(f)):
-          file_path = os.path.join(root, file_name)
-          yield file_path
-
-    path = self.package.recipe_dir
-    for recipe in scan_directory(
-        path, lambda f: f.endswith('.py') and f[0] != '_'):
-      yield recipe, recipe[len(path)+1:-len('.py')]
-
-    for module_name in self.loop_over_recipe_modules():
-      module_dir = os.path.join(self.package.module_dir, module_name)
-
-      for subdir_name in ('tests', 'examples'):
-        subdir = os.path.join(module_dir, subdir_name)
-        if os.path.exists(subdir):
-          for recipe in scan_directory(subdir, lambda f: f.endswith('.py')):
-            yield recipe, '%s:%s/%s' % (
-                module_name, subdir_name, recipe[len(subdir)+1:-len('.py')])
+    manifest = self.universe.manifest(self.package)
+    for relpath, name in manifest.recipes:
+      yield os.path.join(self.package.recipes_dir, relpath), name
 
   def loop_over_recipe_modules(self):
-    """Yields the paths to all the modules that this view can see."""
-    path = self.package.module_dir
-    if os.path.isdir(path):
-      for item in os.listdir(path):
-        subpath = os.path.join(path, item)
-        if _is_recipe_module_dir(subpath):
-          yield os.path.basename(subpath)
+    """Yields the names of all the modules that this view can see."""
+    for name in self.universe.manifest(self.package).module_names():
+      yield name
 
 
 def _amend_exception(e, amendment):
@@ -412,30 +611,55 @@ def _load_recipe_module_module(path, universe_view):
   # Prevent any modules that mess with sys.path from leaking.
   with _temp_sys_path():
     sys.modules['%s.DEPS' % fullname] = mod.LOADED_DEPS
+    tree = universe_view.universe.manifest(universe_view.package).module_tree(
+        modname)
+    if tree is None:
+      tree = _scan_import_tree(path)
     _recursive_import(
-        path, '%s.%s' % (RECIPE_MODULE_PREFIX, universe_view.package.name))
+        path, '%s.%s' % (RECIPE_MODULE_PREFIX, universe_view.package.name),
+        tree)
     _patchup_module(modname, mod, universe_view)
 
   return mod
 
 
-def _recursive_import(path, prefix):
-  modname = os.path.splitext(os.path.basename(path))[0]
-  fullname = '%s.%s' % (prefix, modname)
-  mod = _find_and_load_module(fullname, modname, path)
-  if not os.path.isdir(path):
-    return mod
+def _scan_import_tree(path, note_dir=lambda _path: None):
+  """Returns the tree of python files which _recursive_import imports for the
+  package directory |path|.
 
+  The tree is a list of [name, subtree] for the entries of |path|, where
+  subtree is None for .py files and the tree of the subdirectory otherwise.
+
+  note_dir is called with every directory which is examined.
+  """
+  note_dir(path)
+  tree = []
   for subitem in os.listdir(path):
     subpath = os.path.join(path, subitem)
-    subname = os.path.splitext(subitem)[0]
     if os.path.isdir(subpath):
       if not os.path.exists(os.path.join(subpath, '__init__.py')):
+        note_dir(subpath)
         continue
-    elif not subpath.endswith('.py') or subitem.startswith('__init__.py'):
-      continue
+      tree.append([subitem, _scan_import_tree(subpath, note_dir)])
+    elif subpath.endswith('.py') and not subitem.startswith('__init__.py'):
+      tree.append([subitem, None])
+  return tree
+
+
+def _recursive_import(path, prefix, tree):
+  """Imports |path|, and everything in its |tree| (see _scan_import_tree).
+
+  |tree| is None if |path| is a .py file.
+  """
+  modname = os.path.splitext(os.path.basename(path))[0]
+  fullname = '%s.%s' % (prefix, modname)
+  mod = _find_and_load_module(fullname, modname, path)
 
-    submod = _recursive_import(subpath, fullname)
+  for subitem, subtree in tree or ():
+    subpath = os.path.join(path, subitem)
+    subname = os.path.splitext(subitem)[0]
+
+    submod = _recursive_import(subpath, fullname, subtree)
 
     if not hasattr(mod, subname):
       setattr(mod, subname, submod)
@@ -515,6 +739,7 @@ def _patchup_module(name, submod, universe_view):
       prop_name: value.bind(prop_name, BoundProperty.MODULE_PROPERTY,
                             full_decl_name)
       for prop_name, value in getattr(submod, 'PROPERTIES', {}).items()}
+  submod.API_BINDING_PLAN = make_binding_plan(submod.API, submod.PROPERTIES)
 
 
 class DependencyMapper(object):
@@ -554,14 +779,28 @@ class DependencyMapper(object):
     return self._instances[mod]
 
 
-def _invoke_with_properties(callable_obj, all_props, environ, prop_defs,
-                            arg_names, **additional_args):
-  """Internal version of invoke_with_properties.
+# A precomputed recipe for binding properties to the arguments of a callable
+# (see make_binding_plan).
+#
+# args (tuple((param_name, prop_name|None, BoundProperty|None))): One entry
+#   per argument of the callable, in order. The property is None if there's no
+#   property for that argument, in which case it must be passed explicitly.
+BindingPlan = collections.namedtuple('BindingPlan', 'callable_obj args')
 
-  The main difference is it gets passed the argument names as `arg_names`.
-  This allows us to reuse this logic elsewhere, without defining a fake function
-  which has arbitrary argument names.
-  """
+
+def _arg_names(callable_obj):
+  # To detect when they didn't specify a property that they have as a
+  # function argument, list the arguments, through inspection,
+  # and then comparing this list to the provided properties.
+  if inspect.isclass(callable_obj):
+    arg_names = inspect.getargspec(callable_obj.__init__).args
+    arg_names.pop(0)  # 'self'
+  else:
+    arg_names = inspect.getargspec(callable_obj).args
+  return arg_names
+
+
+def _make_binding_plan(callable_obj, prop_defs, arg_names):
   for name, prop in prop_defs.iteritems():
     if not isinstance(prop, BoundProperty):
       raise ValueError(
@@ -573,28 +812,59 @@ def _invoke_with_properties(callable_obj, all_props, environ, prop_defs,
     prop.param_name: name for name, prop in prop_defs.iteritems()
   }
 
+  args = []
+  for param_name in arg_names:
+    prop_name = param_name_mapping.get(param_name)
+    args.append((param_name, prop_name, prop_defs.get(prop_name)))
+  return BindingPlan(callable_obj, tuple(args))
+
+
+def make_binding_plan(callable_obj, prop_defs):
+  """Precomputes how invoke_with_properties would call |callable_obj|.
+
+  The returned plan can be used with invoke_with_plan any number of times,
+  without redoing the introspection and validation of the properties.
+
+  Args:
+    callable_obj: The function to call, or class to instantiate.
+    prop_defs: A dictionary of property name to property definitions
+               (BoundProperty) for this callable.
+
+  Returns a BindingPlan.
+  """
+  return _make_binding_plan(callable_obj, prop_defs, _arg_names(callable_obj))
+
+
+def invoke_with_plan(plan, all_props, environ, **additional_args):
+  """Like invoke_with_properties, but with a plan from make_binding_plan."""
   props = []
 
-  for param_name in arg_names:
+  for param_name, prop_name, prop in plan.args:
     if param_name in additional_args:
       props.append(additional_args.pop(param_name))
       continue
 
-    if param_name not in param_name_mapping:
+    if prop is None:
       raise UndefinedPropertyException(
           "Missing property definition for parameter '{}'.".format(param_name))
 
-    prop_name = param_name_mapping[param_name]
-
-    if prop_name not in prop_defs:
-      raise UndefinedPropertyException(
-          "Missing property value for '{}'.".format(prop_name))
-
-    prop = prop_defs[prop_name]
     props.append(
         prop.interpret(all_props.get(prop_name, PROPERTY_SENTINEL), environ))
 
-  return callable_obj(*props, **additional_args)
+  return plan.callable_obj(*props, **additional_args)
+
+
+def _invoke_with_properties(callable_obj, all_props, environ, prop_defs,
+                            arg_names, **additional_args):
+  """Internal version of invoke_with_properties.
+
+  The main difference is it gets passed the argument names as `arg_names`.
+  This allows us to reuse this logic elsewhere, without defining a fake function
+  which has arbitrary argument names.
+  """
+  return invoke_with_plan(
+      _make_binding_plan(callable_obj, prop_defs, arg_names),
+      all_props, environ, **additional_args)
 
 
 def invoke_with_properties(callable_obj, all_props, environ, prop_defs,
@@ -602,6 +872,9 @@ def invoke_with_properties(callable_obj, all_props, environ, prop_defs,
   """
   Invokes callable with filtered, type-checked properties.
 
+  If the same callable is invoked repeatedly, prefer make_binding_plan and
+  invoke_with_plan.
+
   Args:
     callable_obj: The function to call, or class to instantiate.
                   This supports passing in either RunSteps, or a recipe module,
@@ -620,36 +893,43 @@ def invoke_with_properties(callable_obj, all_props, environ, prop_defs,
     The result of calling callable with the filtered properties
     and additional arguments.
   """
-  # To detect when they didn't specify a property that they have as a
-  # function argument, list the arguments, through inspection,
-  # and then comparing this list to the provided properties. We use a list
-  # instead of a dict because getargspec returns a list which we would have to
-  # convert to a dictionary, and the benefit of the dictionary is pretty small.
-  if inspect.isclass(callable_obj):
-    arg_names = inspect.getargspec(callable_obj.__init__).args
-    arg_names.pop(0)  # 'self'
-  else:
-    arg_names = inspect.getargspec(callable_obj).args
   return _invoke_with_properties(callable_obj, all_props, environ, prop_defs,
-                                 arg_names, **additional_args)
+                                 _arg_names(callable_obj), **additional_args)
 
 
 def create_recipe_api(toplevel_package, toplevel_deps, recipe_script_path,
                       engine, test_data=DisabledTestData()):
-  def instantiator(mod, deps):
+  # Modules are instantiated lazily, the first time they're accessed through
+  # `api.<dep>` or `api.m.<dep>` (see ModuleInjectionSite.inject_lazy). A
+  # module's dependencies are therefore always initialized before it uses them,
+  # and the initialization order only depends on what the recipe does.
+  instances = {}
+
+  def instantiate(mod):
+    if mod not in instances:
+      instances[mod] = instantiator(mod)
+    return instances[mod]
+
+  def instantiate_test_api(mod):
+    return instantiate(mod).test_api
+
+  def inject_deps(mod_api, deps):
+    for k, v in deps.iteritems():
+      mod_api.m.inject_lazy(k, v, functools.partial(instantiate, v))
+      mod_api.test_api.m.inject_lazy(
+          k, v, functools.partial(instantiate_test_api, v))
+
+  def instantiator(mod):
     kwargs = {
       'module': mod,
       # TODO(luqui): test_data will need to use canonical unique names.
       'test_data': test_data.get_module_test_data(mod.NAME)
     }
-    prop_defs = mod.PROPERTIES
-    mod_api = invoke_with_properties(
-        mod.API, engine.properties, engine.environ, prop_defs, **kwargs)
+    mod_api = invoke_with_plan(
+        mod.API_BINDING_PLAN, engine.properties, engine.environ, **kwargs)
     mod_api.test_api = (getattr(mod, 'TEST_API', None)
                         or RecipeTestApi)(module=mod)
-    for k, v in deps.iteritems():
-      setattr(mod_api.m, k, v)
-      setattr(mod_api.test_api.m, k, v.test_api)
+    inject_deps(mod_api, mod.LOADED_DEPS)
     setattr(mod_api.m, mod.NAME, mod_api)
     setattr(mod_api.test_api.m, mod.NAME, mod_api.test_api)
 
@@ -662,7 +942,6 @@ def create_recipe_api(toplevel_package, toplevel_deps, recipe_script_path,
     mod_api.initialize()
     return mod_api
 
-  mapper = DependencyMapper(instantiator)
   # Provide a fake module to the ScriptApi so that recipes can use:
   #   * .name
   #   * .resource
@@ -688,7 +967,7 @@ def create_recipe_api(toplevel_package, toplevel_deps, recipe_script_path,
   api = RecipeScriptApi(module=fakeModule, engine=engine,
                   test_data=test_data.get_module_test_data(None))
   for k, v in toplevel_deps.iteritems():
-    setattr(api, k, mapper.instantiate(v))
+    api.inject_lazy(k, v, functools.partial(instantiate, v))
 
   # Always instantiate the path module at least once so that string functions on
   # Path objects work. This extra load doesn't actually attach the loaded path
@@ -697,7 +976,7 @@ def create_recipe_api(toplevel_package, toplevel_deps, recipe_script_path,
   # (somewhere, could be transitively), then this extra load is a no-op.
   # TODO(iannucci): The way paths work need to be reimplemented sanely :/
   path_spec = engine._universe_view.deps_from_spec(['recipe_engine/path'])
-  mapper.instantiate(path_spec['path'])
+  instantiate(path_spec['path'])
 
   return api
 
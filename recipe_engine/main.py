@@ -18,25 +18,21 @@ reload(sys)
 sys.setdefaultencoding('UTF8')
 
 import argparse
+import importlib
 import logging
 import os
 import shutil
 import subprocess
 import tempfile
 
-import urllib3.contrib.pyopenssl
-urllib3.contrib.pyopenssl.inject_into_urllib3()
-
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, ROOT_DIR)
 
 from recipe_engine import common_args, package, package_io, util
 
-from recipe_engine import fetch, lint, bundle, depgraph, analyze, autoroll
-from recipe_engine import manual_roll, refs, doc, test, run
-
 
-# Each of these subcommands has a method:
+# Each of these subcommands is implemented by a module in recipe_engine which
+# has a method:
 #
 #   def add_subparsers(argparse._SubParsersAction): ...
 #
@@ -64,22 +60,64 @@ from recipe_engine import manual_roll, refs, doc, test, run
 #
 #   def main(package_deps, args):
 #     print args.cool_arg
+#
+# The modules are only imported when needed (see _find_subcommand), since some
+# of them pull in heavy dependencies (e.g. coverage, multiprocessing).
 _SUBCOMMANDS = [
-  run,
-  test,
-
-  analyze,
-  autoroll,
-  manual_roll,
-  bundle,
-  depgraph,
-  doc,
-  fetch,
-  lint,
-  refs,
+  'run',
+  'test',
+
+  'analyze',
+  'autoroll',
+  'manual_roll',
+  'bundle',
+  'depgraph',
+  'doc',
+  'fetch',
+  'lint',
+  'refs',
 ]
 
 
+def _find_subcommand(argv):
+  """Returns the name of the subcommand selected by argv, or None if it can't
+  be determined without loading all of them (e.g. for the top-level --help).
+
+  This is only a guess; main() double checks it against the parsed args.
+  """
+  for arg in argv:
+    if arg in ('-h', '--help'):
+      return None
+    if arg in _SUBCOMMANDS:
+      return arg
+  return None
+
+
+def _make_parser(subcommands):
+  """Returns an ArgumentParser for recipes.py.
+
+  Args:
+    subcommands (list(str)): The subcommands to import and fully register. All
+      other subcommands get a placeholder parser which accepts anything.
+
+  Returns (parser, common_postprocess_func).
+  """
+  parser = argparse.ArgumentParser(
+    description='Interact with the recipe system.')
+
+  common_postprocess_func = common_args.add_common_args(parser)
+
+  subp = parser.add_subparsers(dest='command')
+  for name in _SUBCOMMANDS:
+    if name in subcommands:
+      importlib.import_module('recipe_engine.' + name).add_subparser(subp)
+    else:
+      placeholder = subp.add_parser(name, add_help=False)
+      placeholder.add_argument('args', nargs=argparse.REMAINDER)
+
+  return parser, common_postprocess_func
+
+
 def main():
   # Prune all evidence of VPython/VirtualEnv out of the environment. This means
   # that recipe engine 'unwraps' vpython VirtualEnv path/env manipulation.
@@ -100,16 +138,14 @@ def main():
     if not os.path.isfile(os.path.join(p, 'activate_this.py'))
   ])
 
-  parser = argparse.ArgumentParser(
-    description='Interact with the recipe system.')
-
-  common_postprocess_func = common_args.add_common_args(parser)
-
-  subp = parser.add_subparsers(dest='command')
-  for module in _SUBCOMMANDS:
-    module.add_subparser(subp)
-
+  command = _find_subcommand(sys.argv[1:])
+  parser, common_postprocess_func = _make_parser(
+    [command] if command else _SUBCOMMANDS)
   args = parser.parse_args()
+  if args.command != command:
+    # Our guess was wrong; fall back to loading everything.
+    parser, common_postprocess_func = _make_parser(_SUBCOMMANDS)
+    args = parser.parse_args()
   common_postprocess_func(parser, args)
   args.postprocess_func(parser, args)
 
@@ -4,6 +4,8 @@
 
 import copy
 import errno
+import hashlib
+import json
 import logging
 import operator
 import os
@@ -31,16 +33,48 @@ class CyclicDependencyError(Exception):
   pass
 
 
+def _pyc_is_stale(pyc_path):
+  """Returns True iff the .pyc at |pyc_path| must not be used.
+
+  Python already recompiles a .pyc whose embedded source mtime doesn't match
+  the .py file, so only two cases need handling here:
+    * the .py file is gone, in which case python would happily import the
+      orphaned .pyc.
+    * the .py file was rewritten within the same second as the .pyc was
+      compiled (the embedded mtime only has 1s granularity). We detect this by
+      comparing the full resolution mtimes of the two files.
+  """
+  try:
+    src_st = os.stat(pyc_path[:-1])
+  except OSError as ex:
+    if ex.errno != errno.ENOENT:
+      raise
+    return True
+  try:
+    pyc_st = os.stat(pyc_path)
+  except OSError as ex:
+    if ex.errno != errno.ENOENT:
+      raise
+    return False
+  return pyc_st.st_mtime <= src_st.st_mtime
+
+
 def cleanup_pyc(path):
-  """Removes any .pyc files from |path|'s directory tree.
+  """Removes any stale .pyc files from |path|'s directory tree.
+
+  Up-to-date .pyc files are left alone, so that they don't need to be
+  recompiled. See _pyc_is_stale for what counts as stale.
 
   This ensures we always use the fresh code.
   """
   for root, _dirs, files in os.walk(path):
     for f in files:
       if f.endswith('.pyc'):
+        pyc_path = os.path.join(root, f)
+        if not _pyc_is_stale(pyc_path):
+          continue
         try:
-          os.unlink(os.path.join(root, f))
+          os.unlink(pyc_path)
         except OSError as ex:
           # If multiple things are cleaning pyc's at the same time this can
           # race. Fortunately we only care that SOMETHING deleted the pyc :)
@@ -48,6 +82,261 @@ def cleanup_pyc(path):
             raise
 
 
+def _tree_fingerprint(path):
+  """Returns a hash of the names, sizes and mtimes of the files under |path|.
+
+  The .git directory and .pyc files are ignored, since they are expected to
+  change without the checkout itself changing.
+  """
+  h = hashlib.sha1()
+  for root, dirs, files in os.walk(path):
+    dirs[:] = sorted(d for d in dirs if d not in ('.git', '.recipe_deps'))
+    for f in sorted(files):
+      if f.endswith('.pyc'):
+        continue
+      full = os.path.join(root, f)
+      try:
+        st = os.lstat(full)
+      except OSError as ex:
+        if ex.errno != errno.ENOENT:
+          raise
+        continue
+      h.update('%s\0%d\0%r\n' % (
+          os.path.relpath(full, path), st.st_size, st.st_mtime))
+  return h.hexdigest()
+
+
+def _write_json_atomically(path, data):
+  """Writes |data| as json to |path|.
+
+  This writes to a temporary file and renames it into place, so that concurrent
+  invocations never observe a partially written file.
+  """
+  tmp_path = '%s.%d.tmp' % (path, os.getpid())
+  with open(tmp_path, 'w') as f:
+    json.dump(data, f, indent=2, sort_keys=True)
+  if sys.platform.startswith(('win', 'cygwin')) and os.path.exists(path):
+    os.remove(path)
+  os.rename(tmp_path, path)
+
+
+class CheckoutStamp(object):
+  """Records the state of the git dependency checkouts in .recipe_deps.
+
+  For each git dependency this stores the revision it was checked out at, a
+  fingerprint of its checked out files and the CommitMetadata of that revision.
+  While the stamp is valid, PackageDeps.create doesn't need to run git at all.
+  The stamp is discarded whenever the root package's recipes.cfg changes.
+  """
+
+  FILENAME = '.checkout_stamp.json'
+  VERSION = 1
+
+  def __init__(self, context, package_file):
+    self._context = context
+    self._path = os.path.join(context.package_dir, self.FILENAME)
+    self._cfg_hash = hashlib.sha1(package_file.read_raw()).hexdigest()
+    self._deps = None
+    self._dirty = False
+
+  def _load(self):
+    if self._deps is not None:
+      return self._deps
+    self._deps = {}
+    try:
+      with open(self._path) as f:
+        data = json.load(f)
+    except (IOError, ValueError):
+      return self._deps
+    if (isinstance(data, dict) and data.get('version') == self.VERSION and
+        data.get('recipes_cfg') == self._cfg_hash):
+      self._deps = data.get('deps', {})
+    return self._deps
+
+  def is_fresh(self, project_id, repo_spec):
+    """Returns True iff |repo_spec| is known to be checked out already.
+
+    If it is, this also primes the backend with the cached CommitMetadata.
+    """
+    entry = self._load().get(project_id)
+    if not entry or (entry.get('url'), entry.get('revision')) != (
+        repo_spec.repo, repo_spec.revision):
+      return False
+    if entry.get('fingerprint') != _tree_fingerprint(
+        repo_spec.repo_root(self._context)):
+      return False
+
+    # git gives us utf-8 encoded str's; json hands back unicode.
+    enc = lambda s: s.encode('utf-8') if s is not None else None
+    meta = entry['metadata']
+    repo_spec.backend.prime_commit_metadata(fetch.CommitMetadata(
+        str(repo_spec.revision),
+        enc(meta['author_email']),
+        meta['commit_timestamp'],
+        tuple(enc(l) for l in meta['message_lines']),
+        package_io.parse(meta['spec']) if meta['spec'] else None,
+        meta['roll_candidate']))
+    return True
+
+  def record(self, project_id, repo_spec):
+    """Records that |repo_spec| has just been checked out."""
+    meta = repo_spec.current()
+    self._load()[project_id] = {
+      'url': repo_spec.repo,
+      'revision': repo_spec.revision,
+      'fingerprint': _tree_fingerprint(repo_spec.repo_root(self._context)),
+      'metadata': {
+        'author_email': meta.author_email,
+        'commit_timestamp': meta.commit_timestamp,
+        'message_lines': meta.message_lines,
+        'spec': package_io.dump(meta.spec) if meta.spec else None,
+        'roll_candidate': meta.roll_candidate,
+      },
+    }
+    self._dirty = True
+
+  def save(self):
+    """Writes the stamp file, if anything was recorded."""
+    if not self._dirty:
+      return
+    data = {
+      'version': self.VERSION,
+      'recipes_cfg': self._cfg_hash,
+      'deps': self._deps,
+    }
+    try:
+      _write_json_atomically(self._path, data)
+    except (IOError, OSError):
+      # The stamp is only an optimization.
+      LOGGER.warning('Failed to write checkout stamp %r', self._path,
+                     exc_info=True)
+    self._dirty = False
+
+
+class DepsSnapshot(object):
+  """Records the fully resolved dependency graph in .recipe_deps.
+
+  For each package in the graph this stores its repo spec, repo root, recipes
+  path and the names of its dependencies, so that PackageDeps.create can
+  rebuild the graph without parsing the recipes.cfg of every package.
+
+  The snapshot is discarded whenever the root package's recipes.cfg changes.
+  Before it is used, the recipes.cfg of every path dependency is checked against
+  the recorded hash, and every git dependency must still be fresh according to
+  the CheckoutStamp.
+  """
+
+  FILENAME = '.deps_snapshot.json'
+  VERSION = 1
+
+  def __init__(self, context, package_file):
+    self._context = context
+    self._package_file = package_file
+    self._path = os.path.join(context.package_dir, self.FILENAME)
+    self._key = hashlib.sha1('%s\0%s' % (
+        context.repo_root, package_file.read_raw())).hexdigest()
+
+  @staticmethod
+  def _path_cfg_hash(path):
+    return hashlib.sha1(package_io.PackageFile(
+        package_io.InfraRepoConfig().to_recipes_cfg(path)).read_raw()
+    ).hexdigest()
+
+  def _repo_spec(self, project_id, entry):
+    kind = entry['kind']
+    if kind == 'root':
+      return RootRepoSpec(self._package_file)
+    if kind == 'path':
+      return PathRepoSpec(project_id, str(entry['path']))
+    url = str(entry['url'])
+    return GitRepoSpec(
+      project_id,
+      url,
+      str(entry['branch']),
+      str(entry['revision']),
+      fetch.GitBackend(
+        os.path.join(self._context.package_dir, project_id), url))
+
+  def load(self, stamp):
+    """Returns the PackageDeps recorded in the snapshot, or None if there is
+    no usable snapshot.
+
+    Args:
+      stamp (CheckoutStamp): Used to check that the git dependencies are still
+          checked out at the recorded revisions.
+    """
+    try:
+      with open(self._path) as f:
+        data = json.load(f)
+    except (IOError, ValueError):
+      return None
+    if not (isinstance(data, dict) and data.get('version') == self.VERSION and
+            data.get('key') == self._key):
+      return None
+
+    package_deps = PackageDeps()
+    try:
+      entries = {str(k): v for k, v in data['packages'].iteritems()}
+      specs = {}
+      for project_id, entry in entries.iteritems():
+        repo_spec = specs[project_id] = self._repo_spec(project_id, entry)
+        if repo_spec.repo_root(self._context) != entry['repo_root']:
+          return None
+        if (isinstance(repo_spec, PathRepoSpec) and
+            self._path_cfg_hash(repo_spec.path) != entry['recipes_cfg']):
+          return None
+      # Fingerprinting the git checkouts is the expensive part, so do it last.
+      for project_id, repo_spec in specs.iteritems():
+        if (isinstance(repo_spec, GitRepoSpec) and
+            not stamp.is_fresh(project_id, repo_spec)):
+          return None
+
+      for project_id, entry in entries.iteritems():
+        repo_spec = specs[project_id]
+        package_deps._packages[project_id] = Package(
+            project_id, repo_spec, {}, repo_spec.repo_root(self._context),
+            str(entry['recipes_path']))
+      for project_id, entry in entries.iteritems():
+        package_deps._packages[project_id].deps = {
+          str(dep): package_deps._packages[dep] for dep in entry['deps']}
+      package_deps._root_package = package_deps._packages[data['root']]
+    except (IOError, KeyError, TypeError, AttributeError):
+      return None
+    return package_deps
+
+  def save(self, package_deps):
+    """Writes a snapshot of |package_deps|."""
+    packages = {}
+    for pkg in package_deps.packages:
+      repo_spec = pkg.repo_spec
+      entry = {
+        'repo_root': pkg.repo_root,
+        'recipes_path': pkg.relative_recipes_dir,
+        'deps': sorted(pkg.deps),
+      }
+      if isinstance(repo_spec, GitRepoSpec):
+        entry.update(kind='git', url=repo_spec.repo, branch=repo_spec.branch,
+                     revision=repo_spec.revision)
+      elif isinstance(repo_spec, PathRepoSpec):
+        entry.update(kind='path', path=repo_spec.path,
+                     recipes_cfg=self._path_cfg_hash(repo_spec.path))
+      else:
+        entry['kind'] = 'root'
+      packages[pkg.name] = entry
+    data = {
+      'version': self.VERSION,
+      'key': self._key,
+      'root': package_deps.root_package.name,
+      'packages': packages,
+    }
+    try:
+      _write_json_atomically(self._path, data)
+    except (IOError, OSError):
+      # The snapshot is only an optimization.
+      LOGGER.warning('Failed to write dependency snapshot %r', self._path,
+                     exc_info=True)
+
+
 class PackageContext(object):
   """Contains information about where the root package and its dependency
   checkouts live.
@@ -421,14 +710,32 @@ class PackageDeps(object):
 
     package_deps = cls(overrides=overrides_deep)
 
-    # Initialize all repos to their intended state.
+    # Reuse the graph from the last invocation if nothing changed since. With
+    # overrides the graph also depends on the overriding checkouts, so always
+    # resolve it from scratch then.
+    stamp = CheckoutStamp(context, package_file)
+    snapshot = None if overrides else DepsSnapshot(context, package_file)
+    if snapshot:
+      cached = snapshot.load(stamp)
+      if cached is not None:
+        return cached
+
+    # Initialize all repos to their intended state. The stamp lets us skip git
+    # entirely for the dependencies which are already checked out.
     pspec = PackageSpec.from_package_pb(context, package_file.read())
     for project_id, dep in pspec.deps.iteritems():
       effective_dep = overrides_deep.get(project_id, dep)
-      effective_dep.checkout(context)
+      if not isinstance(effective_dep, GitRepoSpec):
+        effective_dep.checkout(context)
+      elif not stamp.is_fresh(project_id, effective_dep):
+        effective_dep.checkout(context)
+        stamp.record(project_id, effective_dep)
+    stamp.save()
 
     package_deps._root_package = package_deps._create_package(
       context, RootRepoSpec(package_file))
+    if snapshot:
+      snapshot.save(package_deps)
 
     return package_deps
 
@@ -13,6 +13,25 @@ from collections import defaultdict, OrderedDict, namedtuple
 
 _filterRegexEntry = namedtuple('_filterRegexEntry', 'at_most at_least fields')
 
+# What the post_process functions look up in the followup annotations of a step.
+#   status (str): 'success', 'failure' or 'exception'.
+#   text (str): The step_text of the step ('' if it has none).
+#   logs (dict(str, list(str))): The lines of each log of the step (with a
+#     trailing '' once the log is closed).
+_StepInfo = namedtuple('_StepInfo', 'status text logs')
+
+# tuple(followup annotations) -> _StepInfo
+#
+# Every post_process hook of a test gets its own copy of the steps, so this is
+# keyed by the content of the annotations rather than by the step, which lets
+# all the hooks of a test share the parsed annotations.
+_STEP_INFO_CACHE = {}
+
+
+def ResetStepInfoCache():
+  """Forgets the parsed annotations of all steps. Called between tests."""
+  _STEP_INFO_CACHE.clear()
+
 
 class Filter(object):
   """Filter is an implementation of a post_process callable which can remove
@@ -33,6 +52,16 @@ class Filter(object):
     """
     self.data = {name: () for name in steps}
     self.re_data = {}
+    # step name -> the first regex in re_data which matches it, or None. The
+    # same filter is usually used by many tests with the same step names.
+    self._re_matches = {}
+
+  def _match_re(self, name):
+    """Returns the first regex in re_data which matches |name|, or None."""
+    if name not in self._re_matches:
+      self._re_matches[name] = next(
+          (exp for exp in self.re_data if exp.match(name)), None)
+    return self._re_matches[name]
 
   def __call__(self, check, step_odict):
     unused_includes = self.data.copy()
@@ -44,11 +73,10 @@ class Filter(object):
     for name, step in step_odict.iteritems():
       field_set = unused_includes.pop(name, None)
       if field_set is None:
-        for exp, (_, _, fset) in re_data.iteritems():
-          if exp.match(name):
-            re_usage_count[exp] += 1
-            field_set = fset
-            break
+        exp = self._match_re(name)
+        if exp is not None:
+          re_usage_count[exp] += 1
+          field_set = re_data[exp].fields
       if field_set is None:
         continue
       if len(field_set) == 0:
@@ -189,6 +217,57 @@ def _check_step_was_run(check, step_odict, step):
   return check('step %s was run' % step, step in step_odict)
 
 
+_STEP_TEXT_RE = re.compile('@@@STEP_TEXT@(?P<text>.*)@@@$')
+_LOG_LINE_RE = re.compile('@@@STEP_LOG_LINE@(?P<log>[^@]*)@(?P<text>.*)@@@$')
+_LOG_END_RE = re.compile('@@@STEP_LOG_END@(?P<log>.*)@@@$')
+
+
+def _step_info(step_odict, step):
+  """Returns the _StepInfo for the step |step|, which must have been run."""
+  annotations = tuple(step_odict[step].get('~followup_annotations', ()))
+  info = _STEP_INFO_CACHE.get(annotations)
+  if info is None:
+    info = _parse_annotations(annotations)
+    _STEP_INFO_CACHE[annotations] = info
+  return info
+
+
+def _parse_annotations(annotations):
+  """Parses the followup annotations of a step into a _StepInfo."""
+  status = None
+  text = None
+  logs = {}
+  closed_logs = set()
+  for a in annotations:
+    if not a.startswith('@@@'):
+      continue
+    if status is None:
+      if a == '@@@STEP_EXCEPTION@@@':
+        status = 'exception'
+        continue
+      if a == '@@@STEP_FAILURE@@@':
+        status = 'failure'
+        continue
+    if text is None:
+      match = _STEP_TEXT_RE.match(a)
+      if match:
+        text = match.group('text')
+        continue
+    match = _LOG_LINE_RE.match(a)
+    if match:
+      log = match.group('log')
+      if log not in closed_logs:
+        logs.setdefault(log, []).append(match.group('text'))
+      continue
+    match = _LOG_END_RE.match(a)
+    if match:
+      log = match.group('log')
+      if log not in closed_logs:
+        logs.setdefault(log, []).append('')
+        closed_logs.add(log)
+  return _StepInfo(status or 'success', text or '', logs)
+
+
 def _extract_step_status(check, step_odict, step):
   """Extract the status for a step.
 
@@ -203,12 +282,7 @@ def _extract_step_status(check, step_odict, step):
   """
   if not _check_step_was_run(check, step_odict, step):
     return
-  for a in step_odict[step].get('~followup_annotations', []):
-    if a == '@@@STEP_EXCEPTION@@@':
-      return 'exception'
-    if a == '@@@STEP_FAILURE@@@':
-      return 'failure'
-  return 'success'
+  return _step_info(step_odict, step).status
 
 def StepSuccess(check, step_odict, step):
   """Assert that a step succeeded.
@@ -324,9 +398,6 @@ def StepCommandContains(check, step_odict, step, argument_sequence):
             step, argument_sequence),
         subsequence(step_cmd, argument_sequence))
 
-_STEP_TEXT_RE = re.compile('@@@STEP_TEXT@(?P<text>.*)@@@$')
-
-
 def _extract_step_text(check, step_odict, step):
   """Extract the step_text for a step.
 
@@ -342,11 +413,7 @@ def _extract_step_text(check, step_odict, step):
   """
   if not _check_step_was_run(check, step_odict, step):
     return
-  for a in step_odict[step].get('~followup_annotations', []):
-    match = _STEP_TEXT_RE.match(a)
-    if match:
-      return match.group('text')
-  return ''
+  return _step_info(step_odict, step).text
 
 
 def StepTextEquals(check, step_odict, step, expected):
@@ -389,10 +456,6 @@ def StepTextContains(check, step_odict, step, expected_substrs):
     check(expected in actual)
 
 
-_LOG_LINE_RE = re.compile('@@@STEP_LOG_LINE@(?P<log>[^@]*)@(?P<text>.*)@@@$')
-_LOG_END_RE = re.compile('@@@STEP_LOG_END@(?P<log>.*)@@@$')
-
-
 def _extract_log(check, step_odict, step, log):
   """Extract a log for a step.
 
@@ -410,16 +473,7 @@ def _extract_log(check, step_odict, step, log):
   """
   if not _check_step_was_run(check, step_odict, step):
     return
-  log_lines = []
-  for a in step_odict[step].get('~followup_annotations', []):
-    match = _LOG_LINE_RE.match(a)
-    if match and match.group('log') == log:
-      log_lines.append(match.group('text'))
-      continue
-    match = _LOG_END_RE.match(a)
-    if match and match.group('log') == log:
-      log_lines.append('')
-      break
+  log_lines = _step_info(step_odict, step).logs.get(log, [])
   if not check('step %s has log %s' % (step, log), log_lines):
     return
   return '\n'.join(log_lines)
@@ -0,0 +1,239 @@
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+"""Profiling of recipe runs and simulation tests (the --profile flags).
+
+The profiles are written in the pstats format. The summaries attribute the
+time to the recipes and recipe modules which the profiled functions belong to,
+so that module owners can find the hot methods of their APIs without wading
+through the internals of the engine.
+"""
+
+from __future__ import print_function
+
+import collections
+import contextlib
+import cProfile
+import os
+import pstats
+import time
+
+
+# The number of rows of each table of the summaries.
+TOP_N = 20
+
+# The owners of functions outside of any recipe or recipe module.
+ENGINE = '(recipe engine)'
+OTHER = '(other)'
+
+_ENGINE_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+
+class Attributor(object):
+  """Maps the files of profiled functions to the recipe or recipe module they
+  belong to.
+
+  Recipe modules are named like in DEPS ('package/module'), and recipes like on
+  the command line ('package::recipe'). Module examples and tests count towards
+  their module.
+  """
+
+  def __init__(self, packages):
+    """
+    Args:
+      packages (iterable(package.Package)): The packages of the recipes.
+    """
+    # [(directory, is_module_dir, package name)]
+    self._roots = []
+    for p in packages:
+      self._roots.append((p.module_dir + os.sep, True, p.name))
+      self._roots.append((p.recipe_dir + os.sep, False, p.name))
+    # filename -> owner
+    self._owners = {}
+
+  def owner(self, filename):
+    """Returns the name of the recipe or module |filename| belongs to, or
+    ENGINE or OTHER."""
+    owner = self._owners.get(filename)
+    if owner is None:
+      owner = self._owners[filename] = self._find_owner(filename)
+    return owner
+
+  def _find_owner(self, filename):
+    for root, is_module_dir, package_name in self._roots:
+      if filename.startswith(root):
+        relpath = filename[len(root):]
+        if is_module_dir:
+          return '%s/%s' % (package_name, relpath.split(os.sep, 1)[0])
+        return '%s::%s' % (
+            package_name, os.path.splitext(relpath)[0].replace(os.sep, '/'))
+    if filename.startswith(_ENGINE_DIR):
+      return ENGINE
+    return OTHER
+
+
+class _RawStats(object):
+  """Adapts the stats of a cProfile.Profile for pstats.Stats."""
+
+  def __init__(self, stats):
+    self.stats = stats
+
+  def create_stats(self):
+    pass
+
+
+def profile_call(fn, *args):
+  """Calls fn(*args) under cProfile.
+
+  Returns (result of fn, stats): the stats are picklable, and can be passed to
+  SimulationProfile.add_test.
+  """
+  profiler = cProfile.Profile()
+  result = profiler.runcall(fn, *args)
+  profiler.create_stats()
+  return result, profiler.stats
+
+
+def _owner_times(stats, attributor):
+  """Returns {owner: seconds spent in the functions of owner}, not counting
+  the time spent in the functions they call."""
+  times = collections.defaultdict(float)
+  for (filename, _, _), (_, _, tottime, _, _) in stats.iteritems():
+    times[attributor.owner(filename)] += tottime
+  return times
+
+
+def _print_table(out, title, header, rows):
+  print(title, file=out)
+  print(header, file=out)
+  for row in rows:
+    print(row, file=out)
+  print(file=out)
+
+
+def _print_stats_summary(out, stats, attributor, top_n):
+  """Prints the time spent in each owner, and the hottest functions of the
+  recipes and modules in pstats.Stats |stats|."""
+  owner_times = _owner_times(stats.stats, attributor)
+  total = sum(owner_times.itervalues()) or 1.0
+  _print_table(
+      out, 'Time by recipe and module:',
+      '%10s %6s  %s' % ('seconds', '%', 'owner'),
+      ['%10.3f %5.1f%%  %s' % (seconds, 100 * seconds / total, owner)
+       for owner, seconds in sorted(
+           owner_times.iteritems(), key=lambda i: (-i[1], i[0]))[:top_n]])
+
+  hot = []
+  for func, (_, calls, tottime, cumtime, _) in stats.stats.iteritems():
+    owner = attributor.owner(func[0])
+    if owner not in (ENGINE, OTHER):
+      hot.append((cumtime, tottime, calls, owner, func))
+  hot.sort(key=lambda h: (-h[0], h[4]))
+  _print_table(
+      out, 'Hottest recipe and module functions:',
+      '%10s %10s %8s  %s' % ('cumtime', 'tottime', 'calls', 'function'),
+      ['%10.3f %10.3f %8d  %s %s:%d(%s)' % (
+          cumtime, tottime, calls, owner, os.path.basename(func[0]), func[1],
+          func[2])
+       for cumtime, tottime, calls, owner, func in hot[:top_n]])
+
+
+class RunProfiler(object):
+  """Profiles a recipe run (`recipes.py run --profile`).
+
+  The clock of the profile stops while a step runs (see step()), so that the
+  profile only accounts for the time spent in the recipe, its modules and the
+  engine. The wall time of the steps is recorded separately.
+  """
+
+  def __init__(self):
+    self._origin = time.time()
+    # The time spent in steps so far, and the start of the current step.
+    self._step_time = 0.0
+    self._step_start = None
+    # [(step name, seconds)]
+    self.step_times = []
+    self._profiler = cProfile.Profile(self._clock)
+
+  def _clock(self):
+    now = time.time() if self._step_start is None else self._step_start
+    return now - self._origin - self._step_time
+
+  def runcall(self, fn, *args, **kwargs):
+    """Returns fn(*args, **kwargs), profiling the call."""
+    return self._profiler.runcall(fn, *args, **kwargs)
+
+  @contextlib.contextmanager
+  def step(self, name):
+    """Stops the clock of the profile while the body (the step |name|) runs."""
+    self._step_start = time.time()
+    try:
+      yield
+    finally:
+      duration = time.time() - self._step_start
+      self._step_time += duration
+      self._step_start = None
+      self.step_times.append((name, duration))
+
+  def report(self, path, attributor, out, top_n=TOP_N):
+    """Writes the profile to |path|, and prints a summary to |out|."""
+    stats = pstats.Stats(self._profiler)
+    stats.dump_stats(path)
+
+    print('Profile written to %s' % path, file=out)
+    print('Steps: %d, %0.3fs' % (len(self.step_times), self._step_time),
+          file=out)
+    print('Recipe and engine (excluding steps): %0.3fs' % stats.total_tt,
+          file=out)
+    print(file=out)
+    _print_table(
+        out, 'Slowest steps:', '%10s  %s' % ('seconds', 'step'),
+        ['%10.3f  %s' % (seconds, name)
+         for name, seconds in sorted(
+             self.step_times, key=lambda s: -s[1])[:top_n]])
+    _print_stats_summary(out, stats, attributor, top_n)
+
+
+class SimulationProfile(object):
+  """Combines the profiles of simulation tests (`recipes.py test run
+  --profile`), which are run in other processes with profile_call."""
+
+  def __init__(self):
+    # pstats.Stats, once there are any.
+    self._stats = None
+    # [(seconds, test name, recipe or module which took most of its time)]
+    self._tests = []
+
+  def add_test(self, name, stats, attributor):
+    """Adds the stats of test |name| returned by profile_call."""
+    if not stats:
+      return
+    owner_times = _owner_times(stats, attributor)
+    hottest = max([
+      (seconds, owner) for owner, seconds in owner_times.iteritems()
+      if owner not in (ENGINE, OTHER)
+    ] or [(0, '-')])[1]
+    self._tests.append((sum(owner_times.itervalues()), name, hottest))
+    if self._stats is None:
+      self._stats = pstats.Stats(_RawStats(stats))
+    else:
+      self._stats.add(_RawStats(stats))
+
+  def report(self, path, attributor, out, top_n=TOP_N):
+    """Writes the combined profile to |path|, and prints a summary to |out|."""
+    if self._stats is None:
+      print('No tests were profiled', file=out)
+      return
+    self._stats.dump_stats(path)
+
+    print('Profile written to %s' % path, file=out)
+    print('Profiled %d tests, %0.3fs' % (
+        len(self._tests), self._stats.total_tt), file=out)
+    print(file=out)
+    _print_table(
+        out, 'Slowest tests:',
+        '%10s  %-50s %s' % ('seconds', 'test', 'hottest recipe or module'),
+        ['%10.3f  %-50s %s' % test
+         for test in sorted(self._tests, key=lambda t: (-t[0], t[1]))[:top_n]])
+    _print_stats_summary(out, self._stats, attributor, top_n)
@@ -3,7 +3,6 @@
 # that can be found in the LICENSE file.
 
 from __future__ import absolute_import
-import bisect
 import collections
 import contextlib
 import copy
@@ -22,7 +21,7 @@ from .recipe_test_api import DisabledTestData, ModuleTestData
 from .source_manifest_pb2 import Manifest
 from .third_party.logdog import streamname
 from .third_party.logdog.bootstrap import ButlerBootstrap, NotBootstrappedError
-from .types import StepData
+from .types import StepData, freeze
 from .util import ModuleInjectionSite, Placeholder
 
 
@@ -107,41 +106,82 @@ class PathsClient(object):
 
   IDENT = 'paths'
 
+  # Maps a recipe module to (its LOADED_DEPS, the resource and package repo
+  # Paths of it and all of its transitive dependencies). Modules are only
+  # loaded once per universe, so this is shared by all the recipe runs in this
+  # process (e.g. simulation tests). LOADED_DEPS is kept to notice when the
+  # module gets loaded again by another universe. Only the Path objects are
+  # cached; their string forms depend on the path module's configuration for
+  # the current run.
+  _MODULE_PATHS = {}
+
   def __init__(self):
     self.paths = []
     self.path_strings = []
+    # sep -> component trie of path_strings (see find_longest_prefix).
+    self._tries = {}
+
+  @classmethod
+  def _module_paths(cls, module):
+    deps, paths = cls._MODULE_PATHS.get(module, (None, None))
+    if deps is not module.LOADED_DEPS:
+      found = {}
+      def add(path):
+        found[(path.base, path.pieces)] = path
+      add(module.RESOURCE_DIRECTORY)
+      add(module.PACKAGE_REPO_ROOT)
+      for dep in module.LOADED_DEPS.itervalues():
+        for path in cls._module_paths(dep):
+          add(path)
+      paths = tuple(found.itervalues())
+      cls._MODULE_PATHS[module] = (module.LOADED_DEPS, paths)
+    return paths
 
   def _initialize_with_recipe_api(self, root_api):
     """This method is called once before the start of every recipe.
 
-    It is passed the recipe's `api` object. This method crawls the api object
-    and extracts every resource base path it can find."""
+    It is passed the recipe's `api` object. This method finds the recipe's
+    modules on it, and extracts every resource base path of them and their
+    dependencies."""
     paths_found = {}
     def add_found(path):
       if path is not None:
         paths_found[str(path)] = path
 
-    search_set = [root_api]
-    found_api_id_set = {id(root_api)}
-    while search_set:
-      api = search_set.pop()
+    add_found(root_api.resource())
+    add_found(root_api.package_repo_resource())
 
-      add_found(api.resource())
-      add_found(api.package_repo_resource())
+    # The recipe's direct dependencies; the ones which haven't been
+    # instantiated yet (see loader.create_recipe_api) are only known by their
+    # module.
+    modules = root_api.m.lazy_modules().values()
+    for name in dir(root_api.m):
+      sub_api = getattr(root_api.m, name)
+      if isinstance(sub_api, RecipeApiPlain) and sub_api is not root_api:
+        modules.append(sub_api._module)
 
-      for name in dir(api.m):
-        sub_api = getattr(api.m, name)
-        if not isinstance(sub_api, RecipeApiPlain):
-          continue
-        if id(sub_api) not in found_api_id_set:
-          found_api_id_set.add(id(api))
-          search_set.append(sub_api)
+    for module in modules:
+      for path in self._module_paths(module):
+        add_found(path)
 
     # transpose
     #   [(path_string, path), ...]
     #   into
     #   ([path_string, ...], [path, ...])
     self.path_strings, self.paths = zip(*sorted(paths_found.items()))
+    self._tries = {}
+
+  def _trie(self, sep):
+    trie = self._tries.get(sep)
+    if trie is None:
+      trie = self._tries[sep] = {}
+      for sPath, path in zip(self.path_strings, self.paths):
+        node = trie
+        for piece in sPath.split(sep):
+          node = node.setdefault(piece, {})
+        # None never occurs as a piece, so it marks the end of a known path.
+        node[None] = (sPath, path)
+    return trie
 
   def find_longest_prefix(self, target, sep):
     """Identifies a known resource path which would contain the `target` path.
@@ -152,32 +192,82 @@ class PathsClient(object):
     Returns (str(Path), Path) if the prefix path is found, or (None, None) if no
     such prefix exists.
     """
-    idx = bisect.bisect_left(self.path_strings, target)
-    if idx == len(self.paths):
-      return (None, None) # off the end
+    ret = (None, None)
+    node = self._trie(sep)
+    for piece in target.split(sep):
+      node = node.get(piece)
+      if node is None:
+        break
+      ret = node.get(None, ret)
+    return ret
+
 
-    sPath, path = self.path_strings[idx], self.paths[idx]
-    if target == sPath :
-      return sPath, path
+# Types of property values which are never modified in place, and can therefore
+# be shared between copies of the properties.
+_IMMUTABLE_PROPERTY_TYPES = frozenset((
+    str, unicode, int, long, float, bool, type(None)))
 
-    if idx > 0:
-      sPath, path = self.path_strings[idx-1], self.paths[idx-1]
-      if target.startswith(sPath+sep):
-        return sPath, path
 
-    return (None, None)
+def _copy_property(value):
+  """Returns a deep copy of the property |value|, sharing its immutable parts.
+
+  Properties are JSON data, which this copies much faster than copy.deepcopy.
+  """
+  typ = type(value)
+  if typ in _IMMUTABLE_PROPERTY_TYPES:
+    return value
+  if typ is dict:
+    return {k: _copy_property(v) for k, v in value.iteritems()}
+  if typ is list:
+    return map(_copy_property, value)
+  return copy.deepcopy(value)
 
 
 class PropertiesClient(object):
-  """A recipe engine client representing the recipe engine properties."""
+  """A recipe engine client representing the recipe engine properties.
+
+  The properties never change during a run, so each property is frozen at most
+  once, when it's first read through get_frozen_property.
+  """
 
   IDENT = 'properties'
 
   def __init__(self, engine):
     self._engine = engine
+    # property name -> frozen value
+    self._frozen = {}
+    self._names = None
+
+  def get_property_names(self):
+    if self._names is None:
+      # In the order of a copy of the properties, like get_properties(), rather
+      # than of the engine's dict (which may differ).
+      self._names = tuple({k: None for k in self._engine.properties})
+    return self._names
+
+  def has_property(self, name):
+    return name in self._engine.properties
+
+  def get_frozen_property(self, name):
+    """Returns the frozen (see types.freeze) value of the property |name|.
+
+    Raises KeyError if there's no such property.
+    """
+    if name not in self._frozen:
+      self._frozen[name] = freeze(self._engine.properties[name])
+    return self._frozen[name]
+
+  def get_property(self, name):
+    """Returns a read-write copy of the value of the property |name|.
+
+    Raises KeyError if there's no such property.
+    """
+    return _copy_property(self._engine.properties[name])
 
   def get_properties(self):
-    return copy.deepcopy(self._engine.properties)
+    """Returns a read-write copy of all of the properties."""
+    return {k: _copy_property(v)
+            for k, v in self._engine.properties.iteritems()}
 
 
 class StepClient(object):
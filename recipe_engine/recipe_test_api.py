@@ -4,6 +4,7 @@
 
 import contextlib
 import inspect
+import sys
 
 from collections import namedtuple, defaultdict
 
@@ -187,28 +188,135 @@ PostprocessHook = namedtuple(
   'PostprocessHook', 'func args kwargs filename lineno')
 
 
+class _TestDataState(object):
+  """The contents of a TestData which are combined by `+`."""
+
+  def __init__(self):
+    self.properties = {}  # key -> val
+    self.mod_data = defaultdict(ModuleTestData)
+    self.step_data = defaultdict(StepTestData)
+    self.post_process_hooks = [] # list(PostprocessHook)
+
+  def copy(self):
+    ret = _TestDataState()
+    ret.properties.update(self.properties)
+    ret.mod_data.update(self.mod_data)
+    ret.step_data.update(self.step_data)
+    ret.post_process_hooks.extend(self.post_process_hooks)
+    return ret
+
+  def merge(self, other):
+    """Adds the contents of |other| into this state (see TestData.__add__)."""
+    self.properties.update(other.properties)
+    for k, v in other.mod_data.iteritems():
+      self.mod_data[k] = self.mod_data[k] + v if k in self.mod_data else v
+    for k, v in other.step_data.iteritems():
+      if k in self.step_data:
+        try:
+          v = self.step_data[k] + v
+        except ValueError as ve:
+          raise ValueError('in step %r: %s' % (k, ve))
+      self.step_data[k] = v
+    self.post_process_hooks.extend(other.post_process_hooks)
+
+
+def _merge_snapshots(snapshot):
+  """Returns a new _TestDataState with the combined contents of |snapshot|.
+
+  A snapshot is either a _TestDataState, or a (left, right, location) tuple of
+  snapshots for the contents of `left + right`, where location is the
+  (filename, lineno) of the `+` (see _caller_location).
+
+  Raises ValueError if the contents conflict. Since this happens long after the
+  offending `+` ran, the error names its location.
+  """
+  # Long chains of `+` nest on the left, so walk those iteratively.
+  rights = []
+  while isinstance(snapshot, tuple):
+    snapshot, right, location = snapshot
+    rights.append((right, location))
+  ret = snapshot.copy()
+  for right, location in reversed(rights):
+    if isinstance(right, tuple):
+      right = _merge_snapshots(right)
+    try:
+      ret.merge(right)
+    except ValueError as ve:
+      raise ValueError('%s (adding test data at %s:%d)' % ((ve,) + location))
+  return ret
+
+
+def _caller_location():
+  """Returns (filename, lineno) of the innermost caller outside of this file.
+
+  This uses sys._getframe rather than inspect.stack, because it runs for every
+  `+` on TestData, and inspect.stack reads the source of every frame.
+  """
+  frame = sys._getframe(1)  # pylint: disable=W0212
+  while frame.f_back and frame.f_globals.get('__name__') == __name__:
+    frame = frame.f_back
+  return frame.f_code.co_filename, frame.f_lineno
+
+
+def _state_field(name):
+  """Returns a property for the field |name| of the TestData's state."""
+  def _get(self):
+    return getattr(self._get_state(), name)  # pylint: disable=W0212
+  def _set(self, value):
+    setattr(self._get_state(), name, value)  # pylint: disable=W0212
+  return property(_get, _set)
+
+
 class TestData(BaseTestData):
+  """Test data for a single simulation test.
+
+  GenTests often builds a test from a long chain of `+` terms. Rather than
+  merging everything accumulated so far for every term, `+` only remembers
+  what was added (see _merge_snapshots), and the contents are merged in one
+  pass when they're first accessed.
+  """
+
   def __init__(self, name=None):
     super(TestData, self).__init__()
     self.name = name
-    self.properties = {}  # key -> val
-    self.mod_data = defaultdict(ModuleTestData)
-    self.step_data = defaultdict(StepTestData)
     self.expected_exception = None
-    self.post_process_hooks = [] # list(PostprocessHook)
+    self._state = _TestDataState()
+    # (left, right, location) snapshots which have not been merged into _state
+    # yet.
+    self._pending = None
+    # True if _state is part of a snapshot, and so must be copied before it's
+    # accessed.
+    self._shared = False
+
+  properties = _state_field('properties')
+  mod_data = _state_field('mod_data')
+  step_data = _state_field('step_data')
+  post_process_hooks = _state_field('post_process_hooks')
+
+  def _snapshot(self):
+    """Returns a snapshot of the current contents of this TestData."""
+    if self._pending is not None:
+      return self._pending
+    self._shared = True
+    return self._state
+
+  def _get_state(self):
+    """Returns the _TestDataState of this TestData, which it's free to modify."""
+    if self._pending is not None:
+      self._state = _merge_snapshots(self._pending)
+      self._pending = None
+      self._shared = False
+    elif self._shared:
+      self._state = self._state.copy()
+      self._shared = False
+    return self._state
 
   def __add__(self, other):
     assert isinstance(other, TestData)
     ret = TestData(self.name or other.name)
-
-    ret.properties.update(self.properties)
-    ret.properties.update(other.properties)
-
-    combineify('mod_data', ret, self, other)
-    combineify('step_data', ret, self, other)
-
-    ret.post_process_hooks.extend(self.post_process_hooks)
-    ret.post_process_hooks.extend(other.post_process_hooks)
+    # pylint: disable=W0212
+    ret._state = None
+    ret._pending = (self._snapshot(), other._snapshot(), _caller_location())
 
     ret.expected_exception = self.expected_exception
     if other.expected_exception:
@@ -216,6 +324,11 @@ class TestData(BaseTestData):
 
     return ret
 
+  def __getstate__(self):
+    # Merge the contents first, so that copies don't hold on to the snapshots.
+    self._get_state()
+    return self.__dict__
+
   @property
   def consumed(self):
     return not (self.step_data or self.expected_exception)
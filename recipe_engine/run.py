@@ -17,6 +17,7 @@ from google.protobuf import json_format as jsonpb
 from .third_party import subprocess42
 
 from . import loader
+from . import profiling
 from . import recipe_api
 from . import recipe_test_api
 from . import types
@@ -35,7 +36,7 @@ RecipeResult = collections.namedtuple('RecipeResult', 'result')
 # will be used to seed recipe clients and expanded to include managed runtime
 # entities.
 def run_steps(properties, stream_engine, step_runner, universe_view,
-              emit_initial_properties=False):
+              emit_initial_properties=False, profiler=None):
   """Runs a recipe (given by the 'recipe' property) for real.
 
   Args:
@@ -46,6 +47,8 @@ def run_steps(properties, stream_engine, step_runner, universe_view,
     universe_view: The RecipeUniverse to use to load the recipes & modules.
     emit_initial_properties (bool): If True, write the initial recipe engine
         properties in the "setup_build" step.
+    profiler (profiling.RunProfiler): If not None, the profiler which times
+        the steps.
 
   Returns: result_pb2.Result
   """
@@ -55,7 +58,7 @@ def run_steps(properties, stream_engine, step_runner, universe_view,
         s.set_build_property(key, json.dumps(properties[key], sort_keys=True))
 
     engine = RecipeEngine(
-        step_runner, properties, os.environ, universe_view)
+        step_runner, properties, os.environ, universe_view, profiler=profiler)
 
     # Create all API modules and top level RunSteps function.  It doesn't launch
     # any recipe code yet; RunSteps needs to be called.
@@ -135,9 +138,11 @@ class RecipeEngine(object):
   ActiveStep = collections.namedtuple('ActiveStep', (
       'config', 'step_result', 'open_step'))
 
-  def __init__(self, step_runner, properties, environ, universe_view):
+  def __init__(self, step_runner, properties, environ, universe_view,
+               profiler=None):
     """See run_steps() for parameter meanings."""
     self._step_runner = step_runner
+    self._profiler = profiler
     self._properties = properties
     self._environ = environ.copy()
     self._universe_view = universe_view
@@ -220,7 +225,11 @@ class RecipeEngine(object):
           step_result=None,
           open_step=open_step))
 
-      step_result = open_step.run()
+      if self._profiler:
+        with self._profiler.step(step_config.name):
+          step_result = open_step.run()
+      else:
+        step_result = open_step.run()
       self._step_stack[-1] = (
           self._step_stack[-1]._replace(step_result=step_result))
 
@@ -363,6 +372,34 @@ def add_subparser(parser):
     help=(
       'The file to write the JSON serialized returned value '
       ' of the recipe to'))
+  run_p.add_argument(
+    '--async-output',
+    action='store_true',
+    help=(
+      'Forward recipe output to stdout from a background thread, so that a '
+      'slow reader of stdout does not stall running steps.'))
+  run_p.add_argument(
+    '--output-buffer-size',
+    type=int,
+    default=4 * 1024 * 1024,
+    help=(
+      'With --async-output, the number of bytes of pending output to hold in '
+      'memory before spilling to disk (default: %(default)s).'))
+  run_p.add_argument(
+    '--output-spill-dir',
+    type=os.path.abspath,
+    help=(
+      'With --async-output, the directory to spill pending output to. '
+      'Defaults to the system temporary directory.'))
+  run_p.add_argument(
+    '--profile',
+    metavar='FILE',
+    type=os.path.abspath,
+    help=(
+      'Profile the recipe, its modules and the engine with cProfile, and write '
+      'the profile to FILE in the pstats format. The time spent running steps '
+      'is excluded from the profile, and reported separately along with a '
+      'summary of the hottest recipes and modules on stderr.'))
   prop_group = run_p.add_mutually_exclusive_group()
   prop_group.add_argument(
     '--properties-file',
@@ -468,7 +505,12 @@ def main(package_deps, args):
   old_cwd = os.getcwd()
   os.chdir(workdir)
 
-  stream_engine = stream.AnnotatorStreamEngine(sys.stdout)
+  outstream = sys.stdout
+  if args.async_output:
+    outstream = stream.AsyncOutstream(
+        sys.stdout, max_buffer_bytes=args.output_buffer_size,
+        spill_dir=args.output_spill_dir)
+  stream_engine = stream.AnnotatorStreamEngine(outstream)
 
   # This only applies to 'annotation' mode and will go away with build.proto.
   # It is slightly hacky, but this property is the officially documented way
@@ -480,14 +522,31 @@ def main(package_deps, args):
     get('is_luci', False)
   )
 
-  # Have a top-level set of invariants to enforce StreamEngine expectations.
-  with stream.StreamEngineInvariants.wrap(stream_engine) as stream_engine:
-    try:
-      ret = run_steps(
-          properties, stream_engine,
-          step_runner.SubprocessStepRunner(stream_engine),
-          universe_view, emit_initial_properties=emit_initial_properties)
-    finally:
-      os.chdir(old_cwd)
-
-    return handle_recipe_return(ret, args.output_result_json, stream_engine)
+  profiler = profiling.RunProfiler() if args.profile else None
+
+  try:
+    # Have a top-level set of invariants to enforce StreamEngine expectations.
+    with stream.StreamEngineInvariants.wrap(stream_engine) as stream_engine:
+      try:
+        run_args = (
+            properties, stream_engine,
+            step_runner.SubprocessStepRunner(stream_engine), universe_view)
+        run_kwargs = {
+          'emit_initial_properties': emit_initial_properties,
+          'profiler': profiler,
+        }
+        if profiler:
+          ret = profiler.runcall(run_steps, *run_args, **run_kwargs)
+        else:
+          ret = run_steps(*run_args, **run_kwargs)
+      finally:
+        os.chdir(old_cwd)
+
+      if profiler:
+        profiler.report(args.profile, profiling.Attributor(
+            package_deps.packages), sys.stderr)
+
+      return handle_recipe_return(ret, args.output_result_json, stream_engine)
+  finally:
+    if outstream is not sys.stdout:
+      outstream.close()
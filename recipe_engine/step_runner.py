@@ -258,6 +258,9 @@ class SubprocessStepRunner(StepRunner):
              '--output-result-json=%s' % f.name, recipe]
       cmd.extend(['%s=%s' % (k,repr(v)) for k, v in properties.iteritems()])
 
+      # The sub-recipe writes directly to our stdout, so make sure everything
+      # we've emitted so far gets there first.
+      self._stream_engine.flush()
       retcode = subprocess42.call(cmd)
       result = json.load(f)
       if retcode != 0:
@@ -589,10 +592,17 @@ class SimulationStepRunner(StepRunner):
   values.
   """
 
-  def __init__(self, stream_engine, test_data, annotator):
+  def __init__(self, stream_engine, test_data, recorder):
+    """
+    Args:
+      stream_engine (StreamEngine): The stream engine for the steps.
+      test_data (TestData): The test data for this run.
+      recorder (test.SimulationStreamEngine): The engine which records the
+        output of each step, to be included in the expectations.
+    """
     self._test_data = test_data
     self._stream_engine = stream_engine
-    self._annotator = annotator
+    self._recorder = recorder
     self._step_history = collections.OrderedDict()
 
   @property
@@ -637,16 +647,12 @@ class SimulationStepRunner(StepRunner):
       def finalize(inner):
         rs = rendered_step
 
-        # note that '~' sorts after 'z' so that this will be last on each
-        # step. also use _step to get access to the mutable step
-        # dictionary.
-        buf = self._annotator.step_buffer(rs.config.name)
-        lines = filter(None, buf.getvalue()).splitlines()
-        lines = [stream.encode_str(x) for x in lines]
-        if lines:
+        # The records are only rendered to followup annotations in steps_ran.
+        records = self._recorder.step_records(rs.config.name)
+        if records:
           # This magically floats into step_history, which we have already
           # added step_config to.
-          rs = rs._replace(followup_annotations=lines)
+          rs = rs._replace(followup_annotations=records)
         step_stream.close()
         self._step_history[rs.config.name] = rs
 
@@ -673,7 +679,9 @@ class SimulationStepRunner(StepRunner):
   def _rendered_step_to_dict(self, rs):
     d = rs.config.render_to_dict()
     if rs.followup_annotations:
-      d['~followup_annotations'] = rs.followup_annotations
+      # note that '~' sorts after 'z' so that this will be last on each step.
+      d['~followup_annotations'] = self._recorder.render_followup_annotations(
+          rs.followup_annotations)
     return d
 
   @property
@@ -692,8 +700,9 @@ Placeholders = collections.namedtuple('Placeholders',
 # Fields:
 #   config (recipe_api.StepClient.StepConfig): The step configuration.
 #   placeholders (Placeholders): Placeholders for this rendered step.
-#   followup_annotations (list): A list of followup annotation, populated during
-#       simulation test.
+#   followup_annotations (list): The records of what the step emitted to its
+#       stream, populated during simulation test. See
+#       SimulationStreamEngine.render_followup_annotations.
 RenderedStep = collections.namedtuple('RenderedStep',
     ('config', 'placeholders', 'followup_annotations'))
 
@@ -17,8 +17,11 @@ Stream is a virtual well-behaved stream (associated with an Engine) which you
 can just write to without worrying.
 """
 
+import collections
 import json
+import os
 import tempfile
+import threading
 import time
 
 from . import recipe_api
@@ -118,6 +121,10 @@ class StreamEngine(object):
   def open(self):
     pass
 
+  def flush(self):
+    """Blocks until everything emitted so far has reached the output."""
+    pass
+
   def close(self):
     pass
 
@@ -191,6 +198,10 @@ class ProductStreamEngine(StreamEngine):
     self._engine_a.open()
     self._engine_b.open()
 
+  def flush(self):
+    self._engine_a.flush()
+    self._engine_b.flush()
+
   def close(self):
     self._engine_a.close()
     self._engine_b.close()
@@ -303,6 +314,13 @@ class AnnotatorStreamEngine(StreamEngine):
     self.output_current_time()
     self.output_root_annotation('HONOR_ZERO_RETURN_CODE')
 
+  def flush(self):
+    super(AnnotatorStreamEngine, self).flush()
+    if isinstance(self._outstream, AsyncOutstream):
+      self._outstream.drain()
+    else:
+      self._outstream.flush()
+
   def close(self):
     super(AnnotatorStreamEngine, self).close()
     self.output_current_time()
@@ -496,6 +514,156 @@ class QuietAnnotatorStreamEngine(AnnotatorStreamEngine):
           self._log_name, self._quiet_log_location))
 
 
+class AsyncOutstream(object):
+  """A write-only file-like object which forwards writes to "outstream" from a
+  background thread.
+
+  Writes are never blocked by a slow consumer of "outstream". Up to
+  "max_buffer_bytes" of pending output is held in memory; anything beyond
+  that is spilled to a temporary file (in "spill_dir") and replayed once the
+  consumer catches up. Output is always forwarded in the order it was written.
+
+  flush() is a no-op for the writer; the background thread flushes
+  "outstream" whenever it runs out of pending output. Use drain() to wait for
+  all pending output to be written.
+  """
+
+  # The amount of spilled output to read back from disk at a time.
+  _SPILL_CHUNK = 64 * 1024
+
+  def __init__(self, outstream, max_buffer_bytes=4 * 1024 * 1024,
+               spill_dir=None):
+    self._outstream = outstream
+    self._max_buffer_bytes = max_buffer_bytes
+    self._spill_dir = spill_dir
+
+    # All of the following are guarded by _cond.
+    self._cond = threading.Condition()
+    self._pending = collections.deque()
+    self._pending_bytes = 0
+    # When not None, a file which all new writes are appended to until the
+    # writer thread has replayed it completely.
+    self._spill = None
+    self._spill_read_pos = 0
+    self._spill_write_pos = 0
+    # True while the writer thread is forwarding data outside of the lock.
+    self._busy = False
+    self._closed = False
+    self._error = None
+
+    self._thread = threading.Thread(
+        target=self._writer_thread, name='AsyncOutstream')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def write(self, data):
+    if not data:
+      return
+    with self._cond:
+      assert not self._closed, 'write to closed AsyncOutstream'
+      self._raise_error()
+      if (self._spill is None and
+          self._pending_bytes + len(data) > self._max_buffer_bytes):
+        fd, path = tempfile.mkstemp(
+            prefix='recipe_output_spill.', dir=self._spill_dir)
+        # Only this object holds the file open; unlink it right away so that it
+        # does not outlive us.
+        os.unlink(path)
+        self._spill = os.fdopen(fd, 'w+b')
+        self._spill_read_pos = self._spill_write_pos = 0
+      if self._spill is not None:
+        self._spill.seek(self._spill_write_pos)
+        self._spill.write(data)
+        self._spill_write_pos += len(data)
+      else:
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+      self._cond.notify_all()
+
+  def flush(self):
+    pass
+
+  def drain(self):
+    """Blocks until all output written so far has been forwarded."""
+    with self._cond:
+      while (self._pending or self._spill is not None or self._busy) and (
+          self._error is None):
+        self._cond.wait()
+      self._raise_error()
+
+  def close(self):
+    """Drains all pending output and stops the background thread."""
+    with self._cond:
+      if self._closed:
+        return
+      self._closed = True
+      self._cond.notify_all()
+    self._thread.join()
+    self._raise_error()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, _exc_type, _exc_val, _exc_tb):
+    self.close()
+
+  def _raise_error(self):
+    if self._error is not None:
+      raise self._error
+
+  def _next_chunk(self):
+    """Returns the next piece of output to forward, or None if there is
+    nothing to forward right now.
+
+    Must be called with _cond held.
+    """
+    if self._pending:
+      data = self._pending.popleft()
+      self._pending_bytes -= len(data)
+      return data
+    if self._spill is not None:
+      self._spill.seek(self._spill_read_pos)
+      data = self._spill.read(
+          min(self._SPILL_CHUNK, self._spill_write_pos - self._spill_read_pos))
+      self._spill_read_pos += len(data)
+      if self._spill_read_pos == self._spill_write_pos:
+        # Caught up; go back to buffering in memory.
+        self._spill.close()
+        self._spill = None
+      return data
+    return None
+
+  def _writer_thread(self):
+    while True:
+      with self._cond:
+        self._busy = False
+        data = self._next_chunk()
+        while data is None:
+          self._cond.notify_all()
+          if self._closed:
+            return
+          self._cond.wait()
+          data = self._next_chunk()
+        self._busy = True
+
+      try:
+        self._outstream.write(data)
+        with self._cond:
+          idle = not self._pending and self._spill is None
+        if idle:
+          self._outstream.flush()
+      except Exception as ex:  # pylint: disable=broad-except
+        with self._cond:
+          self._error = ex
+          self._busy = False
+          self._pending.clear()
+          self._pending_bytes = 0
+          if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+          self._cond.notify_all()
+        return
+
 
 def encode_str(s):
   """Tries to encode a string into a python str type.
@@ -15,26 +15,41 @@ import difflib
 import errno
 import fnmatch
 import functools
+import gzip
+import hashlib
 import json
 import multiprocessing
+import multiprocessing.connection
 import os
 import pdb
 import pprint
 import re
+import select
 import shutil
 import signal
 import sys
 import tempfile
+import time
 import traceback
 
 import coverage
 
+from coverage.files import PathAliases
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows.
+  resource = None
+
 from google.protobuf import json_format
 
 from . import checker
 from . import config_types
 from . import loader
 from . import package
+from . import post_process
+from . import profiling
 from . import run
 from . import step_runner
 from . import stream
@@ -59,6 +74,12 @@ _GEN_TEST_CACHE = {}
 # These are modes that various functions in this file switch on.
 _MODE_TEST, _MODE_TRAIN, _MODE_DEBUG = range(3)
 
+# Whether training writes compressed expectation files (see
+# _dump_expectation). None keeps the format of the existing files, and writes
+# new ones uncompressed. Like _UNIVERSE_VIEW, this is set before the workers
+# are forked.
+_COMPRESS_EXPECTATIONS = None
+
 
 # Allow regex patterns to be 'deep copied' by using them as-is.
 copy._deepcopy_dispatch[re._pattern_type] = copy._deepcopy_atomic
@@ -159,11 +180,17 @@ class TestResult(object):
   """Result of running a test."""
 
   def __init__(self, test_description, failures, coverage_data,
-               generates_expectation):
+               generates_expectation, profile_stats=None,
+               compressed_expectation=False):
     self.test_description = test_description
     self.failures = failures
     self.coverage_data = coverage_data
     self.generates_expectation = generates_expectation
+    # Whether the expectation is in the compressed expectation file.
+    self.compressed_expectation = compressed_expectation
+    # The cProfile stats of the test (see profiling.profile_call), if it was
+    # profiled.
+    self.profile_stats = profile_stats
 
 
 class TestDescription(object):
@@ -186,6 +213,16 @@ class TestDescription(object):
     name = ''.join('_' if c in '<>:"\\/|?*\0' else c for c in self.test_name)
     return os.path.join(self.expect_dir, name + '.json')
 
+  @property
+  def compressed_expectation_path(self):
+    return self.expectation_path + '.gz'
+
+  def expectation_file(self, compressed):
+    """Returns the path of the expectation file in the given format."""
+    if compressed:
+      return self.compressed_expectation_path
+    return self.expectation_path
+
 
 @contextlib.contextmanager
 def maybe_debug(break_funcs, enable):
@@ -231,19 +268,58 @@ def maybe_debug(break_funcs, enable):
     debugger.interaction(None, t)
 
 
+def _dump_expectation(obj, compressed):
+  """Serializes the expectation |obj|.
+
+  Uncompressed expectations are indented so that they diff well in code
+  review. Compressed ones are canonical compact JSON; they are gzipped on disk,
+  and decompressed and indented again to show differences.
+  """
+  if compressed:
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+  return json.dumps(obj, sort_keys=True, indent=2, separators=(',', ': '))
+
+
+def _read_expectation(test_description):
+  """Returns (contents, compressed) of the expectation file of the test, or
+  (None, False) if it has none.
+
+  If both exist, the compressed file takes precedence, and the other one is
+  reported as unused.
+  """
+  path = test_description.compressed_expectation_path
+  if os.path.exists(path):
+    with gzip.open(path, 'rb') as f:
+      return f.read(), True
+  path = test_description.expectation_path
+  if os.path.exists(path):
+    with open(path) as f:
+      return f.read(), False
+  return None, False
+
+
+def _write_expectation(path, contents, compressed):
+  with open(path, 'wb') as f:
+    if compressed:
+      # Leave out the name and time of the file, so that the same expectation
+      # always compresses to the same bytes.
+      with gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0) as gz:
+        gz.write(contents)
+    else:
+      f.write(contents)
+
+
 def run_test(test_description, mode):
   """Runs a test. Returns TestResults object."""
-  expected = None
-  if os.path.exists(test_description.expectation_path):
-    try:
-      with open(test_description.expectation_path) as f:
-        expected = f.read()
-    except Exception:
-      if mode == _MODE_TRAIN:
-        # Ignore errors when training; we're going to overwrite the file anyway.
-        expected = None
-      else:
-        raise
+  try:
+    expected, compressed = _read_expectation(test_description)
+  except Exception:
+    if mode != _MODE_TRAIN:
+      raise
+    # Ignore errors when training; we're going to overwrite the file anyway.
+    expected, compressed = None, False
+  if mode == _MODE_TRAIN and _COMPRESS_EXPECTATIONS is not None:
+    compressed = _COMPRESS_EXPECTATIONS
 
   break_funcs = [
     _UNIVERSE_VIEW.load_recipe(test_description.recipe_name).run_steps,
@@ -261,9 +337,7 @@ def run_test(test_description, mode):
     return TestResult(
         test_description, [CrashFailure(ex)], coverage.CoverageData(), False)
 
-  actual = json.dumps(
-      re_encode(actual_obj), sort_keys=True, indent=2,
-      separators=(',', ': '))
+  actual = _dump_expectation(re_encode(actual_obj), compressed)
 
   failures = []
 
@@ -283,9 +357,12 @@ def run_test(test_description, mode):
         except OSError as e:
           if e.errno != errno.EEXIST:
             raise e
-        with open(test_description.expectation_path, 'wb') as f:
-          f.write(actual)
+        _write_expectation(
+            test_description.expectation_file(compressed), actual, compressed)
       else:
+        if compressed:
+          expected = _dump_expectation(json.loads(expected), False)
+          actual = _dump_expectation(re_encode(actual_obj), False)
         diff = '\n'.join(difflib.unified_diff(
             unicode(expected).splitlines(),
             unicode(actual).splitlines(),
@@ -303,7 +380,8 @@ def run_test(test_description, mode):
   sys.stdout.flush()
 
   return TestResult(test_description, failures, coverage_data,
-                    actual_obj is not None)
+                    actual_obj is not None,
+                    compressed_expectation=compressed)
 
 
 def run_recipe(recipe_name, test_name, covers, enable_coverage=True):
@@ -315,14 +393,15 @@ def run_recipe(recipe_name, test_name, covers, enable_coverage=True):
     - coverage data
   """
   config_types.ResetTostringFns()
+  post_process.ResetStepInfoCache()
 
   # Grab test data from the cache. This way it's only generated once.
   test_data = _GEN_TEST_CACHE[(recipe_name, test_name)]
 
-  annotator = SimulationAnnotatorStreamEngine()
-  with stream.StreamEngineInvariants.wrap(annotator) as stream_engine:
+  recorder = SimulationStreamEngine()
+  with stream.StreamEngineInvariants.wrap(recorder) as stream_engine:
     runner = step_runner.SimulationStepRunner(
-        stream_engine, test_data, annotator)
+        stream_engine, test_data, recorder)
 
     props = test_data.properties.copy()
     props['recipe'] = recipe_name
@@ -629,9 +708,457 @@ def worker(f):
 
 
 @worker
-def run_worker(test, mode):
-  """Worker for 'run' command (note decorator above)."""
-  return run_test(test, mode)
+def run_worker(test, mode, profile_test=False):
+  """Worker for 'run' command (note decorator above).
+
+  If |profile_test|, the test runs under cProfile.
+  """
+  if not profile_test:
+    return run_test(test, mode)
+  result, stats = profiling.profile_call(run_test, test, mode)
+  result.profile_stats = stats
+  return result
+
+
+def _rss_mb():
+  """Returns the resident set size of this process in MB, or None if it can't
+  be measured on this platform.
+
+  This is the current RSS where /proc is available, and the peak RSS otherwise.
+  """
+  if resource is None:
+    return None
+  try:
+    with open('/proc/self/statm') as f:
+      pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / (1024.0 * 1024.0)
+  except (IOError, ValueError, IndexError):
+    pass
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is in bytes on Mac, and in kilobytes elsewhere.
+  return peak / (1024.0 * (1024.0 if sys.platform == 'darwin' else 1.0))
+
+
+class _MemoryGrowth(object):
+  """Tracks how much the RSS of this process grew since it was created.
+
+  A forked worker starts out sharing all the memory of its parent (e.g. the
+  loaded recipes and generated tests), and that memory counts towards its RSS
+  too. Only the growth on top of it is what the worker itself used.
+  """
+
+  def __init__(self):
+    self._start = _rss_mb()
+    self.peak = None if self._start is None else 0.0
+
+  def update(self):
+    """Measures the growth now, and returns the peak growth (MB) so far, or
+    None if the RSS can't be measured."""
+    if self.peak is not None:
+      self.peak = max(self.peak, _rss_mb() - self._start)
+    return self.peak
+
+
+def _worker_main(conn, mode, max_tests, max_rss_mb, profile_tests):
+  """Main function of the worker processes of _run_in_workers.
+
+  Runs the (index, test) tasks received on |conn| until it gets None, or until
+  it has run |max_tests| tests or its RSS grew by |max_rss_mb| since it was
+  forked (0 disables either limit). Sends back (peak RSS growth, retiring,
+  index, result) for every test.
+  """
+  count = 0
+  growth = _MemoryGrowth()
+  while True:
+    task = conn.recv()
+    if task is None:
+      return
+    index, test = task
+    result = run_worker(test, mode, profile_tests)
+    count += 1
+    rss = growth.update()
+    retiring = bool(
+        (max_tests and count >= max_tests) or
+        (max_rss_mb and rss is not None and rss >= max_rss_mb))
+    conn.send((rss, retiring, index, result))
+    if retiring:
+      return
+
+
+def _start_worker_process(mode, max_tests, max_rss_mb, profile_tests):
+  """Forks a worker process running _worker_main with these arguments, and
+  returns (process, connection to it)."""
+  conn, child_conn = multiprocessing.Pipe()
+  proc = multiprocessing.Process(
+      target=_worker_main,
+      args=(child_conn, mode, max_tests, max_rss_mb, profile_tests))
+  proc.daemon = True
+  proc.start()
+  child_conn.close()
+  return proc, conn
+
+
+def _wait_for_any(conns, timeout):
+  """Returns the multiprocessing connections in |conns| which have something
+  to receive (or were closed), waiting up to |timeout| seconds for one.
+
+  Returns no connections if the wait was interrupted by a signal (e.g. ctrl-c
+  setting the kill switch).
+  """
+  if not sys.platform.startswith(('win', 'cygwin')):
+    try:
+      return select.select(conns, [], [], timeout)[0]
+    except select.error as ex:
+      if ex.args[0] != errno.EINTR:
+        raise
+      return []
+  # Pipes can't be selected on Windows, so poll them in turns.
+  deadline = time.time() + timeout
+  while True:
+    ready = [conn for conn in conns if conn.poll()]
+    if ready or time.time() >= deadline:
+      return ready
+    time.sleep(0.001)
+
+
+def _test_failed(result):
+  """Returns whether the run_worker |result| is a failure."""
+  success, _, details = result
+  return not success or bool(details.failures)
+
+
+def _run_in_workers(tests, mode, jobs, max_tests=0, max_rss_mb=0,
+                    remote_workers=(), profile_tests=False, fail_fast=0):
+  """Runs |tests| with run_worker in up to |jobs| worker processes, and on the
+  connections to remote workers in |remote_workers| (see
+  connect_remote_worker).
+
+  A worker is replaced by a new one once it has run |max_tests| tests, or its
+  RSS grew by |max_rss_mb| (0 disables either limit), so that the caches
+  the workers build up while running tests don't grow with the size of the
+  suite. The workers are forked from this process, which has already loaded
+  the recipes and generated the tests, so the new ones start out warm.
+
+  If |profile_tests|, the local workers profile every test (see run_worker).
+
+  Once |fail_fast| tests failed (0 for never), or the kill switch is set, no
+  more tests are started; the results of the tests which didn't run are None.
+
+  Every worker has its own pipe, so that a worker which gets killed (e.g. for
+  using too much memory) can't take a lock shared with the other workers down
+  with it. Its test is reported as failed. Remote workers speak the same
+  protocol over their connection. They are never replaced, and the test of a
+  remote worker which disconnects is run by another worker instead.
+
+  Returns (results, peak_rss):
+    results (list): The results of run_worker, in the same order as |tests|.
+    peak_rss (list(float)): The peak RSS growth in MB of each worker which
+      could measure it (see _MemoryGrowth).
+  """
+  pending = collections.deque(enumerate(tests))
+  results = [None] * len(tests)
+  # connection -> [process (None if remote), (index, test) it's running,
+  #                peak RSS growth]
+  workers = {}
+  peak_rss = []
+  failures = [0]
+
+  def record(index, result):
+    results[index] = result
+    if fail_fast and _test_failed(result):
+      failures[0] += 1
+      if failures[0] >= fail_fast:
+        pending.clear()
+
+  def start_worker():
+    proc, conn = _start_worker_process(
+        mode, max_tests, max_rss_mb, profile_tests)
+    workers[conn] = [proc, None, None]
+    assign(conn)
+
+  def assign(conn):
+    if _KILL_SWITCH.is_set():
+      # ctrl-c: the workers finish the tests they're running, and stop.
+      pending.clear()
+    task = pending.popleft() if pending else None
+    workers[conn][1] = task
+    try:
+      conn.send(task)
+    except IOError:
+      # The worker died between two tests; give the test to another one.
+      if task is not None:
+        pending.appendleft(task)
+      task = None
+    if task is None:
+      stop(conn)
+
+  def stop(conn):
+    """Waits for the worker on |conn| to exit."""
+    proc, _, rss = workers.pop(conn)
+    conn.close()
+    if proc is not None:
+      proc.join()
+    if rss is not None:
+      peak_rss.append(rss)
+    # Only local workers are replaced, unless there are no workers left at
+    # all.
+    if pending and (proc is not None or not workers):
+      start_worker()
+
+  for conn in remote_workers:
+    workers[conn] = [None, None, None]
+    assign(conn)
+  for _ in xrange(min(max(jobs, 0 if remote_workers else 1), len(pending))):
+    start_worker()
+
+  while workers:
+    for conn in _wait_for_any(workers.keys(), 1):
+      try:
+        rss, retiring, index, result = conn.recv()
+      except (EOFError, IOError):
+        proc, task, _ = workers[conn]
+        if proc is None:
+          # Another worker runs the test instead, unless --fail-fast already
+          # stopped starting tests.
+          if not (fail_fast and failures[0] >= fail_fast):
+            pending.appendleft(task)
+          stop(conn)
+        else:
+          proc.join()
+          record(task[0], (False, task[1],
+                           'worker process died (exit code %s)' % (
+                               proc.exitcode,)))
+          stop(conn)
+        continue
+      record(index, result)
+      if rss is not None:
+        workers[conn][2] = rss
+      if retiring:
+        stop(conn)
+      else:
+        assign(conn)
+
+  return results, peak_rss
+
+
+# The environment variable with the key which coordinators and remote workers
+# authenticate each other with.
+_REMOTE_AUTHKEY_ENV = 'RECIPES_TEST_AUTHKEY'
+
+
+def parse_remote_address(address):
+  """Parses a remote worker address, which is either HOST:PORT for TCP, or the
+  path of a Unix socket."""
+  host, sep, port = address.rpartition(':')
+  if sep and port.isdigit():
+    return (host, int(port))
+  return address
+
+
+def _format_remote_address(address):
+  if isinstance(address, tuple):
+    return '%s:%d' % address
+  return address
+
+
+def _remote_authkey():
+  authkey = os.environ.get(_REMOTE_AUTHKEY_ENV)
+  if not authkey:
+    raise ValueError(
+        '$%s must be set to the same secret for the coordinator and its '
+        'remote workers' % _REMOTE_AUTHKEY_ENV)
+  return authkey
+
+
+def _package_revisions():
+  """Returns {package name: revision} for the pinned dependencies of the
+  package under test."""
+  return {
+    p.name: p.repo_spec.revision
+    for p in _UNIVERSE_VIEW.universe.package_deps.packages
+    if isinstance(p.repo_spec, package.GitRepoSpec)
+  }
+
+
+def _package_fingerprint(pkg):
+  """Returns a hash of the contents of the recipes and recipe modules of |pkg|,
+  including their expectations.
+
+  Unlike package._tree_fingerprint this only depends on file names and contents
+  (not mtimes), so that it matches for identical checkouts on different
+  machines.
+  """
+  h = hashlib.sha1()
+  for top in (pkg.recipe_dir, pkg.module_dir):
+    for root, dirs, files in os.walk(top):
+      dirs.sort()
+      for f in sorted(files):
+        if f.endswith('.pyc'):
+          continue
+        path = os.path.join(root, f)
+        with open(path, 'rb') as fh:
+          data = fh.read()
+        h.update('%s\0%d\0' % (
+            os.path.relpath(path, pkg.recipes_dir).replace(os.sep, '/'),
+            len(data)))
+        h.update(data)
+  return h.hexdigest()
+
+
+def connect_remote_worker(address):
+  """Connects to the remote worker listening on |address| (see
+  parse_remote_address), and returns the connection for _run_in_workers.
+
+  Raises ValueError if the worker can't run the tests of this package.
+  """
+  conn = multiprocessing.connection.Client(
+      parse_remote_address(address), authkey=_remote_authkey())
+  root_package = _UNIVERSE_VIEW.universe.package_deps.root_package
+  conn.send({
+    'revisions': _package_revisions(),
+    'fingerprint': _package_fingerprint(root_package),
+    'recipes_dir': root_package.recipes_dir,
+  })
+  error = conn.recv()
+  if error:
+    conn.close()
+    raise ValueError('remote worker %s: %s' % (address, error))
+  return conn
+
+
+def _serve_coordinator(conn, tests_by_name, revisions, fingerprint,
+                       recipes_dir, max_tests=0, max_rss_mb=0):
+  """Runs tests for the coordinator on |conn| until it's done.
+
+  The coordinator is turned away unless it tests the same package, i.e. the
+  pinned dependencies and the recipes, modules and expectations of the package
+  itself are the same.
+
+  The tests run one at a time in a forked worker process, just like the local
+  workers of _run_in_workers: a test which crashes the interpreter only fails
+  itself, and the worker process is replaced once it has run |max_tests| tests
+  or its RSS grew by |max_rss_mb| (0 disables either limit).
+
+  Args:
+    conn (multiprocessing.connection.Connection): The coordinator.
+    tests_by_name (dict(str, TestDescription)): All the tests of this package.
+    revisions (dict): The _package_revisions of this package.
+    fingerprint (str): The _package_fingerprint of this package.
+    recipes_dir (str): The recipes_dir of this package.
+    max_tests (int): See above.
+    max_rss_mb (int): See above.
+  """
+  hello = conn.recv()
+  if hello['revisions'] != revisions:
+    conn.send('package revisions differ (coordinator %r, worker %r)' % (
+        hello['revisions'], revisions))
+    return
+  if hello['fingerprint'] != fingerprint:
+    conn.send('the recipes, modules or expectations of the package under test '
+              'differ from the ones of the coordinator')
+    return
+  conn.send(None)
+
+  # Report coverage with the paths of the coordinator's checkout.
+  aliases = PathAliases()
+  aliases.add(recipes_dir, hello['recipes_dir'])
+
+  # The (process, connection) of the worker process, once there is one.
+  worker = None
+  try:
+    while True:
+      task = conn.recv()
+      if task is None:
+        return
+      index, test = task
+      local_test = tests_by_name.get(test.full_name)
+      if local_test is None:
+        conn.send((None, False, index, (
+            False, test, 'remote worker has no test %s' % test.full_name)))
+        continue
+
+      if worker is None:
+        worker = _start_worker_process(_MODE_TEST, max_tests, max_rss_mb, False)
+      proc, worker_conn = worker
+      try:
+        worker_conn.send((index, local_test))
+        rss, retiring, _, result = worker_conn.recv()
+      except (EOFError, IOError):
+        proc.join()
+        rss, retiring = None, True
+        result = (False, local_test, 'worker process died (exit code %s)' % (
+            proc.exitcode,))
+      if retiring:
+        worker_conn.close()
+        proc.join()
+        worker = None
+
+      success, _, details = result
+      if success:
+        coverage_data = coverage.CoverageData()
+        coverage_data.update(details.coverage_data, aliases=aliases)
+        details.test_description = test
+        details.coverage_data = coverage_data
+      conn.send((rss, False, index, (success, test, details)))
+  finally:
+    if worker is not None:
+      proc, worker_conn = worker
+      try:
+        worker_conn.send(None)
+      except IOError:
+        pass
+      worker_conn.close()
+      proc.join()
+
+
+def run_remote_worker(address, once, max_tests=0, max_rss_mb=0):
+  """Implementation of the 'worker' command.
+
+  Listens on |address| for coordinators (`test run --remote-worker`), and runs
+  their tests one coordinator at a time, or only for the first one if |once|.
+  The worker processes running the tests are limited by |max_tests| and
+  |max_rss_mb| (see _serve_coordinator).
+  """
+  try:
+    authkey = _remote_authkey()
+  except ValueError as ex:
+    print('ERROR: %s' % ex)
+    return 1
+
+  tests, _coverage_data, _uncovered_modules = get_tests()
+  tests_by_name = {t.full_name: t for t in tests}
+  revisions = _package_revisions()
+  root_package = _UNIVERSE_VIEW.universe.package_deps.root_package
+  fingerprint = _package_fingerprint(root_package)
+
+  listener = multiprocessing.connection.Listener(
+      parse_remote_address(address), authkey=authkey)
+  try:
+    print('Listening on %s' % _format_remote_address(listener.address))
+    sys.stdout.flush()
+    while True:
+      try:
+        conn = listener.accept()
+      except multiprocessing.AuthenticationError as ex:
+        print('Rejected coordinator: %s' % ex)
+        continue
+      try:
+        if _package_fingerprint(root_package) != fingerprint:
+          # The loaded recipes and generated tests are out of date.
+          conn.recv()
+          conn.send('the checkout of the worker changed since it started')
+          print('ERROR: the checkout changed since the worker started')
+          return 1
+        _serve_coordinator(conn, tests_by_name, revisions, fingerprint,
+                           root_package.recipes_dir, max_tests, max_rss_mb)
+      except (EOFError, IOError):
+        print('Lost connection to coordinator')
+      finally:
+        conn.close()
+      if once:
+        return 0
+  finally:
+    listener.close()
 
 
 def scan_for_expectations(root, inside_expectations=False):
@@ -652,25 +1179,87 @@ def scan_for_expectations(root, inside_expectations=False):
     if os.path.isdir(full_entry):
       collected_expectations.add(full_entry)
       for subentry in os.listdir(full_entry):
-        if not subentry.endswith('.json'):
+        if not subentry.endswith(('.json', '.json.gz')):
           continue
         full_subentry = os.path.join(full_entry, subentry)
         collected_expectations.add(full_subentry)
-    elif entry.endswith('.json'):
+    elif entry.endswith(('.json', '.json.gz')):
       collected_expectations.add(full_entry)
   return collected_expectations
 
 
-def run_train(package_deps, gen_docs, test_filter, jobs, json_file):
-  rc = run_run(test_filter, jobs, json_file, _MODE_TRAIN)
+def run_train(package_deps, gen_docs, test_filter, jobs, json_file,
+              max_worker_tests=0, max_worker_rss=0, compress_expectations=None,
+              fail_fast=0, failed_first=False):
+  global _COMPRESS_EXPECTATIONS
+  _COMPRESS_EXPECTATIONS = compress_expectations
+  rc = run_run(test_filter, jobs, json_file, _MODE_TRAIN,
+               max_worker_tests, max_worker_rss, fail_fast=fail_fast,
+               failed_first=failed_first)
   if rc == 0 and gen_docs:
     print('Generating README.recipes.md')
     doc.regenerate_docs(_UNIVERSE_VIEW, package_deps)
   return rc
 
 
-def run_run(test_filter, jobs, json_file, mode):
-  """Implementation of the 'run' command."""
+def _last_failures_path():
+  return os.path.join(
+      _UNIVERSE_VIEW.universe.package_deps.root_package.recipes_dir,
+      '.recipe_deps', 'last_test_failures.json')
+
+
+def _load_last_failures():
+  """Returns the set of the names of the tests which failed in the last run
+  (see _save_last_failures)."""
+  try:
+    with open(_last_failures_path()) as f:
+      return set(json.load(f))
+  except (IOError, ValueError):
+    return set()
+
+
+def _save_last_failures(last_failures, results):
+  """Updates the tests which failed in the last run with |results|, given the
+  previous |last_failures|.
+
+  The previous failures which didn't run this time (because they were
+  filtered out, or because of --fail-fast) are kept.
+  """
+  failures = set(last_failures)
+  for result in results:
+    if result is not None:
+      name = result[1].full_name
+      if _test_failed(result):
+        failures.add(name)
+      else:
+        failures.discard(name)
+  if failures == last_failures:
+    return
+  path = _last_failures_path()
+  try:
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+      json.dump(sorted(failures), f, indent=2, separators=(',', ': '))
+  except (IOError, OSError) as ex:
+    print('WARNING: could not save the failed tests to %s: %s' % (path, ex))
+
+
+def run_run(test_filter, jobs, json_file, mode, max_worker_tests=0,
+            max_worker_rss=0, remote_workers=(), profile_path=None,
+            fail_fast=0, failed_first=False):
+  """Implementation of the 'run' command.
+
+  Workers are replaced once they ran |max_worker_tests| tests or their RSS
+  grew by |max_worker_rss| MB (0 disables either limit). Tests are also
+  sent to the remote workers at the addresses in |remote_workers|. If
+  |profile_path| is set, the tests run locally are profiled, and the profile is
+  written there.
+
+  Once |fail_fast| tests failed (0 for never), the remaining tests are
+  skipped. If |failed_first|, the tests which failed in the last run are run
+  before the others.
+  """
   start_time = datetime.datetime.now()
 
   rc = 0
@@ -678,6 +1267,15 @@ def run_run(test_filter, jobs, json_file, mode):
   results_proto.version = 1
   results_proto.valid = True
 
+  remote_conns = []
+  try:
+    for address in remote_workers:
+      remote_conns.append(connect_remote_worker(address))
+  except (ValueError, IOError, EOFError,
+          multiprocessing.AuthenticationError) as ex:
+    print('ERROR: %s' % ex)
+    return 1
+
   tests, coverage_data, uncovered_modules = get_tests(test_filter)
   if uncovered_modules and not test_filter:
     rc = 1
@@ -685,26 +1283,46 @@ def run_run(test_filter, jobs, json_file, mode):
     print('ERROR: The following modules lack test coverage: %s' % (
         ','.join(uncovered_modules)))
 
+  last_failures = _load_last_failures()
+  if failed_first:
+    # sorted() is stable, so the tests keep their order otherwise.
+    tests = sorted(tests, key=lambda t: t.full_name not in last_failures)
+
+  peak_rss = []
   if mode == _MODE_DEBUG:
-    results = []
-    for t in tests:
-      results.append(run_worker(t, mode))
+    results = [None] * len(tests)
+    failures = 0
+    for i, t in enumerate(tests):
+      results[i] = run_worker(t, mode)
+      failures += _test_failed(results[i])
+      if fail_fast and failures >= fail_fast:
+        break
   else:
     with kill_switch():
-      pool = multiprocessing.Pool(jobs)
-      # the 'mode=mode' is necessary, because we want a function call like:
-      #   func(test) -> run_worker(test, mode)
-      # if we supply 'mode' as an arg, it will end up calling:
-      #   func(test) -> run_worker(mode, test)
-      results = pool.map(functools.partial(run_worker, mode=mode), tests)
+      results, peak_rss = _run_in_workers(
+          tests, mode, jobs, max_worker_tests, max_worker_rss, remote_conns,
+          profile_tests=bool(profile_path), fail_fast=fail_fast)
+  _save_last_failures(last_failures, results)
 
   print()
 
+  skipped = results.count(None)
+  if skipped:
+    print('NOTE: skipped %d tests after %d failures (--fail-fast)' % (
+        skipped, fail_fast))
+    results = [r for r in results if r is not None]
+
   used_expectations = set()
 
+  attributor = profiling.Attributor(
+      _UNIVERSE_VIEW.universe.package_deps.packages)
+  simulation_profile = profiling.SimulationProfile()
+
   for success, test_description, details in results:
     if success:
       assert isinstance(details, TestResult)
+      simulation_profile.add_test(
+          test_description.full_name, details.profile_stats, attributor)
       if details.failures:
         rc = 1
         key = details.test_description.full_name
@@ -714,9 +1332,10 @@ def run_run(test_filter, jobs, json_file, mode):
           print(failure.format())
       coverage_data.update(details.coverage_data)
       if details.generates_expectation:
-        used_expectations.add(details.test_description.expectation_path)
-        used_expectations.add(
-            os.path.dirname(details.test_description.expectation_path))
+        expectation_path = details.test_description.expectation_file(
+            details.compressed_expectation)
+        used_expectations.add(expectation_path)
+        used_expectations.add(os.path.dirname(expectation_path))
     else:
       rc = 1
       results_proto.valid = False
@@ -730,6 +1349,8 @@ def run_run(test_filter, jobs, json_file, mode):
 
   if test_filter:
     print('NOTE: not checking coverage, because a filter is enabled')
+  elif skipped:
+    print('NOTE: not checking coverage, because tests were skipped')
   else:
     try:
       # TODO(phajdan.jr): Add API to coverage to load data from memory.
@@ -765,6 +1386,9 @@ def run_run(test_filter, jobs, json_file, mode):
   if test_filter:
     print('NOTE: not checking for unused expectations, '
           'because a filter is enabled')
+  elif skipped:
+    print('NOTE: not checking for unused expectations, '
+          'because tests were skipped')
   else:
     actual_expectations = set()
     if os.path.exists(_UNIVERSE_VIEW.recipe_dir):
@@ -806,7 +1430,14 @@ def run_run(test_filter, jobs, json_file, mode):
   finish_time = datetime.datetime.now()
   print('-' * 70)
   print('Ran %d tests in %0.3fs' % (
-      len(tests), (finish_time - start_time).total_seconds()))
+      len(results), (finish_time - start_time).total_seconds()))
+  if peak_rss:
+    print('Peak worker memory growth: %0.1f MB (mean %0.1f MB over %d '
+          'workers)' % (max(peak_rss), sum(peak_rss) / len(peak_rss),
+                        len(peak_rss)))
+  if profile_path and mode != _MODE_DEBUG:
+    print()
+    simulation_profile.report(profile_path, attributor, sys.stdout)
   print()
   print('OK' if rc == 0 else 'FAILED')
 
@@ -832,20 +1463,108 @@ def run_run(test_filter, jobs, json_file, mode):
   return rc
 
 
-class SimulationAnnotatorStreamEngine(stream.AnnotatorStreamEngine):
-  """Stream engine which just records generated commands."""
+class SimulationStreamEngine(stream.StreamEngine):
+  """Stream engine which records what each step emits.
+
+  Rather than writing annotations into a text buffer per step (which then has
+  to be split back into lines), this keeps a list of records per step. They're
+  only rendered into the followup annotations (the lines which
+  AnnotatorStreamEngine would have emitted for the step) when the expectations
+  are built.
+  """
+
+  # Annotation emitted for each step status.
+  _STATUS_ANNOTATIONS = {
+    'SUCCESS': None,
+    'WARNING': 'STEP_WARNINGS',
+    'FAILURE': 'STEP_FAILURE',
+    'EXCEPTION': 'STEP_EXCEPTION',
+  }
 
   def __init__(self):
-    self._step_buffer_map = {}
-    super(SimulationAnnotatorStreamEngine, self).__init__(
-        self.step_buffer(None))
+    # step name -> [record]. A record is either (True, annotation args) or
+    # (False, line of text).
+    self._records = {}
+
+  class StepStream(stream.StreamEngine.StepStream):
+    def __init__(self, records, allow_subannotations):
+      super(SimulationStreamEngine.StepStream, self).__init__()
+      self._records = records
+      self._allow_subannotations = allow_subannotations
+
+    def annotate(self, *args):
+      self._records.append((True, args))
 
-  def step_buffer(self, step_name):
-    return self._step_buffer_map.setdefault(step_name, cStringIO.StringIO())
+    def write_line(self, line):
+      if not self._allow_subannotations and line.startswith('@@@'):
+        line = '!' + line
+      # Coerce unicode like writing it to a cStringIO would.
+      self._records.append((False, str(line)))
+
+    def close(self):
+      pass
+
+    def new_log_stream(self, log_name):
+      return SimulationStreamEngine.LogStream(self, log_name)
+
+    def add_step_text(self, text):
+      self.annotate('STEP_TEXT', text)
+
+    def add_step_summary_text(self, text):
+      self.annotate('STEP_SUMMARY_TEXT', text)
+
+    def add_step_link(self, name, url):
+      self.annotate('STEP_LINK', name, url)
+
+    def set_step_status(self, status):
+      if status not in SimulationStreamEngine._STATUS_ANNOTATIONS:
+        raise Exception('Impossible status %s' % status)
+      annotation = SimulationStreamEngine._STATUS_ANNOTATIONS[status]
+      if annotation:
+        self.annotate(annotation)
+
+    def set_build_property(self, key, value):
+      self.annotate('SET_BUILD_PROPERTY', key, value)
+
+    def trigger(self, spec):
+      self.annotate('STEP_TRIGGER', spec)
+
+    def set_manifest_link(self, name, sha256, url):
+      self.annotate('SOURCE_MANIFEST', name, sha256.encode('hex'), url)
+
+  class LogStream(stream.StreamEngine.Stream):
+    def __init__(self, step_stream, log_name):
+      self._step_stream = step_stream
+      self._log_name = log_name.replace('/', '&#x2f;')
+
+    def write_line(self, line):
+      self._step_stream.annotate('STEP_LOG_LINE', self._log_name, line)
+
+    def close(self):
+      self._step_stream.annotate('STEP_LOG_END', self._log_name)
 
   def new_step_stream(self, step_config):
-    return self._create_step_stream(step_config,
-                                    self.step_buffer(step_config.name))
+    ret = self.StepStream(self._records.setdefault(step_config.name, []),
+                          step_config.allow_subannotations)
+    if step_config.nest_level > 0:
+      ret.annotate('STEP_NEST_LEVEL', str(step_config.nest_level))
+    return ret
+
+  def step_records(self, step_name):
+    """Returns the list of records for the step |step_name|."""
+    return self._records.get(step_name, [])
+
+  @staticmethod
+  def render_followup_annotations(records):
+    """Returns (list(str)): the lines AnnotatorStreamEngine would have emitted
+    for a step with the given records."""
+    text = ''.join(
+        ('@@@%s@@@\n' % '@'.join(map(stream.encode_str, data))) if is_annotation
+        else data + '\n'
+        for is_annotation, data in records)
+    # Text may have embedded newlines, so split it up the same way the
+    # annotation stream would be.
+    return text.splitlines()
 
 
 def handle_killswitch(*_):
@@ -929,6 +1648,28 @@ def add_subparser(parser):
     '--json', metavar='FILE', type=argparse.FileType('w'),
     help='path to JSON output file')
 
+  def add_worker_limit_args(parser):
+    parser.add_argument(
+      '--max-worker-tests', metavar='N', type=int, default=1000,
+      help='replace each worker process after it ran N tests; 0 for no '
+           'limit (default %(default)s)')
+    parser.add_argument(
+      '--max-worker-rss', metavar='MB', type=int, default=1024,
+      help='replace each worker process once its memory usage grew by MB '
+           'megabytes since it was started; 0 for no limit (default '
+           '%(default)s)')
+
+  def add_failure_args(parser):
+    parser.add_argument(
+      '--fail-fast', metavar='N', type=int, default=0,
+      help='stop starting tests once N tests failed, and skip the coverage '
+           'and unused expectation checks; 0 to run all tests (default '
+           '%(default)s)')
+    parser.add_argument(
+      '--failed-first', action='store_true',
+      help='run the tests which failed in the last run (as recorded in '
+           '.recipe_deps/last_test_failures.json) before the others')
+
   glob_helpstr = (
     'glob filter for the tests to run; '
     'can be specified multiple times; '
@@ -940,11 +1681,27 @@ def add_subparser(parser):
   helpstr = 'Run the tests.'
   run_p = subp.add_parser('run', help=helpstr, description=helpstr)
   run_p.set_defaults(subfunc=lambda opts, _: run_run(
-    opts.filter, opts.jobs, opts.json, _MODE_TEST))
+    opts.filter, opts.jobs, opts.json, _MODE_TEST,
+    opts.max_worker_tests, opts.max_worker_rss, opts.remote_worker,
+    opts.profile, opts.fail_fast, opts.failed_first))
   run_p.add_argument(
     '--jobs', metavar='N', type=int,
     default=multiprocessing.cpu_count(),
     help='run N jobs in parallel (default %(default)s)')
+  add_worker_limit_args(run_p)
+  add_failure_args(run_p)
+  run_p.add_argument(
+    '--remote-worker', metavar='ADDRESS', action='append', default=[],
+    help='also run tests on the `test worker` listening on ADDRESS (HOST:PORT '
+         'or the path of a Unix socket); can be specified multiple times. '
+         'Use --jobs 0 to only run tests remotely. $%s must be set to the '
+         'secret shared with the workers.' % _REMOTE_AUTHKEY_ENV)
+  run_p.add_argument(
+    '--profile', metavar='FILE', type=os.path.abspath,
+    help='profile each test with cProfile, write the combined profile to FILE '
+         'in the pstats format, and print a summary of the slowest tests, '
+         'recipes and modules. Tests run on remote workers are not profiled, '
+         'and coverage measurement inflates the times of all tests.')
   run_p.add_argument(
     '--json', metavar='FILE', type=argparse.FileType('w'),
     help='path to JSON output file')
@@ -955,11 +1712,15 @@ def add_subparser(parser):
   helpstr = 'Re-train recipe expectations.'
   train_p = subp.add_parser('train', help=helpstr, description=helpstr)
   train_p.set_defaults(subfunc=lambda opts, pd: run_train(
-    pd, opts.docs, opts.filter, opts.jobs, opts.json))
+    pd, opts.docs, opts.filter, opts.jobs, opts.json,
+    opts.max_worker_tests, opts.max_worker_rss, opts.compress_expectations,
+    opts.fail_fast, opts.failed_first))
   train_p.add_argument(
     '--jobs', metavar='N', type=int,
     default=multiprocessing.cpu_count(),
     help='run N jobs in parallel (default %(default)s)')
+  add_worker_limit_args(train_p)
+  add_failure_args(train_p)
   train_p.add_argument(
     '--json', metavar='FILE', type=argparse.FileType('w'),
     help='path to JSON output file')
@@ -969,6 +1730,35 @@ def add_subparser(parser):
   train_p.add_argument(
     '--no-docs', action='store_false', default=True, dest='docs',
     help='Disable automatic documentation generation.')
+  compress_group = train_p.add_mutually_exclusive_group()
+  compress_group.add_argument(
+    '--compress-expectations', action='store_const', const=True,
+    help='write the expectations as gzipped canonical JSON (.json.gz), '
+         'converting existing plain ones. By default every expectation keeps '
+         'its format, and new ones are plain JSON.')
+  compress_group.add_argument(
+    '--no-compress-expectations', action='store_const', const=False,
+    dest='compress_expectations',
+    help='write the expectations as plain JSON, converting compressed ones.')
+
+  helpstr = 'Run tests for coordinators (`test run --remote-worker`).'
+  worker_p = subp.add_parser(
+    'worker', help=helpstr, description=(
+      helpstr + ' The worker runs one test at a time, in a forked worker '
+      'process which is replaced like the ones of `test run`. It uses one '
+      'core, so start one worker per core (each listening on its own address) '
+      'and pass all of their addresses to the coordinator.'))
+  worker_p.set_defaults(subfunc=lambda opts, _: run_remote_worker(
+    opts.listen, opts.once, opts.max_worker_tests, opts.max_worker_rss))
+  worker_p.add_argument(
+    '--listen', metavar='ADDRESS', required=True,
+    help='address to listen on for coordinators; HOST:PORT (port 0 picks a '
+         'free port) or the path of a Unix socket. $%s must be set to the '
+         'secret shared with the coordinators.' % _REMOTE_AUTHKEY_ENV)
+  worker_p.add_argument(
+    '--once', action='store_true',
+    help='exit after serving one coordinator')
+  add_worker_limit_args(worker_p)
 
   helpstr = 'Run the tests under debugger (pdb).'
   debug_p = subp.add_parser(
@@ -994,9 +1784,15 @@ def main(package_deps, args):
   universe = loader.RecipeUniverse(package_deps, args.package)
   universe_view = loader.UniverseView(universe, package_deps.root_package)
 
-  # Prevent flakiness caused by stale pyc files.
+  # Prevent flakiness caused by stale pyc files. Up-to-date ones are kept, so
+  # that the modules don't all need to be recompiled.
   package.cleanup_pyc(package_deps.root_package.recipes_dir)
 
+  # Failed checks look up the statements they were made from, so keep the
+  # parsed statements of those files around between runs.
+  checker.SetStatementCacheDir(os.path.join(
+      package_deps.root_package.recipes_dir, '.recipe_deps', '.checker'))
+
   global _UNIVERSE_VIEW
   _UNIVERSE_VIEW = universe_view
 
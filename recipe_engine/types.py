@@ -5,7 +5,6 @@
 import collections
 import copy
 import json
-import operator
 
 from .util import sentinel
 
@@ -25,6 +24,13 @@ def freeze(obj):
   if isinstance(obj, dict):
     return FrozenDict((freeze(k), freeze(v)) for k, v in obj.iteritems())
   elif isinstance(obj, (list, tuple)):
+    if type(obj) is tuple:
+      # Hashable tuples are already frozen all the way down.
+      try:
+        hash(obj)
+        return obj
+      except TypeError:
+        pass
     return tuple(freeze(i) for i in obj)
   elif isinstance(obj, set):
     return frozenset(freeze(i) for i in obj)
@@ -33,24 +39,45 @@ def freeze(obj):
     return obj
 
 
-class FrozenDict(collections.Mapping):
+class FrozenDict(object):
   """An immutable OrderedDict.
 
+  The items live in a plain dict, and the key order in a tuple. The hash is
+  computed once, on construction, and is used to quickly tell unequal
+  FrozenDicts apart.
+
   Modified From: http://stackoverflow.com/a/2704866
   """
+  __slots__ = ('_d', '_keys', '_hash')
+
   def __init__(self, *args, **kwargs):
-    self._d = collections.OrderedDict(*args, **kwargs)
+    if len(args) > 1:
+      raise TypeError('expected at most 1 arguments, got %d' % len(args))
+    d = {}
+    keys = []
+    for items in (args[0] if args else (), kwargs):
+      if isinstance(items, collections.Mapping):
+        items = items.iteritems()
+      for k, v in items:
+        if k not in d:
+          keys.append(k)
+        d[k] = v
+    self._d = d
+    self._keys = tuple(keys)
 
     # Calculate the hash immediately so that we know all the items are
-    # hashable too.
-    self._hash = reduce(operator.xor,
-                        (hash(i) for i in enumerate(self._d.iteritems())), 0)
+    # hashable too. It doesn't depend on the order, just like __eq__.
+    self._hash = hash(frozenset(d.iteritems()))
 
   def __eq__(self, other):
-    if not isinstance(other, collections.Mapping):
-      return NotImplemented
     if self is other:
       return True
+    if isinstance(other, FrozenDict):
+      return self._hash == other._hash and self._d == other._d
+    if isinstance(other, dict):
+      return self._d == other
+    if not isinstance(other, collections.Mapping):
+      return NotImplemented
     if len(self) != len(other):
       return False
     for k, v in self.iteritems():
@@ -58,20 +85,60 @@ class FrozenDict(collections.Mapping):
         return False
     return True
 
+  def __ne__(self, other):
+    ret = self.__eq__(other)
+    return ret if ret is NotImplemented else not ret
+
   def __iter__(self):
-    return iter(self._d)
+    return iter(self._keys)
 
   def __len__(self):
-    return len(self._d)
+    return len(self._keys)
+
+  def __contains__(self, key):
+    return key in self._d
 
   def __getitem__(self, key):
     return self._d[key]
 
+  def get(self, key, default=None):
+    return self._d.get(key, default)
+
+  def keys(self):
+    return list(self._keys)
+
+  def iterkeys(self):
+    return iter(self._keys)
+
+  def values(self):
+    return [self._d[k] for k in self._keys]
+
+  def itervalues(self):
+    return (self._d[k] for k in self._keys)
+
+  def items(self):
+    return [(k, self._d[k]) for k in self._keys]
+
+  def iteritems(self):
+    return ((k, self._d[k]) for k in self._keys)
+
   def __hash__(self):
     return self._hash
 
+  def __reduce__(self):
+    return FrozenDict, (self.items(),)
+
+  # FrozenDicts are immutable all the way down, so there's nothing to copy.
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, _memo):
+    return self
+
   def __repr__(self):
-    return 'FrozenDict(%r)' % (self._d.items(),)
+    return 'FrozenDict(%r)' % (self.items(),)
+
+collections.Mapping.register(FrozenDict)
 
 
 class StepPresentation(object):
@@ -3,12 +3,17 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 import copy
 
 from collections import OrderedDict
 
+import mock
+
 import test_env
 
 from recipe_engine import checker
@@ -173,6 +178,49 @@ class TestChecker(unittest.TestCase):
               {"targ['a'].keys()": "['sub']", 'v': "'whee'"}))
 
 
+class TestStatementCache(unittest.TestCase):
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    checker.SetStatementCacheDir(self.cache_dir)
+    checker.Checker._PARSED_FILE_CACHE.clear()
+
+  def tearDown(self):
+    checker.SetStatementCacheDir(None)
+    checker.Checker._PARSED_FILE_CACHE.clear()
+    shutil.rmtree(self.cache_dir)
+
+  def fail_check(self):
+    c = checker.Checker('<filename>', 0, lambda: None, (), {})
+    def body(check):
+      val = 'thing'
+      check(val == 'other')
+    body(c)
+    self.assertEqual(len(c.failed_checks), 1)
+    self.assertEqual(c.failed_checks[0].frames[0].code,
+                     "check((val == 'other'))")
+    self.assertEqual(c.failed_checks[0].frames[0].varmap,
+                     {'val': "'thing'"})
+
+  def test_cached_on_disk(self):
+    self.fail_check()
+    self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    # The second time around, the statements come from the disk.
+    checker.Checker._PARSED_FILE_CACHE.clear()
+    with mock.patch('recipe_engine.checker._index_statements') as index:
+      self.fail_check()
+    self.assertFalse(index.called)
+
+  def test_bad_cache(self):
+    self.fail_check()
+    for name in os.listdir(self.cache_dir):
+      with open(os.path.join(self.cache_dir, name), 'w') as f:
+        f.write('garbage')
+
+    checker.Checker._PARSED_FILE_CACHE.clear()
+    self.fail_check()
+
+
 class TestVerifySubset(unittest.TestCase):
   @staticmethod
   def mkData(*steps):
@@ -3,6 +3,7 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import copy
 import unittest
 
 import test_env
@@ -31,6 +32,89 @@ class TestConfigGroupSchema(unittest.TestCase):
     with self.assertRaises(ValueError):
       config.ConfigGroupSchema()
 
+class TestConfigGroup(unittest.TestCase):
+  @staticmethod
+  def make():
+    return config.ConfigGroup(
+      num=config.Single(int),
+      things=config.List(str),
+      sub=config.ConfigGroup(
+        name=config.Single(str),
+        hidden_name=config.Single(str, hidden=True),
+      ),
+      shown_sub=config.ConfigGroup(
+        flag=config.Single(bool),
+        hidden=False,
+      ),
+      items=config.ConfigList(lambda: config.ConfigGroup(
+        val=config.Single(int),
+      )),
+    )
+
+  def testFields(self):
+    c = self.make()
+    self.assertIsInstance(c, config.ConfigGroup)
+    self.assertIsNone(c.num)
+    c.num = 10
+    self.assertEqual(c.num, 10)
+    with self.assertRaises(TypeError):
+      c.num = 'ten'
+    del c.num
+    self.assertIsNone(c.num)
+
+    c.sub.name = 'bob'
+    self.assertEqual(c.sub.name, 'bob')
+    c.things.append('a')
+    self.assertEqual(list(c.things), ['a'])
+
+    with self.assertRaises(AttributeError):
+      c.not_a_field = 1
+    with self.assertRaises(AttributeError):
+      c.not_a_field  # pylint: disable=pointless-statement
+
+  def testCompiledClassIsShared(self):
+    a, b = self.make(), self.make()
+    self.assertIs(type(a), type(b))
+    self.assertIs(type(a.sub), type(b.sub))
+    self.assertIsNot(type(a), type(a.sub))
+    self.assertFalse(hasattr(a, '__dict__'))
+
+  def testAsJsonish(self):
+    c = self.make()
+    self.assertEqual(c.as_jsonish(), {'shown_sub': {}})
+    self.assertEqual(c.as_jsonish(include_hidden=True), {
+      'num': None,
+      'things': [],
+      'sub': {'name': None, 'hidden_name': None},
+      'shown_sub': {'flag': None},
+      'items': [],
+    })
+
+    c.sub.hidden_name = 'secret'
+    self.assertEqual(c.as_jsonish(), {'shown_sub': {}, 'sub': {}})
+    c.sub.name = 'bob'
+    c.items.add()
+    c.items.add().val = 3
+    self.assertEqual(c.as_jsonish(), {
+      'shown_sub': {},
+      'sub': {'name': 'bob'},
+      'items': [{'val': 3}],
+    })
+
+  def testDeepcopy(self):
+    c = self.make()
+    c.sub.name = 'bob'
+    c.items.add().val = 3
+    c2 = copy.deepcopy(c)
+    c2.sub.name = 'alice'
+    self.assertEqual(c.sub.name, 'bob')
+    self.assertEqual(c2.as_jsonish(), {
+      'shown_sub': {},
+      'sub': {'name': 'alice'},
+      'items': [{'val': 3}],
+    })
+
+
 class TestProperties(unittest.TestCase):
   def testSimpleReturn(self):
     pass
@@ -0,0 +1,56 @@
+#!/usr/bin/env vpython
+# Copyright 2018 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import copy
+import pickle
+import unittest
+
+import test_env
+
+from recipe_engine import config_types
+
+
+class TestPath(unittest.TestCase):
+  def setUp(self):
+    self.base = config_types.NamedBasePath('start_dir')
+
+  def testInterned(self):
+    a = config_types.Path(self.base, 'a', 'b')
+    self.assertIs(a, config_types.Path(self.base, 'a', 'b'))
+    self.assertIs(a, config_types.Path(self.base, 'a').join('b'))
+    self.assertIs(a, config_types.Path(self.base).join('a', '', None, 'b'))
+    self.assertIsNot(a, config_types.Path(self.base, 'a'))
+    self.assertIsNot(a, a.join(platform_ext={'win': '.exe'}))
+    self.assertIs(a.join(platform_ext={'win': '.exe', 'mac': ''}),
+                  a.join(platform_ext={'mac': '', 'win': '.exe'}))
+    self.assertEqual(hash(a), hash(config_types.Path(self.base, 'a', 'b')))
+
+  def testJoin(self):
+    p = config_types.Path(self.base, 'a', platform_ext={'win': '.exe'})
+    self.assertIs(p.join(), p)
+    self.assertEqual(p.join('b').pieces, ('a', 'b'))
+    self.assertEqual(p.join('b').platform_ext, {'win': '.exe'})
+    self.assertEqual(config_types.Path(self.base, '', 'a').join('b').pieces,
+                     ('a', 'b'))
+    with self.assertRaises(AssertionError):
+      p.join('..')
+    with self.assertRaises(AssertionError):
+      p.join(1)
+
+  def testNoDict(self):
+    p = config_types.Path(self.base, 'a')
+    with self.assertRaises(AttributeError):
+      p.other = 1
+
+  def testCopy(self):
+    p = config_types.Path(self.base, 'a', platform_ext={'win': '.exe'})
+    self.assertIs(copy.copy(p), p)
+    self.assertIs(copy.deepcopy(p), p)
+    self.assertIs(pickle.loads(pickle.dumps(p)), p)
+    self.assertIs(pickle.loads(pickle.dumps(p, pickle.HIGHEST_PROTOCOL)), p)
+
+
+if __name__ == '__main__':
+  unittest.main()
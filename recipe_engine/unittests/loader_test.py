@@ -3,6 +3,10 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import os
+import py_compile
+import shutil
+import tempfile
 import unittest
 
 import mock
@@ -40,6 +44,122 @@ class TestRecipeScript(unittest.TestCase):
 
     self.assertEqual(mocked_return, script.run(None, None, None))
 
+class TestCompileRecipeScript(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.script = os.path.join(self.tmpdir, 'recipe.py')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _write(self, source, mtime):
+    with open(self.script, 'w') as f:
+      f.write(source)
+    os.utime(self.script, (mtime, mtime))
+
+  def _eval(self):
+    code = loader._compile_recipe_script(self.script)
+    self.assertEqual(code.co_filename, self.script)
+    scope = {}
+    exec code in scope
+    return scope['VALUE']
+
+  def testUsesUpToDatePyc(self):
+    self._write('VALUE = "compiled"\n', 1000)
+    py_compile.compile(self.script, dfile='/somewhere/else/recipe.py')
+    # Same mtime, so the .pyc is considered up to date.
+    self._write('VALUE = "source"\n', 1000)
+    self.assertEqual(self._eval(), 'compiled')
+
+  def testIgnoresStalePyc(self):
+    self._write('VALUE = "compiled"\n', 1000)
+    py_compile.compile(self.script)
+    self._write('VALUE = "source"\n', 2000)
+    self.assertEqual(self._eval(), 'source')
+
+
+class TestPackageManifest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.tmpdir, 'cache')
+    recipes_dir = os.path.join(self.tmpdir, 'repo')
+    self.package = mock.Mock(
+        recipes_dir=recipes_dir,
+        recipe_dir=os.path.join(recipes_dir, 'recipes'),
+        module_dir=os.path.join(recipes_dir, 'recipe_modules'))
+    self.package.name = 'repo'
+    for path in ('recipes/foo.py', 'recipes/_private.py',
+                 'recipes/sub/bar.py', 'recipes/foo.expected/basic.json',
+                 'recipe_modules/mod/__init__.py',
+                 'recipe_modules/mod/api.py',
+                 'recipe_modules/mod/sub/__init__.py',
+                 'recipe_modules/mod/sub/util.py',
+                 'recipe_modules/mod/examples/full.py',
+                 'recipe_modules/not_a_mod/api.py'):
+      self._touch(path)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _touch(self, relpath):
+    path = os.path.join(self.package.recipes_dir, relpath)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, 'w'):
+      pass
+
+  def testScan(self):
+    manifest = loader.PackageManifest.scan(self.package)
+    self.assertEqual(manifest.module_names(), ['mod'])
+    self.assertEqual(
+        sorted(manifest.module_tree('mod')),
+        [['api.py', None], ['sub', [['util.py', None]]]])
+    self.assertEqual(sorted(name for _, name in manifest.recipes),
+                     ['foo', 'mod:examples/full', 'sub/bar'])
+    self.assertTrue(manifest.is_fresh())
+
+  def testLoadUsesCache(self):
+    manifest = loader.PackageManifest.load(self.package, self.cache_dir)
+    with mock.patch('recipe_engine.loader.PackageManifest.scan') as scan:
+      with mock.patch('os.path.isdir') as isdir:
+        cached = loader.PackageManifest.load(self.package, self.cache_dir)
+      self.assertFalse(scan.called)
+      self.assertFalse(isdir.called)
+    self.assertEqual(cached.modules, manifest.modules)
+    self.assertEqual(cached.recipes, manifest.recipes)
+
+  def testLoadRescansChangedDirectories(self):
+    loader.PackageManifest.load(self.package, self.cache_dir)
+    self._touch('recipe_modules/not_a_mod/__init__.py')
+    # Make sure the mtime differs, even on coarse filesystems.
+    path = os.path.join(self.package.module_dir, 'not_a_mod')
+    os.utime(path, (1, 1))
+    manifest = loader.PackageManifest.load(self.package, self.cache_dir)
+    self.assertEqual(sorted(manifest.module_names()), ['mod', 'not_a_mod'])
+
+  def testLoadRescansWithinMtimeTick(self):
+    path = self.package.recipe_dir
+    os.utime(path, (1000, 1000))
+    loader.PackageManifest.load(self.package, self.cache_dir)
+    # Adding a recipe within the same mtime tick as the scan leaves the
+    # directory's mtime unchanged.
+    self._touch('recipes/new.py')
+    os.utime(path, (1000, 1000))
+    manifest = loader.PackageManifest.load(self.package, self.cache_dir)
+    self.assertIn('new', [name for _, name in manifest.recipes])
+
+  def testWarnsOnceIfCacheIsUnwritable(self):
+    cache_dir = os.path.join(self.tmpdir, 'not_a_dir')
+    with open(cache_dir, 'w'):
+      pass
+    with mock.patch('recipe_engine.loader._MANIFEST_WRITE_WARNED', False):
+      with mock.patch('recipe_engine.loader.LOGGER') as logger:
+        loader.PackageManifest.load(self.package, cache_dir)
+        loader.PackageManifest.load(self.package, cache_dir)
+    self.assertEqual(logger.warning.call_count, 1)
+    self.assertEqual(logger.debug.call_count, 1)
+
+
 def make_prop(**kwargs):
   name = kwargs.pop('name', "dumb_name")
   return recipe_api.Property(**kwargs).bind(
@@ -146,6 +266,27 @@ class TestInvoke(unittest.TestCase):
     with self.assertRaises(ValueError):
       self.invoke(lambda a: None, {}, {}, prop_defs, ['a'])
 
+  def testBindingPlan(self):
+    def func(api, a, c):
+      return api, a, c
+
+    prop_defs = {
+      'a': make_prop(name="a"),
+      'b.c': make_prop(name="b.c", param_name="c", default=3),
+    }
+    plan = loader.make_binding_plan(func, prop_defs)
+
+    with mock.patch('inspect.getargspec') as getargspec:
+      self.assertEqual(
+          ('api', 1, 3), loader.invoke_with_plan(plan, {'a': 1}, {}, api='api'))
+      self.assertEqual(
+          ('api', 2, 4),
+          loader.invoke_with_plan(plan, {'a': 2, 'b.c': 4}, {}, api='api'))
+      self.assertFalse(getargspec.called)
+
+    with self.assertRaises(recipe_api.UndefinedPropertyException):
+      loader.invoke_with_plan(plan, {'a': 1}, {})
+
   def testInvokeArgNamesFunc(self):
     def test_function(a, b):
       return a
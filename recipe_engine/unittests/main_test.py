@@ -0,0 +1,60 @@
+#!/usr/bin/env vpython
+# Copyright 2018 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import json
+import subprocess
+import sys
+import unittest
+
+import test_env
+
+from recipe_engine import main
+
+
+class FindSubcommandTest(unittest.TestCase):
+  def test_simple(self):
+    self.assertEqual(
+        main._find_subcommand(['--package', 'recipes.cfg', 'run', 'foo']),
+        'run')
+
+  def test_nested(self):
+    self.assertEqual(
+        main._find_subcommand(['-v', '-O', 'a=b', 'test', 'run']), 'test')
+
+  def test_help(self):
+    self.assertIsNone(main._find_subcommand(['--help', 'run']))
+    self.assertEqual(main._find_subcommand(['run', '--help']), 'run')
+
+  def test_none(self):
+    self.assertIsNone(main._find_subcommand(['--package', 'recipes.cfg']))
+
+
+class LazyImportTest(unittest.TestCase):
+  def _loaded_modules(self, subcommands):
+    script = (
+      'import json, sys\n'
+      'sys.path.insert(0, %r)\n'
+      'from recipe_engine import main\n'
+      'main._make_parser(%r)\n'
+      'print json.dumps(sorted(sys.modules))\n'
+    ) % (test_env.BASE_DIR, subcommands)
+    return set(json.loads(
+        subprocess.check_output([sys.executable, '-c', script])))
+
+  def test_run_is_lazy(self):
+    loaded = self._loaded_modules(['run'])
+    self.assertIn('recipe_engine.run', loaded)
+    for mod in ('recipe_engine.test', 'recipe_engine.doc', 'coverage',
+                'multiprocessing', 'urllib3'):
+      self.assertNotIn(mod, loaded)
+
+  def test_all(self):
+    loaded = self._loaded_modules(main._SUBCOMMANDS)
+    for name in main._SUBCOMMANDS:
+      self.assertIn('recipe_engine.' + name, loaded)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -100,6 +100,17 @@ class TestFilter(unittest.TestCase):
                       're_usage_count[regex]': '2',
                       'regex': "re.compile('b\\\\.')"})
 
+  def test_re_reused(self):
+    f = self.f('a').include_re('b$', fields=['sub_b']).include_re('b\.sub2')
+    for _ in xrange(2):
+      c = checker.Checker('<filename>', 0, f, (), {})
+      self.assertEqual(f(c, self.d), OrderedDict([
+        ('a', mkS('a')),
+        ('b', mkS('b', 'sub_b')),
+        ('b.sub2', mkS('b.sub2')),
+      ]))
+      self.assertEqual(len(c.failed_checks), 0)
+
 
 class TestRun(unittest.TestCase):
   def setUp(self):
@@ -407,5 +418,51 @@ class TestLog(unittest.TestCase):
                       "'foobar'")
 
 
+class TestStepInfo(unittest.TestCase):
+  def setUp(self):
+    post_process.ResetStepInfoCache()
+    self.d = OrderedDict([
+        ('x', {
+            '~followup_annotations': [
+                'some output',
+                '@@@STEP_LOG_LINE@log-a@a1@@@',
+                '@@@STEP_TEXT@first@@@',
+                '@@@STEP_LOG_LINE@log-b@b1@@@',
+                '@@@STEP_FAILURE@@@',
+                '@@@STEP_LOG_END@log-a@@@',
+                '@@@STEP_LOG_LINE@log-a@ignored@@@',
+                '@@@STEP_TEXT@second@@@',
+                '@@@STEP_EXCEPTION@@@',
+            ],
+        }),
+        ('y', {}),
+    ])
+
+  def test_parse(self):
+    info = post_process._step_info(self.d, 'x')
+    self.assertEqual(info.status, 'failure')
+    self.assertEqual(info.text, 'first')
+    self.assertEqual(info.logs, {'log-a': ['a1', ''], 'log-b': ['b1']})
+
+    info = post_process._step_info(self.d, 'y')
+    self.assertEqual(info, ('success', '', {}))
+
+  def test_shared(self):
+    info = post_process._step_info(self.d, 'x')
+    copied = OrderedDict(
+        (k, dict(v, **{'~followup_annotations': list(v.get(
+            '~followup_annotations', []))}))
+        for k, v in self.d.iteritems())
+    self.assertIs(post_process._step_info(copied, 'x'), info)
+
+  def test_functions(self):
+    c = checker.Checker('<filename>', 0, lambda: None, (), {})
+    post_process.StepFailure(c, self.d, 'x')
+    post_process.StepTextEquals(c, self.d, 'x', 'first')
+    post_process.LogEquals(c, self.d, 'x', 'log-a', 'a1\n')
+    post_process.LogEquals(c, self.d, 'x', 'log-b', 'b1')
+    self.assertEqual(len(c.failed_checks), 0)
+
+
 if __name__ == '__main__':
   sys.exit(unittest.main())
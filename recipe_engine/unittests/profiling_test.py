@@ -0,0 +1,120 @@
+#!/usr/bin/env vpython
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import collections
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+from cStringIO import StringIO
+
+import test_env
+
+from recipe_engine import profiling
+
+
+FakePackage = collections.namedtuple(
+    'FakePackage', 'name recipe_dir module_dir')
+
+_PACKAGES = [
+  FakePackage('main', '/repo/recipes', '/repo/recipe_modules'),
+  FakePackage('dep', '/deps/dep/recipes', '/deps/dep/recipe_modules'),
+]
+
+
+def _busy(seconds):
+  end = time.time() + seconds
+  while time.time() < end:
+    pass
+
+
+class TestAttributor(unittest.TestCase):
+  def test_owner(self):
+    attributor = profiling.Attributor(_PACKAGES)
+    self.assertEqual(
+        attributor.owner('/repo/recipe_modules/foo/api.py'), 'main/foo')
+    self.assertEqual(
+        attributor.owner('/repo/recipe_modules/foo/examples/full.py'),
+        'main/foo')
+    self.assertEqual(
+        attributor.owner('/deps/dep/recipes/sub/bar.py'), 'dep::sub/bar')
+    self.assertEqual(
+        attributor.owner(profiling.__file__), profiling.ENGINE)
+    self.assertEqual(attributor.owner(os.__file__), profiling.OTHER)
+    self.assertEqual(attributor.owner('~'), profiling.OTHER)
+
+
+class TestRunProfiler(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_steps_excluded(self):
+    profiler = profiling.RunProfiler()
+    def run():
+      with profiler.step('sleep'):
+        time.sleep(0.2)
+      _busy(0.01)
+      return 'result'
+    self.assertEqual(profiler.runcall(run), 'result')
+
+    self.assertEqual([name for name, _ in profiler.step_times], ['sleep'])
+    self.assertGreaterEqual(profiler.step_times[0][1], 0.2)
+
+    path = os.path.join(self.tmpdir, 'profile')
+    out = StringIO()
+    profiler.report(path, profiling.Attributor(_PACKAGES), out)
+    stats = pstats.Stats(path)
+    self.assertLess(stats.total_tt, 0.2)
+    self.assertGreaterEqual(stats.total_tt, 0.01)
+    self.assertIn('Steps: 1,', out.getvalue())
+    self.assertIn('sleep', out.getvalue())
+
+
+class TestSimulationProfile(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_combined(self):
+    attributor = profiling.Attributor(_PACKAGES)
+    simulation_profile = profiling.SimulationProfile()
+    for name, seconds in (('fast', 0.01), ('slow', 0.05)):
+      result, stats = profiling.profile_call(_busy, seconds)
+      self.assertIsNone(result)
+      simulation_profile.add_test(name, stats, attributor)
+    simulation_profile.add_test('unprofiled', None, attributor)
+
+    path = os.path.join(self.tmpdir, 'profile')
+    out = StringIO()
+    simulation_profile.report(path, attributor, out)
+    self.assertIn('Profiled 2 tests', out.getvalue())
+    lines = out.getvalue().splitlines()
+    slowest = lines.index('Slowest tests:')
+    self.assertEqual(
+        [l.split()[1] for l in lines[slowest + 2:slowest + 4]],
+        ['slow', 'fast'])
+    busy = [v for k, v in pstats.Stats(path).stats.iteritems()
+            if k[2] == '_busy']
+    self.assertEqual([nc for _, nc, _, _, _ in busy], [2])
+
+  def test_nothing_profiled(self):
+    out = StringIO()
+    path = os.path.join(self.tmpdir, 'profile')
+    profiling.SimulationProfile().report(
+        path, profiling.Attributor(_PACKAGES), out)
+    self.assertEqual(out.getvalue(), 'No tests were profiled\n')
+    self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+  unittest.main()
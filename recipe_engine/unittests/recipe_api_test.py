@@ -3,11 +3,13 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import collections
 import unittest
 
 import test_env
 
 from recipe_engine import recipe_api, config
+from recipe_engine.types import FrozenDict
 
 
 RECIPE_PROPERTY = recipe_api.BoundProperty.RECIPE_PROPERTY
@@ -113,5 +115,67 @@ class TestProperties(unittest.TestCase):
                 'fake_package::fake_module:example')
 
 
+class TestPropertiesClient(unittest.TestCase):
+  def make_client(self, properties):
+    FakeEngine = collections.namedtuple('FakeEngine', 'properties')
+    return recipe_api.PropertiesClient(FakeEngine(properties))
+
+  def testFrozenPerProperty(self):
+    props = {'a': {'b': [1, 2]}, 'c': 'd'}
+    client = self.make_client(props)
+    frozen = client.get_frozen_property('a')
+    self.assertEqual(frozen, FrozenDict(b=(1, 2)))
+    self.assertIs(client.get_frozen_property('a'), frozen)
+    self.assertIs(client.get_frozen_property('c'), props['c'])
+    with self.assertRaises(KeyError):
+      client.get_frozen_property('missing')
+    self.assertEqual(sorted(client.get_property_names()), ['a', 'c'])
+    self.assertTrue(client.has_property('c'))
+    self.assertFalse(client.has_property('missing'))
+
+  def testCopies(self):
+    props = {'a': {'b': [1, {'c': u'd'}]}, 'e': (1, [2])}
+    client = self.make_client(props)
+    thawed = client.get_properties()
+    self.assertEqual(thawed, props)
+    self.assertEqual(client.get_property('a'), props['a'])
+
+    thawed['a']['b'][1]['c'] = 'x'
+    thawed['e'][1].append(3)
+    client.get_property('a')['b'].append(2)
+    self.assertEqual(props, {'a': {'b': [1, {'c': u'd'}]}, 'e': (1, [2])})
+    # The names are in the same order as the copies.
+    self.assertEqual(list(client.get_property_names()), list(thawed))
+
+
+class TestPathsClient(unittest.TestCase):
+  def make_client(self, *path_strings):
+    client = recipe_api.PathsClient()
+    client.path_strings = sorted(path_strings)
+    client.paths = ['Path(%s)' % p for p in client.path_strings]
+    return client
+
+  def testExactMatch(self):
+    client = self.make_client('/a/b', '/c')
+    self.assertEqual(client.find_longest_prefix('/a/b', '/'),
+                     ('/a/b', 'Path(/a/b)'))
+
+  def testNestedPrefixes(self):
+    client = self.make_client('/a', '/a/b', '/a/b/c', '/a/bc')
+    self.assertEqual(client.find_longest_prefix('/a/b/d/e', '/'),
+                     ('/a/b', 'Path(/a/b)'))
+    self.assertEqual(client.find_longest_prefix('/a/b/c/d', '/'),
+                     ('/a/b/c', 'Path(/a/b/c)'))
+    self.assertEqual(client.find_longest_prefix('/a/bcd', '/'),
+                     ('/a', 'Path(/a)'))
+
+  def testNoMatch(self):
+    client = self.make_client('/a/b')
+    self.assertEqual(client.find_longest_prefix('/a', '/'), (None, None))
+    self.assertEqual(client.find_longest_prefix('/a/bc', '/'), (None, None))
+    self.assertEqual(client.find_longest_prefix('/a/b/c', '\\'),
+                     (None, None))
+
+
 if __name__ == '__main__':
   unittest.main()
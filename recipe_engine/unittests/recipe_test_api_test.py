@@ -3,6 +3,8 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import copy
+import inspect
 import unittest
 
 import test_env
@@ -47,5 +49,78 @@ class TestExpectedException(unittest.TestCase):
       self.assertTrue(should_raise)
 
 
+class TestCombine(unittest.TestCase):
+  def setUp(self):
+    self.api = recipe_test_api.RecipeTestApi()
+
+  def props(self, **kwargs):
+    ret = recipe_test_api.TestData()
+    ret.properties.update(kwargs)
+    return ret
+
+  def testChain(self):
+    test_data = self.api.test('chain')
+    for i in xrange(2000):
+      test_data += self.props(**{'p%d' % (i % 10): i})
+      test_data += self.api.step_data('step %d' % i, retcode=i)
+    self.assertEqual(test_data.name, 'chain')
+    self.assertEqual(test_data.properties,
+                     {'p%d' % i: 1990 + i for i in xrange(10)})
+    self.assertEqual(len(test_data.step_data), 2000)
+    self.assertEqual(test_data.step_data['step 1999'].retcode, 1999)
+
+  def testOperandsUnchanged(self):
+    base = self.api.test('base') + self.props(a=1)
+    derived = base + self.props(a=2, b=3)
+    other = base + self.api.step_data('x', retcode=1)
+
+    base.properties['c'] = 4
+    base.post_process(len, (), {}, 'file', 1)
+    self.assertEqual(base.properties, {'a': 1, 'c': 4})
+
+    self.assertEqual(derived.properties, {'a': 2, 'b': 3})
+    self.assertEqual(other.properties, {'a': 1})
+    self.assertEqual(other.post_process_hooks, [])
+    self.assertEqual(other.step_data.keys(), ['x'])
+
+    other.step_data.pop('x')
+    self.assertEqual((base + other).step_data.keys(), [])
+    self.assertEqual(len((base + other).post_process_hooks), 1)
+
+  def testNested(self):
+    test_data = self.api.step_data('x', retcode=1) + (
+        self.api.override_step_data('x') +
+        self.api.step_data('x', times_out_after=10))
+    self.assertEqual(test_data.step_data['x'].retcode, 1)
+    self.assertEqual(test_data.step_data['x'].times_out_after, 10)
+
+    test_data = (
+        self.api.step_data('x', retcode=1) +
+        self.api.override_step_data('x') +
+        self.api.step_data('x', times_out_after=10))
+    self.assertEqual(test_data.step_data['x'].retcode, 0)
+    self.assertEqual(test_data.step_data['x'].times_out_after, 10)
+
+  def testConflict(self):
+    test_data = (
+        self.api.step_data('x', retcode=1) + self.api.step_data('x', retcode=2))
+    frame = inspect.currentframe()
+    location = (frame.f_code.co_filename, frame.f_lineno - 2)
+    test_data += self.props(a=1)
+    with self.assertRaises(ValueError) as cm:
+      copy.deepcopy(test_data)
+    self.assertEqual(
+        str(cm.exception),
+        "in step 'x': Conflicting retcode values. (adding test data at %s:%d)"
+        % location)
+
+  def testDeepCopy(self):
+    test_data = self.api.test('copy') + self.props(a=[1])
+    copied = copy.deepcopy(test_data)
+    self.assertEqual(copied.name, 'copy')
+    self.assertEqual(copied.properties, {'a': [1]})
+    self.assertIsNot(copied.properties['a'], test_data.properties['a'])
+
+
 if __name__ == '__main__':
   unittest.main()
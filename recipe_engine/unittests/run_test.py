@@ -6,6 +6,7 @@
 import json
 import os
 import re
+import shutil
 import subprocess
 import tempfile
 import time
@@ -36,12 +37,13 @@ class RunTest(unittest.TestCase):
     os.environ['RANDOM_MULTILINE_ENV'] = 'foo\nbar\nbaz\n'
     return (['python', script_path] + eng_args + ['run', recipe] + proplist)
 
-  def _test_recipe(self, recipe, properties=None, env=None):
+  def _test_recipe(self, recipe, properties=None, env=None, cwd=None):
     proc = subprocess.Popen(
         self._run_cmd(recipe, properties),
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        env=env)
+        env=env,
+        cwd=cwd)
     stdout = proc.communicate()
     self.assertEqual(0, proc.returncode, '%d != %d when testing %s:\n%s' % (
         0, proc.returncode, recipe, stdout))
@@ -71,6 +73,15 @@ class RunTest(unittest.TestCase):
     for test in tests:
       self._test_recipe(*test, env=env)
 
+  def test_start_dir_in_package(self):
+    # [START_DIR] is more specific than the package root containing it, so
+    # abs_to_path must pick it.
+    start_dir = tempfile.mkdtemp(dir=BASE_DIR)
+    try:
+      self._test_recipe('path:examples/full', cwd=start_dir)
+    finally:
+      shutil.rmtree(start_dir)
+
   def test_bad_subprocess(self):
     now = time.time()
     self._test_recipe('engine_tests/bad_subprocess')
@@ -4,6 +4,7 @@
 # that can be found in the LICENSE file.
 
 import cStringIO
+import threading
 import unittest
 
 import test_env
@@ -159,5 +160,83 @@ bar tries to kiss foo, but foo already left
         foo.set_step_status('SUCCESS')
 
 
+class AsyncOutstreamTest(unittest.TestCase):
+  class BlockingStream(object):
+    """A stream whose writes block until |unblock| is set."""
+    def __init__(self):
+      self.unblock = threading.Event()
+      self.data = cStringIO.StringIO()
+      self.flushes = 0
+
+    def write(self, data):
+      self.unblock.wait()
+      self.data.write(data)
+
+    def flush(self):
+      self.flushes += 1
+
+  def test_preserves_order(self):
+    out = self.BlockingStream()
+    out.unblock.set()
+    with stream.AsyncOutstream(out) as s:
+      for i in xrange(100):
+        s.write('line %d\n' % i)
+    self.assertEqual(
+        out.data.getvalue(), ''.join('line %d\n' % i for i in xrange(100)))
+    self.assertGreater(out.flushes, 0)
+
+  def test_spills_without_blocking(self):
+    out = self.BlockingStream()
+    s = stream.AsyncOutstream(out, max_buffer_bytes=16)
+    expected = []
+    # None of these writes may block, even though the consumer is stuck.
+    for i in xrange(1000):
+      line = 'spilled line %d\n' % i
+      s.write(line)
+      expected.append(line)
+    out.unblock.set()
+    s.drain()
+    self.assertEqual(out.data.getvalue(), ''.join(expected))
+
+    # Once caught up, writes are buffered in memory again.
+    s.write('after\n')
+    s.close()
+    self.assertEqual(out.data.getvalue(), ''.join(expected) + 'after\n')
+
+  def test_consumer_error(self):
+    class BrokenStream(object):
+      def write(self, data):
+        raise IOError('broken pipe')
+
+      def flush(self):
+        pass
+
+    s = stream.AsyncOutstream(BrokenStream())
+    s.write('hello\n')
+    with self.assertRaises(IOError):
+      s.drain()
+    with self.assertRaises(IOError):
+      s.close()
+
+  def test_annotator_engine(self):
+    out = self.BlockingStream()
+    out.unblock.set()
+    with stream.AsyncOutstream(out) as s:
+      engine = stream.AnnotatorStreamEngine(s)
+      with engine:
+        with engine.make_step_stream('foo') as foo:
+          foo.write_line('hello')
+        engine.flush()
+        self.assertIn('hello\n', out.data.getvalue())
+    self.assertEqual(out.data.getvalue().splitlines(), [
+        '@@@HONOR_ZERO_RETURN_CODE@@@',
+        '@@@SEED_STEP@foo@@@',
+        '@@@STEP_CURSOR@foo@@@',
+        '@@@STEP_STARTED@@@',
+        'hello',
+        '@@@STEP_CLOSED@@@',
+    ])
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -4,17 +4,25 @@
 # that can be found in the LICENSE file.
 
 import argparse
+import collections
+import errno
+import multiprocessing
 import os
+import select
+import shutil
 import sys
 import tempfile
+import threading
 import unittest
 
 from cStringIO import StringIO
 
+import coverage
 import mock
 
 import test_env
 
+from recipe_engine import stream
 from recipe_engine import test
 from recipe_engine import common_args
 
@@ -58,6 +66,323 @@ class TestArgs(unittest.TestCase):
     self.assertEqual(args.filter, ['foo.bar'])
 
 
+# Memory allocated by the fake workers.
+_HELD = []
+
+
+def _fake_run_worker(test, _mode, _profile_test=False):
+  if test == 'crash':
+    os._exit(1)
+  if test.startswith('big'):
+    _HELD.append('x' * (8 * 1024 * 1024))
+  return (True, test, os.getpid())
+
+
+def _fake_interrupted_run_worker(name, mode, profile_test=False):
+  if name == 'interrupt':
+    test._KILL_SWITCH.set()
+  return _fake_run_worker(name, mode, profile_test)
+
+
+class TestRunInWorkers(unittest.TestCase):
+  @mock.patch('recipe_engine.test.run_worker', _fake_run_worker)
+  def test_results_in_order(self):
+    tests = ['t%d' % i for i in xrange(20)]
+    results, peak_rss = test._run_in_workers(tests, 'mode', 3)
+    self.assertEqual([t for _, t, _ in results], tests)
+    self.assertLessEqual(len({pid for _, _, pid in results}), 3)
+    self.assertTrue(peak_rss)
+    self.assertTrue(all(rss >= 0 for rss in peak_rss))
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_run_worker)
+  def test_max_tests(self):
+    tests = ['t%d' % i for i in xrange(10)]
+    results, _ = test._run_in_workers(tests, 'mode', 2, max_tests=2)
+    self.assertEqual([t for _, t, _ in results], tests)
+    pids = collections.Counter(pid for _, _, pid in results)
+    self.assertGreaterEqual(len(pids), 5)
+    self.assertLessEqual(max(pids.values()), 2)
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_run_worker)
+  def test_max_rss(self):
+    tests = ['big%d' % i for i in xrange(4)]
+    results, peak_rss = test._run_in_workers(tests, 'mode', 2, max_rss_mb=4)
+    self.assertEqual(len({pid for _, _, pid in results}), 4)
+    self.assertTrue(all(rss >= 8 for rss in peak_rss))
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_run_worker)
+  def test_max_rss_excludes_parent_memory(self):
+    # The workers share this memory with the parent, and mustn't be replaced
+    # because of it.
+    held = 'x' * (64 * 1024 * 1024)
+    tests = ['t%d' % i for i in xrange(10)]
+    results, peak_rss = test._run_in_workers(tests, 'mode', 2, max_rss_mb=32)
+    self.assertLessEqual(len({pid for _, _, pid in results}), 2)
+    self.assertLess(max(peak_rss), 32)
+    del held
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_run_worker)
+  def test_worker_died(self):
+    tests = ['t0', 'crash', 't2', 't3']
+    results, _ = test._run_in_workers(tests, 'mode', 1)
+    self.assertEqual([t for _, t, _ in results], tests)
+    self.assertEqual([success for success, _, _ in results],
+                     [True, False, True, True])
+    self.assertIn('worker process died', results[1][2])
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_run_worker)
+  @mock.patch('recipe_engine.test._test_failed', lambda r: not r[0])
+  def test_fail_fast(self):
+    tests = ['t0', 'crash', 'crash'] + ['t%d' % i for i in xrange(3, 20)]
+    results, _ = test._run_in_workers(tests, 'mode', 1, fail_fast=2)
+    self.assertEqual([r and r[:2] for r in results],
+                     [(True, 't0'), (False, 'crash'), (False, 'crash')] +
+                     [None] * 17)
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_interrupted_run_worker)
+  def test_kill_switch(self):
+    self.addCleanup(test._KILL_SWITCH.clear)
+    tests = ['t0', 'interrupt', 't2', 't3']
+    results, _ = test._run_in_workers(tests, 'mode', 1)
+    self.assertEqual([r and r[:2] for r in results],
+                     [(True, 't0'), (True, 'interrupt'), None, None])
+
+  def test_wait_interrupted(self):
+    conn, _ = multiprocessing.Pipe()
+    with mock.patch('select.select', side_effect=select.error(
+        errno.EINTR, 'Interrupted system call')):
+      self.assertEqual(test._wait_for_any([conn], 1), [])
+    with mock.patch('select.select', side_effect=select.error(
+        errno.EBADF, 'Bad file descriptor')):
+      with self.assertRaises(select.error):
+        test._wait_for_any([conn], 1)
+
+
+def _fake_remote_run_worker(desc, _mode, _profile_test=False):
+  if desc.test_name == 'crash':
+    os._exit(1)
+  coverage_data = coverage.CoverageData()
+  coverage_data.add_lines({
+    '/worker/recipes/recipe_modules/foo/api.py': {len(desc.test_name): None},
+  })
+  return (True, desc, test.TestResult(desc, [], coverage_data, False))
+
+
+class TestRemoteWorkers(unittest.TestCase):
+  def _serve(self, tests, revisions=None, fingerprint='fingerprint',
+             max_tests=0):
+    """Serves |tests| on a new connection as a remote worker in
+    /worker/recipes, and returns the connection and the serving thread."""
+    conn, worker_conn = multiprocessing.Pipe()
+    thread = threading.Thread(target=test._serve_coordinator, args=(
+        worker_conn, {t.full_name: t for t in tests}, revisions or {},
+        fingerprint, '/worker/recipes', max_tests))
+    thread.daemon = True
+    thread.start()
+    return conn, thread
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_remote_run_worker)
+  def test_remote_only(self):
+    worker_tests = [
+      test.TestDescription('recipe', name, '/worker/recipes/x', [])
+      for name in ('a', 'bb', 'ccc')
+    ]
+    conn, thread = self._serve(worker_tests)
+    conn.send({'revisions': {}, 'fingerprint': 'fingerprint',
+               'recipes_dir': '/local/recipes'})
+    self.assertIsNone(conn.recv())
+
+    tests = [
+      test.TestDescription('recipe', name, '/local/recipes/x', [])
+      for name in ('a', 'bb', 'ccc', 'missing')
+    ]
+    results, peak_rss = test._run_in_workers(
+        tests, 'mode', 0, remote_workers=[conn])
+    thread.join()
+
+    self.assertEqual([t.full_name for _, t, _ in results],
+                     [t.full_name for t in tests])
+    self.assertEqual([success for success, _, _ in results],
+                     [True, True, True, False])
+    self.assertIn('remote worker has no test recipe.missing', results[3][2])
+    for desc, (_, _, details) in zip(tests, results[:3]):
+      # The results refer to the coordinator's tests and files.
+      self.assertEqual(details.test_description.expect_dir, desc.expect_dir)
+      self.assertEqual(details.coverage_data.measured_files(),
+                       ['/local/recipes/recipe_modules/foo/api.py'])
+      self.assertEqual(details.coverage_data.lines(
+          '/local/recipes/recipe_modules/foo/api.py'), [len(desc.test_name)])
+    self.assertEqual(len(peak_rss), 1)
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_remote_run_worker)
+  def test_remote_crash(self):
+    names = ('a', 'crash', 'bb', 'ccc')
+    conn, thread = self._serve([
+      test.TestDescription('recipe', name, '/worker/recipes/x', [])
+      for name in names
+    ], max_tests=2)
+    conn.send({'revisions': {}, 'fingerprint': 'fingerprint',
+               'recipes_dir': '/local/recipes'})
+    self.assertIsNone(conn.recv())
+
+    tests = [
+      test.TestDescription('recipe', name, '/local/recipes/x', [])
+      for name in names
+    ]
+    results, _ = test._run_in_workers(tests, 'mode', 0, remote_workers=[conn])
+    thread.join()
+
+    # Only the crashing test fails; the worker serves the others in new worker
+    # processes.
+    self.assertEqual([success for success, _, _ in results],
+                     [True, False, True, True])
+    self.assertIn('worker process died', results[1][2])
+    self.assertEqual([t.full_name for _, t, _ in results],
+                     [t.full_name for t in tests])
+
+  def test_revision_mismatch(self):
+    conn, thread = self._serve([], {'dep': 'a' * 40})
+    conn.send({'revisions': {'dep': 'b' * 40}, 'fingerprint': 'fingerprint',
+               'recipes_dir': '/local'})
+    self.assertIn('package revisions differ', conn.recv())
+    thread.join()
+
+  def test_fingerprint_mismatch(self):
+    conn, thread = self._serve([], fingerprint='worker')
+    conn.send({'revisions': {}, 'fingerprint': 'coordinator',
+               'recipes_dir': '/local'})
+    self.assertIn('differ from the ones of the coordinator', conn.recv())
+    thread.join()
+
+  def test_package_fingerprint(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      def make_package(name):
+        recipes_dir = os.path.join(tmpdir, name)
+        for path, data in (('recipes/foo.py', 'code'),
+                           ('recipes/foo.expected/basic.json', '[]'),
+                           ('recipe_modules/mod/api.py', 'code')):
+          path = os.path.join(recipes_dir, path)
+          if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+          with open(path, 'w') as f:
+            f.write(data)
+        return mock.Mock(
+            recipes_dir=recipes_dir,
+            recipe_dir=os.path.join(recipes_dir, 'recipes'),
+            module_dir=os.path.join(recipes_dir, 'recipe_modules'))
+
+      a, b = make_package('a'), make_package('b')
+      os.utime(os.path.join(b.recipe_dir, 'foo.py'), (1000, 1000))
+      with open(os.path.join(b.recipe_dir, 'foo.pyc'), 'w') as f:
+        f.write('bytecode')
+      self.assertEqual(test._package_fingerprint(a),
+                       test._package_fingerprint(b))
+
+      with open(os.path.join(b.recipe_dir, 'foo.expected', 'basic.json'),
+                'w') as f:
+        f.write('[{}]')
+      self.assertNotEqual(test._package_fingerprint(a),
+                          test._package_fingerprint(b))
+    finally:
+      shutil.rmtree(tmpdir)
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_run_worker)
+  def test_remote_disconnected(self):
+    conn, remote_conn = multiprocessing.Pipe()
+    remote_conn.close()
+    tests = ['t0', 't1']
+    results, _ = test._run_in_workers(tests, 'mode', 0, remote_workers=[conn])
+    # The tests are run by a local worker instead.
+    self.assertEqual(results, [
+      (True, 't0', results[0][2]),
+      (True, 't1', results[0][2]),
+    ])
+
+  @mock.patch('recipe_engine.test.run_worker', _fake_run_worker)
+  def test_remote_disconnected_after_fail_fast(self):
+    failed = threading.Event()
+    def test_failed(result):
+      if not result[0]:
+        failed.set()
+      return not result[0]
+
+    conn, remote_conn = multiprocessing.Pipe()
+    def remote():
+      # Goes away with its test only once the local worker's test failed.
+      remote_conn.recv()
+      failed.wait(10)
+      remote_conn.close()
+    thread = threading.Thread(target=remote)
+    thread.daemon = True
+    thread.start()
+
+    tests = ['t0', 'crash', 't2', 't3']
+    with mock.patch('recipe_engine.test._test_failed', test_failed):
+      results, _ = test._run_in_workers(
+          tests, 'mode', 1, remote_workers=[conn], fail_fast=1)
+    thread.join()
+    self.assertEqual([r and r[:2] for r in results],
+                     [None, (False, 'crash'), None, None])
+
+  def test_parse_remote_address(self):
+    self.assertEqual(test.parse_remote_address('localhost:1234'),
+                     ('localhost', 1234))
+    self.assertEqual(test.parse_remote_address('[::1]:0'), ('[::1]', 0))
+    self.assertEqual(test.parse_remote_address('/tmp/sock'), '/tmp/sock')
+
+
+class TestSimulationStreamEngine(unittest.TestCase):
+  def _followup(self, engine, name):
+    return engine.render_followup_annotations(engine.step_records(name))
+
+  def test_records(self):
+    engine = test.SimulationStreamEngine()
+    with stream.StreamEngineInvariants.wrap(engine) as wrapped:
+      foo = wrapped.make_step_stream('foo')
+      foo.write_split('hello\n@@@STEP_FAILURE@@@')
+      with foo.new_log_stream('poem/prose') as log:
+        log.write_line('roses are red')
+      foo.add_step_text('line one\nline two')
+      foo.add_step_link('link', 'https://example.com')
+      foo.set_step_status('WARNING')
+      foo.close()
+
+      bar = wrapped.make_step_stream(
+          'bar', allow_subannotations=True, nest_level=2)
+      bar.write_line(u'@@@STEP_TEXT@hi@@@')
+      bar.set_build_property('key', '"value"')
+      bar.set_step_status('SUCCESS')
+      bar.close()
+
+      baz = wrapped.make_step_stream('baz')
+      baz.close()
+
+    self.assertEqual(self._followup(engine, 'foo'), [
+      'hello',
+      '!@@@STEP_FAILURE@@@',
+      '@@@STEP_LOG_LINE@poem&#x2f;prose@roses are red@@@',
+      '@@@STEP_LOG_END@poem&#x2f;prose@@@',
+      '@@@STEP_TEXT@line one',
+      'line two@@@',
+      '@@@STEP_LINK@link@https://example.com@@@',
+      '@@@STEP_WARNINGS@@@',
+    ])
+    self.assertEqual(self._followup(engine, 'bar'), [
+      '@@@STEP_NEST_LEVEL@2@@@',
+      '@@@STEP_TEXT@hi@@@',
+      '@@@SET_BUILD_PROPERTY@key@"value"@@@',
+    ])
+    self.assertEqual(self._followup(engine, 'baz'), [])
+    self.assertEqual(self._followup(engine, 'missing'), [])
+
+  def test_bad_status(self):
+    engine = test.SimulationStreamEngine()
+    step = engine.make_step_stream('foo')
+    with self.assertRaises(Exception):
+      step.set_step_status('BOGUS')
+
+
 if __name__ == '__main__':
   sys.exit(unittest.main())
 
@@ -0,0 +1,87 @@
+#!/usr/bin/env vpython
+# Copyright 2018 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import collections
+import copy
+import pickle
+import unittest
+
+import test_env
+
+from recipe_engine.types import freeze, FrozenDict
+
+
+class TestFrozenDict(unittest.TestCase):
+  def testOrder(self):
+    fd = FrozenDict([('b', 1), ('a', 2), ('c', 3), ('a', 4)], d=5)
+    self.assertEqual(fd.keys(), ['b', 'a', 'c', 'd'])
+    self.assertEqual(list(fd), ['b', 'a', 'c', 'd'])
+    self.assertEqual(fd.values(), [1, 4, 3, 5])
+    self.assertEqual(fd.items(), [('b', 1), ('a', 4), ('c', 3), ('d', 5)])
+    self.assertEqual(repr(fd),
+                     "FrozenDict([('b', 1), ('a', 4), ('c', 3), ('d', 5)])")
+
+  def testMapping(self):
+    fd = FrozenDict({'a': 1})
+    self.assertIsInstance(fd, collections.Mapping)
+    self.assertEqual(fd['a'], 1)
+    self.assertIn('a', fd)
+    self.assertEqual(fd.get('b', 2), 2)
+    self.assertEqual(dict(fd), {'a': 1})
+    with self.assertRaises(KeyError):
+      fd['b']  # pylint: disable=pointless-statement
+    with self.assertRaises(AttributeError):
+      fd.other = 1
+
+  def testEquality(self):
+    a = FrozenDict([('a', 1), ('b', 2)])
+    b = FrozenDict([('b', 2), ('a', 1)])
+    self.assertEqual(a, b)
+    self.assertEqual(hash(a), hash(b))
+    self.assertEqual(a, {'a': 1, 'b': 2})
+    self.assertEqual(a, collections.OrderedDict([('b', 2), ('a', 1)]))
+    self.assertNotEqual(a, FrozenDict(a=1, b=3))
+    self.assertNotEqual(a, {'a': 1})
+    self.assertNotEqual(a, [('a', 1), ('b', 2)])
+
+  def testUnhashable(self):
+    with self.assertRaises(TypeError):
+      FrozenDict(a=[])
+
+  def testCopy(self):
+    fd = FrozenDict(a=(1, 2))
+    self.assertIs(copy.copy(fd), fd)
+    self.assertIs(copy.deepcopy(fd), fd)
+    self.assertEqual(pickle.loads(pickle.dumps(fd)), fd)
+    self.assertEqual(
+        pickle.loads(pickle.dumps(fd, pickle.HIGHEST_PROTOCOL)), fd)
+
+
+class TestFreeze(unittest.TestCase):
+  def testFreeze(self):
+    frozen = freeze({'a': [1, {'b': set([2])}], 'c': (3, [4])})
+    self.assertEqual(frozen, FrozenDict(
+        a=(1, FrozenDict(b=frozenset([2]))),
+        c=(3, (4,))))
+    self.assertIsInstance(frozen['a'][1], FrozenDict)
+
+  def testAlreadyFrozen(self):
+    fd = FrozenDict(a=(1, 2))
+    self.assertIs(freeze(fd), fd)
+    tup = (1, 'a', fd)
+    self.assertIs(freeze(tup), tup)
+
+  def testNamedTuple(self):
+    Pair = collections.namedtuple('Pair', 'a b')
+    frozen = freeze(Pair(1, [2]))
+    self.assertEqual(frozen, (1, (2,)))
+
+  def testUnhashable(self):
+    with self.assertRaises(TypeError):
+      freeze(bytearray())
+
+
+if __name__ == '__main__':
+  unittest.main()
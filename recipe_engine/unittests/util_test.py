@@ -87,5 +87,28 @@ class TestMapDeferExceptions(unittest.TestCase):
     self.assertRaises(ValueError, util.map_defer_exceptions, fn, [1], KeyError)
 
 
+class TestModuleInjectionSite(unittest.TestCase):
+
+  def testInjectLazy(self):
+    site = util.ModuleInjectionSite()
+    calls = []
+    def factory():
+      calls.append(1)
+      return 'instance'
+    site.inject_lazy('dep', 'module', factory)
+    self.assertEqual(site.lazy_modules(), {'dep': 'module'})
+    self.assertEqual(calls, [])
+
+    self.assertEqual(site.dep, 'instance')
+    self.assertEqual(site.dep, 'instance')
+    self.assertEqual(calls, [1])
+    self.assertEqual(site.lazy_modules(), {})
+
+  def testMissingDependency(self):
+    site = util.ModuleInjectionSite()
+    with self.assertRaises(util.ModuleInjectionError):
+      site.dep
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -38,8 +38,35 @@ class ModuleInjectionError(AttributeError):
 class ModuleInjectionSite(object):
   def __init__(self, owner_module=None):
     self.owner_module = owner_module
+    self._lazy_modules = {}
+
+  def inject_lazy(self, name, module, factory):
+    """Injects the dependency |name| without creating it yet.
+
+    The first access of the attribute |name| calls factory() and injects its
+    result for good.
+
+    Args:
+      name (str) - The local name of the dependency.
+      module (module) - The recipe module which |factory| instantiates.
+      factory (fn()) - Returns the object to inject.
+    """
+    self._lazy_modules[name] = (module, factory)
+
+  def lazy_modules(self):
+    """Returns {name: module} for the dependencies injected with inject_lazy
+    which haven't been accessed yet."""
+    return {name: module
+            for name, (module, _) in self._lazy_modules.iteritems()}
 
   def __getattr__(self, key):
+    lazy_modules = self.__dict__.get('_lazy_modules', {})
+    if key in lazy_modules:
+      value = lazy_modules[key][1]()
+      setattr(self, key, value)
+      del lazy_modules[key]
+      return value
+
     if self.owner_module is None:
       raise ModuleInjectionError(
         "RecipeApi has no dependency %r. (Add it to DEPS?)" % (key,))
@@ -176,6 +203,7 @@ def raises(exc_cls, stream_engine=None):
           with stream.new_log_stream('exception') as log:
             log.write_split(traceback.format_exc())
           stream.add_step_link('file a bug', BUG_LINK)
+        stream_engine.flush()
       sys.stdout.flush()
       sys.stderr.flush()
       os._exit(2)
@@ -49,11 +49,20 @@ class Error(Exception):
 
 
 def PathToString(api, test):
+  # (path, resolved base) -> rendered path. The resolved base is part of the
+  # key because named bases (e.g. 'checkout') may change during the run.
+  cache = {}
   def PathToString_inner(path):
     assert isinstance(path, config_types.Path)
     base_path = path.base.resolve(test.enabled)
-    suffix = path.platform_ext.get(api.m.platform.name, '')
-    return api.join(base_path, *path.pieces) + suffix
+    if isinstance(base_path, config_types.Path):
+      base_path = PathToString_inner(base_path)
+    key = (path, base_path)
+    ret = cache.get(key)
+    if ret is None:
+      suffix = path.platform_ext.get(api.m.platform.name, '')
+      ret = cache[key] = api.join(base_path, *path.pieces) + suffix
+    return ret
   return PathToString_inner
 
 
@@ -66,13 +75,19 @@ def string_filter(func):
 
 class path_set(object):
   """ implements a set which contains all the parents folders of added folders.
+
+  The paths are also kept in a trie (each path is linked to its children), so
+  that copying or removing a subtree only has to look at that subtree.
   """
   # TODO(iannucci): Expand this to be a full fakey filesystem, including file
   # contents and file types. Coordinate with the `file` module.
   def __init__(self, path_mod, initial_paths):
     self._path_mod = path_mod
     self._initial_paths = set(initial_paths)
+    # The paths in the set.
     self._paths = set()
+    # path -> set(child paths), for every path in the set and their parents.
+    self._children = {}
 
   def _initialize(self):
     self._initialize = lambda: None
@@ -81,28 +96,74 @@ class path_set(object):
     self._initial_paths = None
     self.contains = lambda path: path in self._paths
 
+  def _link(self, path, add_parents):
+    """Adds |path| to the set, and links it into the trie.
+
+    Its parents are only added to the set if add_parents is True.
+    """
+    child = None
+    while True:
+      children = self._children.get(path)
+      known = children is not None
+      if not known:
+        children = self._children[path] = set()
+      if child is not None:
+        children.add(child)
+      if child is None or add_parents:
+        self._paths.add(path)
+      elif known:
+        # The rest of the parents are linked already.
+        return
+      parent = self._path_mod.dirname(path)
+      if parent == path:
+        return
+      path, child = parent, path
+
+  def _subtree(self, path):
+    """Returns |path| and all the paths below it in the trie, parents first."""
+    ret = []
+    todo = [path]
+    while todo:
+      path = todo.pop()
+      ret.append(path)
+      todo.extend(self._children[path])
+    return ret
+
   def add(self, path):
     path = str(path)
     self._initialize()
-    prev_path = None
-    while path != prev_path:
-      self._paths.add(path)
-      prev_path, path = path, self._path_mod.dirname(path)
+    self._link(path, True)
 
   def copy(self, source, dest):
     source, dest = str(source), str(dest)
     self._initialize()
-    to_add = set()
-    for p in self._paths:
-      if p.startswith(source):
-        to_add.add(p.replace(source, dest))
-    self._paths |= to_add
+    if source not in self._children:
+      return
+    to_add = [dest + p[len(source):] for p in self._subtree(source)
+              if p in self._paths]
+    for p in to_add:
+      self._link(p, False)
 
   def remove(self, path, filt):
     path = str(path)
     self._initialize()
-    kill_set = set(p for p in self._paths if p.startswith(path) and filt(p))
-    self._paths -= kill_set
+    top = path
+    if top not in self._children:
+      # A path ending with a separator means "everything under that directory".
+      if self._path_mod.basename(path):
+        return
+      top = self._path_mod.dirname(path)
+      if top not in self._children:
+        return
+    for p in reversed(self._subtree(top)):
+      if p.startswith(path) and filt(p):
+        self._paths.discard(p)
+      if p not in self._paths and not self._children[p]:
+        # Prune the parts of the trie which don't lead to any path.
+        del self._children[p]
+        parent = self._path_mod.dirname(p)
+        if parent != p:
+          self._children[parent].discard(p)
 
   def contains(self, path):
     self._initialize()
@@ -413,18 +474,20 @@ class PathApi(recipe_api.RecipeApi):
     if ap != abs_string_path:
       raise ValueError("path is not absolute: %r v %r" % (abs_string_path, ap))
 
-    # try module/recipe/package resource paths first
+    # module/recipe/package resource paths
     sPath, path = self._paths_client.find_longest_prefix(
         abs_string_path, self.sep)
-    if path is None:
-      # try base paths now
-      for path_name in itertools.chain(self.c.dynamic_paths, self.c.base_paths):
-        path = self[path_name]
-        sPath = str(path)
-        if abs_string_path.startswith(sPath):
-          break
-      else:
-        path = None
+
+    # base paths, which may be nested within the above (e.g. [START_DIR] in a
+    # package checkout) or the other way around.
+    for path_name in itertools.chain(self.c.dynamic_paths, self.c.base_paths):
+      base = self[path_name]
+      sBase = str(base)
+      if sPath is not None and len(sBase) <= len(sPath):
+        continue
+      if (abs_string_path == sBase or
+          abs_string_path.startswith(sBase.rstrip(self.sep) + self.sep)):
+        sPath, path = sBase, base
 
     if path is None:
       raise ValueError("could not figure out a base path for %r" %
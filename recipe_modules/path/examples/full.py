@@ -94,6 +94,13 @@ def RunSteps(api):
   api.path.mock_remove_paths(copy2)
   assert not api.path.exists(copy2)
 
+  # copying or removing paths which don't exist does nothing.
+  api.path.mock_copy_paths(copy2, copy1.join('copy3'))
+  assert not api.path.exists(copy1.join('copy3'))
+  api.path.mock_remove_paths(copy2)
+  api.path.mock_remove_paths(str(copy2.join('foo'))+api.path.sep)
+  assert api.path.exists(copy1.join('foo', 'bar'))
+
   result = api.step('base paths', ['echo'] + [
       api.path[name] for name in sorted(api.path.c.base_paths.keys())
   ])
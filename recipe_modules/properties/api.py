@@ -19,7 +19,6 @@ random-access global variable).
 """
 
 from recipe_engine import recipe_api
-from recipe_engine.types import freeze
 import collections
 
 # Use RecipeApiPlain because collections.Mapping has its own metaclass.
@@ -27,29 +26,26 @@ import collections
 # is any sort of step :).
 class PropertiesApi(recipe_api.RecipeApiPlain, collections.Mapping):
   """PropertiesApi implements all the standard Mapping functions, so you
-  can use it like a read-only dict."""
+  can use it like a read-only dict.
 
-  properties_client = recipe_api.RequireClient('properties')
-
-  def __init__(self, **kwargs):
-    super(PropertiesApi, self).__init__(**kwargs)
-    self._frozen_properties = None
+  The values are frozen (see recipe_engine.types.freeze) one property at a
+  time, when they're first read, so recipes only pay for the properties they
+  use.
+  """
 
-  @property
-  def _properties(self):
-    if self._frozen_properties is None:
-      self._frozen_properties = freeze(
-          self.properties_client.get_properties())
-    return self._frozen_properties
+  properties_client = recipe_api.RequireClient('properties')
 
   def __getitem__(self, key):
-    return self._properties[key]
+    return self.properties_client.get_frozen_property(key)
+
+  def __contains__(self, key):
+    return self.properties_client.has_property(key)
 
   def __len__(self):
-    return len(self._properties)
+    return len(self.properties_client.get_property_names())
 
   def __iter__(self):
-    return iter(self._properties)
+    return iter(self.properties_client.get_property_names())
 
   def legacy(self):  # pragma: no cover
     """DEPRECATED: Returns a set of properties, possibly used by legacy
@@ -75,6 +71,13 @@ class PropertiesApi(recipe_api.RecipeApiPlain, collections.Mapping):
       props['slavename'] = props['bot_id']
     return props
 
-  def thaw(self):
-    """Returns a read-write copy of all of the properties."""
-    return self.properties_client.get_properties()
+  def thaw(self, key=None):
+    """Returns a read-write copy of all of the properties, or of the value of
+    the property |key|.
+
+    Prefer thawing just the properties you need to modify; large properties
+    are expensive to copy.
+    """
+    if key is None:
+      return self.properties_client.get_properties()
+    return self.properties_client.get_property(key)
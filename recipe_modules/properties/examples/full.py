@@ -25,9 +25,18 @@ def RunSteps(api, test_prop, param_name_test, from_env):
 
   # It should behave like a real dictionary.
   assert len(properties) == len(api.properties)
+  assert 'test_prop' in api.properties
+  assert 'missing' not in api.properties
   for k in api.properties:
     api.step('echo %s' % k, ['echo', repr(api.properties[k])])
 
+  # Thawed copies can be modified without affecting the properties.
+  test_prop = api.properties.thaw('test_prop')
+  if test_prop is not None:
+    test_prop['key'] = 'modified'
+    assert api.properties['test_prop']['key'] != 'modified'
+    assert properties['test_prop']['key'] != 'modified'
+
 
 def GenTests(api):
   pd = {'foo.bar-bam': 'thing', 'from_env': 'mocked_env'}
@@ -0,0 +1,79 @@
+#!/usr/bin/env vpython
+# Copyright 2019 The LUCI Authors. All rights reserved.
+# Use of this source code is governed under the Apache License, Version 2.0
+# that can be found in the LICENSE file.
+
+import marshal
+import os
+import subprocess
+import sys
+import unittest
+
+import repo_test_util
+
+import mock
+
+from recipe_engine import loader
+
+
+class TestBundle(repo_test_util.RepoTest):
+  def setUp(self):
+    super(TestBundle, self).setUp()
+    self.repo = self.repo_setup({'a': []})['a']
+    self.update_recipe_module(self.repo, 'a_module', {'foo': ['bar']})
+    self.update_recipe(
+        self.repo, 'a_recipe', ['a_module'], [('a_module', 'foo')])
+
+  def _bundle(self, *args):
+    destination = os.path.join(self._root_dir, 'bundle')
+    subprocess.check_output([
+      sys.executable, self._recipe_tool,
+      '--package', os.path.join(
+        self.repo['root'], 'infra', 'config', 'recipes.cfg'),
+      'bundle', '--destination', destination,
+    ] + list(args), stderr=subprocess.STDOUT)
+    return destination
+
+  def test_precompile(self):
+    destination = self._bundle('--precompile')
+    recipe = os.path.join(destination, 'a', 'recipes', 'a_recipe.py')
+    self.assertTrue(os.path.isfile(recipe + 'c'))
+    self.assertTrue(os.path.isfile(os.path.join(
+      destination, 'recipe_engine', 'recipe_engine', 'loader.pyc')))
+
+    with mock.patch('recipe_engine.loader.marshal.loads',
+                    side_effect=marshal.loads) as loads:
+      code = loader._compile_recipe_script(recipe)
+    self.assertTrue(loads.called)
+    self.assertEqual(code.co_filename, recipe)
+
+    # Unpacking a bundle without preserving mtimes makes the bytecode stale.
+    os.utime(recipe, (1000, 1000))
+    with mock.patch('recipe_engine.loader.marshal.loads',
+                    side_effect=marshal.loads) as loads:
+      loader._compile_recipe_script(recipe)
+    self.assertFalse(loads.called)
+
+  def test_excludes_expectations(self):
+    with repo_test_util.in_directory(self.repo['root']):
+      subprocess.check_output([
+        sys.executable, self._recipe_tool,
+        '--package', os.path.join('infra', 'config', 'recipes.cfg'),
+        'test', 'train', '--compress-expectations',
+      ], stderr=subprocess.STDOUT)
+      subprocess.check_call(['git', 'add', '-A', 'recipes', 'recipe_modules'])
+      subprocess.check_call(['git', 'commit', '-q', '-m', 'compress'])
+      self.assertTrue(os.path.isfile(os.path.join(
+        'recipes', 'a_recipe.expected', 'basic.json.gz')))
+
+    destination = self._bundle()
+    recipe_dir = os.path.join(destination, 'a', 'recipes')
+    self.assertTrue(os.path.isfile(os.path.join(recipe_dir, 'a_recipe.py')))
+    self.assertFalse(os.path.exists(os.path.join(
+      recipe_dir, 'a_recipe.expected')))
+    for _root, _dirs, files in os.walk(os.path.join(destination, 'a')):
+      self.assertFalse([f for f in files if f.endswith(('.json', '.json.gz'))])
+
+
+if __name__ == '__main__':
+  sys.exit(unittest.main())
@@ -7,8 +7,10 @@ import copy
 import doctest
 import logging
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
 import unittest
 
 import repo_test_util
@@ -199,6 +201,163 @@ class TestPackageDeps(MockIOThings, unittest.TestCase):
       self.assertFalse(checkout.called)
 
 
+class TestCheckoutStamp(repo_test_util.RepoTest):
+  def setUp(self):
+    super(TestCheckoutStamp, self).setUp()
+    repos = self.repo_setup({'a': [], 'b': ['a']})
+    self.b_root = repos['b']['root']
+    self.package_file = package_io.PackageFile(
+      os.path.join(self.b_root, IRC))
+    self.b_context = package.PackageContext.from_package_pb(
+      self.b_root, self.package_file.read())
+    self.checkout_dir = os.path.join(self.b_context.package_dir, 'a')
+
+  def _create(self):
+    # Make sure that nothing leaks between invocations through the in-memory
+    # metadata cache.
+    fetch.Backend._GIT_METADATA_CACHE.clear()
+    return package.PackageDeps.create(self.b_context, self.package_file, {})
+
+  def test_skips_git_when_fresh(self):
+    deps = self._create()
+    self.assertTrue(os.path.isdir(self.checkout_dir))
+    self.assertTrue(os.path.isfile(os.path.join(
+      self.b_context.package_dir, package.CheckoutStamp.FILENAME)))
+    spec = deps.get_package('a').repo_spec.spec_pb()
+
+    with mock.patch('recipe_engine.fetch.GitBackend._execute') as execute:
+      deps = self._create()
+      self.assertEqual(deps.get_package('a').repo_spec.spec_pb(), spec)
+      self.assertFalse(execute.called)
+
+  def test_modified_checkout(self):
+    self._create()
+    with open(os.path.join(self.checkout_dir, 'some_file'), 'a') as f:
+      print >> f, 'local modification'
+
+    self._create()
+    with open(os.path.join(self.checkout_dir, 'some_file')) as f:
+      self.assertNotIn('local modification', f.read())
+
+    with mock.patch('recipe_engine.fetch.GitBackend._execute') as execute:
+      self._create()
+      self.assertFalse(execute.called)
+
+  def test_recipes_cfg_change(self):
+    self._create()
+    with open(self.package_file.path, 'a') as f:
+      f.write('\n')
+
+    with mock.patch('recipe_engine.fetch.GitBackend._execute',
+                    side_effect=fetch.GitBackend._execute,
+                    autospec=True) as execute:
+      self._create()
+      self.assertTrue(execute.called)
+
+
+class TestDepsSnapshot(repo_test_util.RepoTest):
+  def setUp(self):
+    super(TestDepsSnapshot, self).setUp()
+    repos = self.repo_setup({'a': [], 'b': ['a']})
+    self.b_root = repos['b']['root']
+    self.package_file = package_io.PackageFile(
+      os.path.join(self.b_root, IRC))
+    self.b_context = package.PackageContext.from_package_pb(
+      self.b_root, self.package_file.read())
+    self.snapshot_path = os.path.join(
+      self.b_context.package_dir, package.DepsSnapshot.FILENAME)
+
+  def _create(self):
+    fetch.Backend._GIT_METADATA_CACHE.clear()
+    return package.PackageDeps.create(self.b_context, self.package_file, {})
+
+  def _create_parses(self):
+    """Returns (PackageDeps, whether any recipes.cfg was parsed)."""
+    with mock.patch('recipe_engine.package.PackageSpec.from_package_pb',
+                    side_effect=package.PackageSpec.from_package_pb) as parse:
+      deps = self._create()
+    return deps, parse.called
+
+  def test_reused(self):
+    deps = self._create()
+    self.assertTrue(os.path.isfile(self.snapshot_path))
+
+    with mock.patch('recipe_engine.fetch.GitBackend._execute') as execute:
+      cached, parsed = self._create_parses()
+      self.assertFalse(parsed)
+      self.assertFalse(execute.called)
+      self.assertEqual(
+          cached.get_package('a').repo_spec.spec_pb(),
+          deps.get_package('a').repo_spec.spec_pb())
+
+    def describe(deps):
+      return sorted(
+        (p.name, p.repo_spec, p.repo_root, p.relative_recipes_dir,
+         sorted(p.deps)) for p in deps.packages)
+    self.assertEqual(describe(cached), describe(deps))
+    self.assertEqual(cached.root_package.name, deps.root_package.name)
+    self.assertIs(cached.root_package.find_dep('a'), cached.get_package('a'))
+    for p in cached.packages:
+      self.assertIsInstance(p.repo_root, str)
+
+  def test_modified_checkout(self):
+    self._create()
+    checkout_dir = os.path.join(self.b_context.package_dir, 'a')
+    with open(os.path.join(checkout_dir, 'some_file'), 'a') as f:
+      print >> f, 'local modification'
+
+    _, parsed = self._create_parses()
+    self.assertTrue(parsed)
+    _, parsed = self._create_parses()
+    self.assertFalse(parsed)
+
+  def test_recipes_cfg_change(self):
+    self._create()
+    with open(self.package_file.path, 'a') as f:
+      f.write('\n')
+
+    _, parsed = self._create_parses()
+    self.assertTrue(parsed)
+
+  def test_corrupt_snapshot(self):
+    self._create()
+    with open(self.snapshot_path, 'w') as f:
+      f.write('{"version": 1, "key": null')
+
+    deps, parsed = self._create_parses()
+    self.assertTrue(parsed)
+    self.assertEqual(deps.root_package.name, 'b')
+
+
+class TestCleanupPyc(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def _touch(self, name, mtime):
+    path = os.path.join(self.tmpdir, name)
+    with open(path, 'w'):
+      pass
+    os.utime(path, (mtime, mtime))
+    return path
+
+  def test_keeps_fresh_pyc(self):
+    self._touch('fresh.py', 1000)
+    fresh = self._touch('fresh.pyc', 2000)
+    package.cleanup_pyc(self.tmpdir)
+    self.assertTrue(os.path.exists(fresh))
+
+  def test_removes_stale_pyc(self):
+    self._touch('stale.py', 1000.5)
+    stale = self._touch('stale.pyc', 1000.25)
+    orphan = self._touch('orphan.pyc', 2000)
+    package.cleanup_pyc(self.tmpdir)
+    self.assertFalse(os.path.exists(stale))
+    self.assertFalse(os.path.exists(orphan))
+
+
 def load_tests(_loader, tests, _ignore):
   tests.addTests(doctest.DocTestSuite(package))
   return tests
@@ -3,6 +3,7 @@
 # Use of this source code is governed under the Apache License, Version 2.0
 # that can be found in the LICENSE file.
 
+import gzip
 import json
 import os
 import shutil
@@ -338,6 +339,82 @@ class TestTest(unittest.TestCase):
     self._run_recipes('test', 'run', '--json', self.json_path)
     self.assertEqual(self.json_generator.get(), self.json_contents)
 
+  def test_test_remote_worker(self):
+    rw = RecipeWriter(os.path.join(self._root_dir, 'recipes'), 'foo')
+    rw.RunStepsLines = ['pass']
+    rw.add_expectation('basic')
+    rw.write()
+    env = dict(os.environ, RECIPES_TEST_AUTHKEY='secret')
+    worker = subprocess.Popen((
+        sys.executable, self._recipe_tool, '--package', self._recipes_cfg,
+        'test', 'worker', '--listen', '127.0.0.1:0', '--once',
+    ), stdout=subprocess.PIPE, env=env)
+    try:
+      line = worker.stdout.readline()
+      self.assertTrue(line.startswith('Listening on '), line)
+      subprocess.check_output((
+          sys.executable, self._recipe_tool, '--package', self._recipes_cfg,
+          'test', 'run', '--jobs', '0', '--json', self.json_path,
+          '--remote-worker', line[len('Listening on '):].strip(),
+      ), stderr=subprocess.STDOUT, env=env)
+      self.assertEqual(self.json_generator.get(), self.json_contents)
+      worker.communicate()
+      self.assertEqual(worker.returncode, 0)
+    finally:
+      if worker.returncode is None:
+        worker.kill()
+        worker.wait()
+
+  def test_test_failed_first(self):
+    for name in ('a', 'b', 'c'):
+      rw = RecipeWriter(os.path.join(self._root_dir, 'recipes'), name)
+      rw.RunStepsLines = ['pass']
+      if name != 'b':
+        rw.add_expectation('basic')
+      rw.write()
+    state_path = os.path.join(
+        self._root_dir, '.recipe_deps', 'last_test_failures.json')
+
+    with self.assertRaises(subprocess.CalledProcessError) as cm:
+      self._run_recipes('test', 'run', '--jobs', '1')
+    self.assertIn('b.basic failed', cm.exception.output)
+    with open(state_path) as f:
+      self.assertEqual(['b.basic'], json.load(f))
+
+    with self.assertRaises(subprocess.CalledProcessError) as cm:
+      self._run_recipes(
+          'test', 'run', '--jobs', '1', '--failed-first', '--fail-fast', '1')
+    self.assertIn('b.basic failed', cm.exception.output)
+    self.assertIn('skipped 2 tests after 1 failures', cm.exception.output)
+    self.assertIn('not checking coverage', cm.exception.output)
+
+    rw = RecipeWriter(os.path.join(self._root_dir, 'recipes'), 'b')
+    rw.add_expectation('basic')
+    rw.write()
+    self._run_recipes('test', 'run', '--failed-first')
+    with open(state_path) as f:
+      self.assertEqual([], json.load(f))
+
+  def test_debug_saves_failures(self):
+    rw = RecipeWriter(os.path.join(self._root_dir, 'recipes'), 'foo')
+    rw.RunStepsLines = ['pass']
+    rw.add_expectation('basic')
+    rw.write()
+    state_path = os.path.join(
+        self._root_dir, '.recipe_deps', 'last_test_failures.json')
+    os.makedirs(os.path.dirname(state_path))
+    with open(state_path, 'w') as f:
+      json.dump(['foo.basic'], f)
+
+    proc = subprocess.Popen((
+        sys.executable, self._recipe_tool, '--package', self._recipes_cfg,
+        'test', 'debug', '--filter', 'foo.basic',
+    ), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output, _ = proc.communicate('c\n' * 10)
+    self.assertEqual(proc.returncode, 0, output)
+    with open(state_path) as f:
+      self.assertEqual([], json.load(f))
+
   def test_test_expectation_failure_empty(self):
     rw = RecipeWriter(os.path.join(self._root_dir, 'recipes'), 'foo')
     rw.RunStepsLines = ['pass']
@@ -758,6 +835,53 @@ class TestTest(unittest.TestCase):
         expect_contents)
     self.assertEqual(self.json_generator.get(), self.json_contents)
 
+  def test_train_compressed(self):
+    rw = RecipeWriter(os.path.join(self._root_dir, 'recipes'), 'foo')
+    rw.DEPS = ['recipe_engine/step']
+    rw.RunStepsLines = ['api.step("test", ["echo", "bar"])']
+    rw.add_expectation('basic')
+    rw.write()
+    plain_path = os.path.join(rw.expect_dir, 'basic.json')
+    compressed_path = plain_path + '.gz'
+
+    # Convert the stale expectation to a compressed one.
+    self._run_recipes('test', 'train', '--compress-expectations')
+    self.assertFalse(os.path.exists(plain_path))
+    with open(compressed_path, 'rb') as f:
+      compressed = f.read()
+    with gzip.open(compressed_path) as f:
+      self.assertEqual(
+          '[{"cmd":["echo","bar"],"name":"test"},'
+          '{"jsonResult":null,"name":"$result"}]', f.read())
+    self._run_recipes('test', 'run', '--json', self.json_path)
+    self.assertEqual(self.json_generator.get(), self.json_contents)
+
+    # Compressed expectations stay compressed, and show readable diffs.
+    rw.RunStepsLines = ['api.step("test", ["echo", "baz"])']
+    rw.write()
+    with self.assertRaises(subprocess.CalledProcessError) as cm:
+      self._run_recipes('test', 'run')
+    self.assertIn('-      "bar"\n+      "baz"', cm.exception.output)
+    self._run_recipes('test', 'train')
+    self.assertFalse(os.path.exists(plain_path))
+    self._run_recipes('test', 'run')
+
+    # Training the same expectation again produces the same bytes.
+    rw.RunStepsLines = ['api.step("test", ["echo", "bar"])']
+    rw.write()
+    self._run_recipes('test', 'train')
+    with open(compressed_path, 'rb') as f:
+      self.assertEqual(compressed, f.read())
+
+    # And they can be converted back.
+    self._run_recipes('test', 'train', '--no-compress-expectations')
+    self.assertFalse(os.path.exists(compressed_path))
+    with open(plain_path) as f:
+      self.assertEqual(
+          [{u'cmd': [u'echo', u'bar'], u'name': u'test'},
+           {u'jsonResult': None, u'name': u'$result'}],
+          json.load(f))
+
   def test_train_invalid_json(self):
     # 1. Initial state: recipe expectations are passing.
     rw = RecipeWriter(os.path.join(self._root_dir, 'recipes'), 'foo')